@@ -0,0 +1,163 @@
+# Circuit breakers: stop calling a model backend while it is failing or too slow
+import threading
+import time
+from collections import deque
+
+from .config import (
+    BREAKER_ENABLED, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATIO, BREAKER_SLOW_RATIO,
+    BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_CALLS, logger
+)
+from .metrics import counter, gauge
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = gauge("circuit_breaker_state", "Breaker state per backend (0 closed, 1 half-open, 2 open)", ("backend",))
+breaker_transitions = counter("circuit_breaker_transitions_total", "Breaker state changes", ("backend", "state"))
+breaker_rejected = counter("circuit_breaker_rejected_total", "Calls failed fast by an open breaker", ("backend",))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose breaker is open"""
+
+    def __init__(self, backend: str, retry_in: float):
+        self.backend = backend
+        self.retry_in = retry_in
+        super().__init__(f"{backend} circuit open, retrying in {retry_in:.0f}s")
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through, and failures and slow calls (that used
+    `slow_ratio` of their own timeout) are counted over the last `window`
+    seconds. Once at least `min_calls` were made and `failure_ratio` of
+    them went bad, it opens.
+
+    Open: calls fail fast with CircuitOpenError for `open_seconds`.
+
+    Half-open: up to `half_open_calls` trial calls go through. If they all
+    succeed, it closes again; any failure reopens it.
+    """
+
+    def __init__(self, name: str, window: float = 60, min_calls: int = 5, failure_ratio: float = 0.5,
+                 slow_ratio: float = 0.8, open_seconds: float = 30, half_open_calls: int = 1, enabled: bool = True):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_ratio = slow_ratio
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._calls = deque()  # (monotonic time, failed) within the window
+        self._trials = 0  # Half-open calls started
+        self._trial_successes = 0
+        breaker_state.set(0, backend=name)
+
+    def _transition(self, state: str, reason: str = ""):
+        """Change state; caller holds the lock"""
+        if state == self._state:
+            return
+        self._state = state
+        self._calls.clear()
+        self._trials = self._trial_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        breaker_state.set(_STATE_VALUES[state], backend=self.name)
+        breaker_transitions.inc(backend=self.name, state=state)
+        if state == OPEN:
+            logger.warning(f"🔌 {self.name} circuit opened{f' ({reason})' if reason else ''}")
+        else:
+            logger.info(f"🔌 {self.name} circuit {state.replace('_', '-')}")
+
+    @property
+    def state(self) -> str:
+        """Current state; an open breaker turns half-open once `open_seconds` have passed"""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            return self._state
+
+    def is_open(self) -> bool:
+        """Whether calls would be failed fast right now (for skipping optional stages)"""
+        return self.enabled and self.state == OPEN
+
+    def before_call(self):
+        """
+        Admit a call or fail fast.
+
+        Raises:
+            CircuitOpenError: while open, or when all half-open trials are taken
+        """
+        if not self.enabled:
+            return
+        state = self.state
+        with self._lock:
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return
+            if state == CLOSED:
+                return
+            retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+        breaker_rejected.inc(backend=self.name)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self, latency: float, timeout: float):
+        """A call returned within `timeout`; one close to it counts as a failure"""
+        if latency > self.slow_ratio * timeout:
+            self.record_failure(f"{latency:.1f}s of {timeout:.0f}s timeout")
+            return
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            elif self._state == CLOSED:
+                self._add(False)
+
+    def record_failure(self, reason: str = ""):
+        """
+        A call errored or timed out. Every admitted call must end in
+        record_success or record_failure, or a half-open trial stays taken.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN, f"trial failed: {reason}" if reason else "trial failed")
+            elif self._state == CLOSED:
+                self._add(True)
+                failures = sum(failed for _, failed in self._calls)
+                if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_ratio:
+                    self._transition(OPEN, f"{failures}/{len(self._calls)} calls failed, last: {reason}")
+
+    def _add(self, failed: bool):
+        now = time.monotonic()
+        self._calls.append((now, failed))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(backend: str) -> CircuitBreaker:
+    """The shared breaker for a backend (gemini, medgemma, translation, transcription, ...)"""
+    with _breakers_lock:
+        if backend not in _breakers:
+            _breakers[backend] = CircuitBreaker(
+                backend, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATIO, BREAKER_SLOW_RATIO,
+                BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_CALLS, BREAKER_ENABLED
+            )
+        return _breakers[backend]
+
+
+def all_breakers() -> list:
+    with _breakers_lock:
+        return list(_breakers.values())
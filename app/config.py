@@ -17,15 +17,85 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 ENDPOINT_ID = os.getenv("ENDPOINT_ID")
 DEDICATED_ENDPOINT_DNS = os.getenv("DEDICATED_ENDPOINT_DNS")
+MEDGEMMA_API_BASE = os.getenv("MEDGEMMA_API_BASE") or f"https://{DEDICATED_ENDPOINT_DNS}"  # Override for local stubs
+MEDGEMMA_ACCESS_TOKEN = os.getenv("MEDGEMMA_ACCESS_TOKEN")  # Static bearer token instead of Google credentials
+MEDGEMMA_BATCH_WINDOW_MS = float(os.getenv("MEDGEMMA_BATCH_WINDOW_MS", "5"))  # Wait to batch concurrent calls (0 = off)
+MEDGEMMA_BATCH_SIZE = int(os.getenv("MEDGEMMA_BATCH_SIZE", "8"))  # Max instances per :predict call
+MEDGEMMA_MAX_IN_FLIGHT = int(os.getenv("MEDGEMMA_MAX_IN_FLIGHT", "4"))  # Batched calls outstanding at once
 
 # Telegram Configuration
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org/bot")  # Override for local stubs
+TELEGRAM_FILE_BASE = os.getenv("TELEGRAM_FILE_BASE", "https://api.telegram.org/file/bot")
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i.strip()}  # May see live /stats
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # Requests/second across all chats
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # Messages/second per private chat
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))  # Short bursts allowed per chat
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))  # Messages/minute per group chat
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))  # Retries after RetryAfter
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))  # Updates handled at once; each chat stays in order
+IO_WORKERS = int(os.getenv("IO_WORKERS", "0"))  # Threads for blocking model calls (0 = CONCURRENT_UPDATES + 4)
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))  # Threads for short SQLite calls, apart from the model calls
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))  # Seconds in-flight updates get to finish on shutdown
+THINKING_DELAY = float(os.getenv("THINKING_DELAY", "1.5"))  # Seconds before the "thinking" message appears (0 = always)
 
 # Database Configuration
 DATABASE_FILE = os.getenv("DATABASE_FILE", "bot_data.db")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")  # sqlite, or sharded (one SQLite file per shard)
+STORAGE_SHARDS = int(os.getenv("STORAGE_SHARDS", "4"))  # Shard count for sharded storage; fixed once data exists
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))  # Seconds to wait for a locked database
 
-# Gemini Configuration (for follow-up suggestions)
+# Durable job queue: pipelines checkpoint stage results and resume after a restart
+JOB_QUEUE = os.getenv("JOB_QUEUE", "true").lower() == "true"
+JOB_LEASE = int(os.getenv("JOB_LEASE", "600"))  # Seconds a worker owns a job before others may resume it
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Tries per update before it is marked failed
+JOB_RESUME_WINDOW = int(os.getenv("JOB_RESUME_WINDOW", "3600"))  # Older unfinished jobs are not answered any more
+JOB_SWEEP_INTERVAL = int(os.getenv("JOB_SWEEP_INTERVAL", "60"))  # Seconds between scans for abandoned jobs
+
+# Circuit breakers per model backend (gemini answers, medgemma, translation, transcription, suggestions)
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60"))  # Seconds of calls the failure ratio is computed over
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))  # Calls in the window before a breaker may open
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))  # Share of failed/slow calls that opens it
+BREAKER_SLOW_RATIO = float(os.getenv("BREAKER_SLOW_RATIO", "0.8"))  # Calls using this share of their timeout count as failed
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # Fail fast this long before trying again
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))  # Trial calls that must succeed to close
+
+# CPU worker pool for base64 encoding and other CPU-bound stages
+CPU_POOL = os.getenv("CPU_POOL", "thread")  # thread, process (uses more cores), or inline (on the event loop)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0"))  # Worker count (0 = one per CPU core)
+CPU_QUEUE_SIZE = int(os.getenv("CPU_QUEUE_SIZE", "16"))  # Tasks queued beyond the workers before callers wait
+
+# Answer model: gemini, or medgemma (the Vertex AI endpoint above; needs requirements-medgemma.txt)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+# Gemini Configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "true").lower() == "true"  # Cache system prompts server-side
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))  # Seconds
+
+# Suggestion Configuration
+SUGGESTIONS_STRUCTURED_OUTPUT = os.getenv("SUGGESTIONS_STRUCTURED_OUTPUT", "true").lower() == "true"  # responseSchema JSON
+SUGGESTION_MAX_TOKENS = int(os.getenv("SUGGESTION_MAX_TOKENS", "160"))  # Output cap in structured mode
+COMBINED_SUGGESTIONS = os.getenv("COMBINED_SUGGESTIONS", "false").lower() == "true"  # Suggestions come with the answer
+
+# Speculative answers for suggestion buttons
+SPECULATIVE_ANSWERS = os.getenv("SPECULATIVE_ANSWERS", "false").lower() == "true"
+SPECULATION_TTL = int(os.getenv("SPECULATION_TTL", "600"))  # Seconds a precomputed answer stays valid
+SPECULATION_HOURLY_BUDGET = int(os.getenv("SPECULATION_HOURLY_BUDGET", "100"))  # Speculative answers per hour
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", "2"))  # Speculative answers computed at once
 
 # Memory Configuration
 MAX_MEMORY_MESSAGES = 14  # Number of messages to keep in short-term memory
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))  # Tokens of history sent per request
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "512"))  # Max size of the rolling summary
+
+# Cache Configuration
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "512"))  # Voice transcripts kept by file_unique_id
+
+# Observability Configuration
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Serve Prometheus /metrics on this port (0 = off)
+TRACE_FILE = os.getenv("TRACE_FILE")  # Append per-update traces as JSON lines for offline analysis
+USAGE_FLUSH_INTERVAL = int(os.getenv("USAGE_FLUSH_INTERVAL", "30"))  # Seconds between token usage rollup writes
@@ -1,192 +1,129 @@
-import sqlite3
+# Storage API used by the bot; calls go to the backend chosen by STORAGE_BACKEND
 from typing import Optional
-from .config import DATABASE_FILE, MAX_MEMORY_MESSAGES, logger
+from .config import DATABASE_FILE, STORAGE_BACKEND, STORAGE_SHARDS, logger
+from .storage import create_storage
 
-
-def get_connection():
-    """Get database connection"""
-    return sqlite3.connect(DATABASE_FILE)
+storage = create_storage(STORAGE_BACKEND, DATABASE_FILE, STORAGE_SHARDS)
 
 
 def init_database():
     """Initialize the database tables"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            language TEXT,
-            first_name TEXT,
-            username TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Messages table for conversation memory
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            role TEXT,
-            content TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-
-    # Create index for faster queries
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_messages_user_id
-        ON messages (user_id, created_at DESC)
-    ''')
-
-    # Suggestions table for storing button suggestions temporarily
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS suggestions (
-            suggestion_id TEXT PRIMARY KEY,
-            text TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-    logger.info("✅ Database initialized")
+    storage.init_schema()
+    logger.info(f"✅ Database initialized ({STORAGE_BACKEND}, {len(storage.files())} file(s))")
+
+
+def database_files() -> list:
+    """Files holding the data, e.g. for size reporting"""
+    return storage.files()
 
 
 # ==================== USER FUNCTIONS ====================
 
 def get_user_language(user_id: int) -> Optional[str]:
     """Get user's selected language"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    return storage.get_user_language(user_id)
 
 
 def set_user_language(user_id: int, language: str, first_name: str = None, username: str = None):
     """Set or update user's language preference"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        INSERT INTO users (user_id, language, first_name, username)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            language = excluded.language,
-            first_name = COALESCE(excluded.first_name, users.first_name),
-            username = COALESCE(excluded.username, users.username)
-    ''', (user_id, language, first_name, username))
-
-    conn.commit()
-    conn.close()
-    logger.info(f"👤 User {user_id} language set to: {language}")
+    storage.set_user_language(user_id, language, first_name, username)
 
 
 def user_exists(user_id: int) -> bool:
     """Check if user exists in database"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return storage.user_exists(user_id)
 
 
 # ==================== MEMORY FUNCTIONS ====================
 
 def add_message(user_id: int, role: str, content: str):
     """Add a message to conversation history"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Insert new message
-    cursor.execute('''
-        INSERT INTO messages (user_id, role, content)
-        VALUES (?, ?, ?)
-    ''', (user_id, role, content))
-
-    # Clean up old messages (keep only last MAX_MEMORY_MESSAGES * 2 to have buffer)
-    cursor.execute('''
-        DELETE FROM messages
-        WHERE user_id = ? AND id NOT IN (
-            SELECT id FROM messages
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-        )
-    ''', (user_id, user_id, MAX_MEMORY_MESSAGES * 2))
-
-    conn.commit()
-    conn.close()
+    storage.add_message(user_id, role, content)
 
 
 def get_conversation_history(user_id: int, limit: int = None) -> list:
     """Get recent conversation history for a user"""
-    if limit is None:
-        limit = MAX_MEMORY_MESSAGES
+    return storage.get_conversation_history(user_id, limit)
+
+
+def get_messages_since(user_id: int, after_id: int = 0, limit: int = None) -> list:
+    """Get the newest messages with id > after_id, oldest first, including their ids"""
+    return storage.get_messages_since(user_id, after_id, limit)
 
-    conn = get_connection()
-    cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT role, content FROM (
-            SELECT role, content, created_at
-            FROM messages
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-        ) ORDER BY created_at ASC
-    ''', (user_id, limit))
+def get_history_summary(user_id: int) -> tuple:
+    """Get (summary, last_message_id) for a user, or ("", 0) if none"""
+    return storage.get_history_summary(user_id)
 
-    messages = [{"role": row[0], "content": row[1]} for row in cursor.fetchall()]
-    conn.close()
 
-    return messages
+def set_history_summary(user_id: int, summary: str, last_message_id: int):
+    """Store the rolling summary covering messages up to last_message_id"""
+    storage.set_history_summary(user_id, summary, last_message_id)
 
 
 def clear_user_history(user_id: int):
     """Clear conversation history for a user"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-    logger.info(f"🗑️ Cleared history for user {user_id}")
+    storage.clear_user_history(user_id)
 
 
 # ==================== SUGGESTION FUNCTIONS ====================
 
 def store_suggestion(suggestion_id: str, text: str):
     """Store a suggestion text for later retrieval"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    storage.store_suggestion(suggestion_id, text)
 
-    # Insert or replace suggestion
-    cursor.execute('''
-        INSERT OR REPLACE INTO suggestions (suggestion_id, text)
-        VALUES (?, ?)
-    ''', (suggestion_id, text))
 
-    # Clean up old suggestions (older than 24 hours)
-    cursor.execute('''
-        DELETE FROM suggestions
-        WHERE created_at < datetime('now', '-24 hours')
-    ''')
+def get_suggestion(suggestion_id: str) -> Optional[str]:
+    """Get suggestion text by ID"""
+    return storage.get_suggestion(suggestion_id)
 
-    conn.commit()
-    conn.close()
 
+# ==================== USAGE FUNCTIONS ====================
 
-def get_suggestion(suggestion_id: str) -> Optional[str]:
-    """Get suggestion text by ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT text FROM suggestions WHERE suggestion_id = ?', (suggestion_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+def add_token_usage(rows: list):
+    """
+    Add aggregated usage to the rollups.
+
+    Args:
+        rows: [(day, user_id, language, stage, calls, prompt_tokens,
+                output_tokens, cached_tokens, total_tokens, latency_ms, cost_usd)]
+    """
+    storage.add_token_usage(rows)
+
+
+def get_token_usage_by_stage(days: int = 1) -> list:
+    """Token totals per stage over the last `days` days, biggest spender first"""
+    return storage.get_token_usage_by_stage(days)
+
+
+# ==================== JOB FUNCTIONS ====================
+
+def claim_job(update_id: int, user_id: int, payload: str, now: float, lease_until: float,
+              max_attempts: int) -> Optional[tuple]:
+    """Lease a new or abandoned job; (partial JSON, attempts), or None if not claimable"""
+    return storage.claim_job(update_id, user_id, payload, now, lease_until, max_attempts)
+
+
+def record_job(update_id: int, user_id: int, payload: str, now: float):
+    """Store an update as a pending job without starting it"""
+    storage.record_job(update_id, user_id, payload, now)
+
+
+def save_job(user_id: int, update_id: int, partial: str, now: float, lease_until: float):
+    """Store a job's stage results and extend its lease"""
+    storage.save_job(user_id, update_id, partial, now, lease_until)
+
+
+def finish_job(user_id: int, update_id: int, state: str, now: float):
+    """Mark a job done or failed"""
+    storage.finish_job(user_id, update_id, state, now)
+
+
+def release_job(user_id: int, update_id: int):
+    """Drop a job's lease so it can be resumed right away"""
+    storage.release_job(user_id, update_id)
+
+
+def get_resumable_jobs(now: float, created_after: float, max_attempts: int, limit: int = 100) -> list:
+    """Update payloads of abandoned pending jobs, oldest first"""
+    return storage.get_resumable_jobs(now, created_after, max_attempts, limit)
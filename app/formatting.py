@@ -0,0 +1,213 @@
+# Telegram Markdown helpers
+import re
+
+TELEGRAM_CHUNK_LIMIT = 4000  # Telegram caps messages at 4096 characters
+
+# Room for the closing/reopening markers added when an entity spans chunks
+_ENTITY_RESERVE = 16
+
+# Preferred split points, from section/paragraph down to word boundaries
+_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def _open_entities(text: str) -> list:
+    """
+    Scan Telegram (legacy) Markdown and return the entity markers still open
+    at the end of the text: "```", "`", "*", "_" or "[".
+    Inside code spans and pre blocks every other marker is literal.
+    """
+    stack = []
+    i = 0
+    n = len(text)
+    while i < n:
+        top = stack[-1] if stack else None
+        if top == "```":
+            if text.startswith("```", i):
+                stack.pop()
+                i += 3
+            else:
+                i += 1
+            continue
+        if top == "`":
+            if text[i] == "`":
+                stack.pop()
+            i += 1
+            continue
+
+        ch = text[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if text.startswith("```", i):
+            stack.append("```")
+            i += 3
+            continue
+        if ch == "`":
+            stack.append("`")
+        elif ch in "*_":
+            if top == ch:
+                stack.pop()
+            elif top is None:
+                stack.append(ch)
+        elif ch == "[" and top is None:
+            stack.append("[")
+        elif ch == "]" and top == "[":
+            stack.pop()
+        i += 1
+    return stack
+
+
+def _closing(markers: list) -> str:
+    """Markers that close the open entities, innermost first"""
+    closers = {"```": "\n```", "`": "`", "*": "*", "_": "_", "[": "]"}
+    return "".join(closers[m] for m in reversed(markers))
+
+
+def _reopening(markers: list) -> str:
+    """Markers that reopen the entities at the start of the next chunk"""
+    openers = {"```": "```\n", "`": "`", "*": "*", "_": "_", "[": "["}
+    return "".join(openers[m] for m in markers)
+
+
+def _split_units(text: str, max_len: int, level: int = 0) -> list:
+    """Split text into pieces <= max_len, preferring the coarsest separator"""
+    if len(text) <= max_len:
+        return [text]
+    if level == len(_SEPARATORS):
+        # A single unbroken word: split on characters (never inside a code point)
+        return [text[i:i + max_len] for i in range(0, len(text), max_len)]
+
+    sep = _SEPARATORS[level]
+    chunks = []
+    current = None
+    for part in text.split(sep):
+        if len(part) > max_len:
+            if current is not None:
+                chunks.append(current)
+                current = None
+            chunks.extend(_split_units(part, max_len, level + 1))
+        elif current is None:
+            current = part
+        elif len(current) + len(sep) + len(part) <= max_len:
+            current += sep + part
+        else:
+            chunks.append(current)
+            current = part
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def split_markdown(text: str, limit: int = TELEGRAM_CHUNK_LIMIT) -> list:
+    """
+    Split a long Markdown response into Telegram-sized chunks.
+
+    Splits on section/paragraph boundaries first, then lines, then words.
+    Entities that would span a boundary are closed at the end of one chunk
+    and reopened at the start of the next, so each chunk parses on its own.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    pieces = [p for p in _split_units(text, limit - _ENTITY_RESERVE) if p.strip()]
+
+    chunks = []
+    carry = ""
+    for piece in pieces:
+        chunk = carry + piece
+        markers = _open_entities(chunk)
+        chunks.append(chunk + _closing(markers))
+        carry = _reopening(markers)
+    return chunks
+
+
+# ==================== SANITIZING ====================
+
+_HEADING = re.compile(r'^#{1,6}\s+(.+?)\s*#*\s*$', re.MULTILINE)
+_DOUBLE_BOLD = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*', re.DOTALL)
+_DOUBLE_ITALIC = re.compile(r'__(?=\S)(.+?)(?<=\S)__', re.DOTALL)
+_STAR_BULLET = re.compile(r'^(\s*)\*\s+', re.MULTILINE)
+_LINK = re.compile(r'\[[^\[\]\n]+\]\([^()\s]+\)')
+
+
+def _find_closing(text: str, marker: str, start: int) -> int:
+    """Index of the marker closing an entity opened at start-1, or -1"""
+    end = text.find(marker, start)
+    if end == -1:
+        return -1
+    content = text[start:end]
+    if not content or content[0].isspace() or content[-1].isspace() or "\n\n" in content:
+        return -1
+    return end
+
+
+def sanitize_markdown(text: str) -> str:
+    """
+    Rewrite model output into Markdown that Telegram's legacy parser accepts.
+
+    Standard Markdown is mapped to Telegram's dialect (**bold** -> *bold*,
+    # headings -> bold lines, "* " bullets -> "• "). Any marker that would
+    not form a valid entity, such as an unclosed *, an intraword _ or a
+    stray [, is escaped so it shows literally instead of failing the whole
+    message. Entity contents are literal in this dialect and are kept as is.
+    """
+    text = _DOUBLE_BOLD.sub(lambda m: "*" + m.group(1).replace("*", "") + "*", text)
+    text = _DOUBLE_ITALIC.sub(lambda m: "_" + m.group(1).replace("_", "") + "_", text)
+    text = _STAR_BULLET.sub(r"\1• ", text)
+    text = _HEADING.sub(lambda m: "*" + m.group(1).replace("*", "") + "*", text)
+
+    out = []
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+
+        if ch == "\\":
+            out.append(text[i:i + 2])
+            i += 2
+            continue
+
+        if text.startswith("```", i):
+            end = text.find("```", i + 3)
+            if end == -1:
+                out.append(text[i:] + "\n```")
+                break
+            out.append(text[i:end + 3])
+            i = end + 3
+            continue
+
+        if ch == "`":
+            end = text.find("`", i + 1)
+            if end > i + 1:
+                out.append(text[i:end + 1])
+                i = end + 1
+            else:
+                out.append("\\`")
+                i += 1
+            continue
+
+        if ch in "*_":
+            intraword = ch == "_" and i > 0 and text[i - 1].isalnum()
+            end = -1 if intraword else _find_closing(text, ch, i + 1)
+            if end != -1:
+                out.append(text[i:end + 1])
+                i = end + 1
+            else:
+                out.append("\\" + ch)
+                i += 1
+            continue
+
+        if ch == "[":
+            match = _LINK.match(text, i)
+            if match:
+                out.append(match.group(0))
+                i = match.end()
+            else:
+                out.append("\\[")
+                i += 1
+            continue
+
+        out.append(ch)
+        i += 1
+
+    return "".join(out)
@@ -1,8 +1,45 @@
 import base64
-import requests
 import json
 import re
-from .config import GEMINI_API_KEY, logger
+from string import Formatter
+from .breaker import CircuitOpenError
+from .cache import LRUCache
+from .config import (
+    GEMINI_API_KEY, GEMINI_MODEL, SUGGESTIONS_STRUCTURED_OUTPUT, SUGGESTION_MAX_TOKENS,
+    SUMMARY_MAX_TOKENS, TRANSCRIPT_CACHE_SIZE, logger
+)
+from .gemini_client import (
+    GeminiAPIError, generation_config, payload_template, prompt_contents, generate
+)
+
+
+# Request payloads with everything but the per-request contents pre-serialized
+TRANSLATE_TO_EN_TEMPLATE = payload_template(generation_config(temperature=0.3, max_output_tokens=1000))
+TRANSLATE_TO_UZ_TEMPLATE = payload_template(generation_config(temperature=0.3, max_output_tokens=2000))
+TRANSCRIBE_TEMPLATE = payload_template(generation_config(temperature=0.2, max_output_tokens=1024))
+SUMMARY_TEMPLATE = payload_template(generation_config(temperature=0.2, max_output_tokens=SUMMARY_MAX_TOKENS))
+SUGGESTION_TEMPLATE = payload_template(generation_config(temperature=0.7, max_output_tokens=1024))
+
+# Structured output: the model must answer with {"suggestions": [q1, q2]}, so
+# two short questions fit a tight output budget and need no scraping
+SUGGESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "suggestions": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"},
+            "minItems": 2,
+            "maxItems": 2
+        }
+    },
+    "required": ["suggestions"]
+}
+SUGGESTION_STRUCTURED_TEMPLATE = payload_template(generation_config(
+    temperature=0.7,
+    max_output_tokens=SUGGESTION_MAX_TOKENS,
+    responseMimeType="application/json",
+    responseSchema=SUGGESTION_SCHEMA
+))
 
 
 # ==================== TRANSLATION FUNCTIONS ====================
@@ -14,52 +51,28 @@ def translate_uz_to_en(text: str) -> str:
         return text
 
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-
         prompt = f"""Translate the following Uzbek medical text to English.
 Keep medical terminology accurate. Return ONLY the translated text, nothing else.
 
 Uzbek text:
 {text}"""
 
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": 0.3,
-                "maxOutputTokens": 1000,
-                "thinkingConfig": {
-                    "thinkingBudget": 0
-                }
-            }
-        }
+        payload = TRANSLATE_TO_EN_TEMPLATE.render(prompt_contents(prompt))
 
         logger.info("🔄 Translating Uzbek → English...")
-        response = requests.post(url, json=payload, timeout=30)
-
-        if response.status_code != 200:
-            logger.error(f"❌ Translation API error: {response.status_code}")
-            return text
-
-        result = response.json()
-        candidates = result.get("candidates", [])
-        if not candidates:
-            return text
-
-        parts = candidates[0].get("content", {}).get("parts", [])
-
-        # Get text from parts (skip thinking parts with "thought" key)
-        translated = ""
-        for part in parts:
-            if "thought" in part:
-                continue
-            if "text" in part:
-                translated = part.get("text", "").strip()
+        translated = generate(payload, timeout=30, stage="translation").text
 
         if translated:
             logger.info(f"✅ Translated to English: {translated[:100]}...")
             return translated
         return text
 
+    except GeminiAPIError as e:
+        logger.error(f"❌ Translation API error: {e.status_code}")
+        return text
+    except CircuitOpenError as e:
+        logger.warning(f"⏭️ Skipping translation: {e}")
+        return text
     except Exception as e:
         logger.error(f"❌ Translation error: {e}")
         return text
@@ -72,8 +85,6 @@ def translate_en_to_uz(text: str) -> str:
         return text
 
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-
         prompt = f"""Translate the following English medical text to Uzbek (Latin script).
 Keep medical terminology accurate. Keep the same formatting (emojis, line breaks, sections).
 Return ONLY the translated text, nothing else.
@@ -81,44 +92,22 @@ Return ONLY the translated text, nothing else.
 English text:
 {text}"""
 
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": 0.3,
-                "maxOutputTokens": 2000,
-                "thinkingConfig": {
-                    "thinkingBudget": 0
-                }
-            }
-        }
+        payload = TRANSLATE_TO_UZ_TEMPLATE.render(prompt_contents(prompt))
 
         logger.info("🔄 Translating English → Uzbek...")
-        response = requests.post(url, json=payload, timeout=60)
-
-        if response.status_code != 200:
-            logger.error(f"❌ Translation API error: {response.status_code}")
-            return text
-
-        result = response.json()
-        candidates = result.get("candidates", [])
-        if not candidates:
-            return text
-
-        parts = candidates[0].get("content", {}).get("parts", [])
-
-        # Get text from parts (skip thinking parts with "thought" key)
-        translated = ""
-        for part in parts:
-            if "thought" in part:
-                continue
-            if "text" in part:
-                translated = part.get("text", "").strip()
+        translated = generate(payload, timeout=60, stage="translation").text
 
         if translated:
             logger.info(f"✅ Translated to Uzbek: {translated[:100]}...")
             return translated
         return text
 
+    except GeminiAPIError as e:
+        logger.error(f"❌ Translation API error: {e.status_code}")
+        return text
+    except CircuitOpenError as e:
+        logger.warning(f"⏭️ Skipping translation: {e}")
+        return text
     except Exception as e:
         logger.error(f"❌ Translation error: {e}")
         return text
@@ -126,15 +115,19 @@ English text:
 
 # ==================== SPEECH TO TEXT ====================
 
-def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/ogg", language_hint: str | None = None) -> str:
-    """Transcribe audio to text using Gemini"""
+# Transcripts keyed by Telegram's file_unique_id, which is stable across
+# forwards and re-sends of the same voice note
+transcript_cache = LRUCache(TRANSCRIPT_CACHE_SIZE)
+
+
+def transcribe_audio(audio_bytes: bytes = None, mime_type: str = "audio/ogg", language_hint: str | None = None,
+                     audio_base64: str = None) -> str:
+    """Transcribe audio to text using Gemini (pass `audio_base64` if it is already encoded)"""
     if not GEMINI_API_KEY:
         logger.warning("⚠️ GEMINI_API_KEY not set, skipping transcription")
         return ""
 
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-
         lang_line = f"Language hint: {language_hint}." if language_hint else ""
         prompt = (
             "Transcribe the following medical voice message. "
@@ -143,59 +136,86 @@ def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/ogg", language_
             f"{lang_line}"
         ).strip()
 
-        audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
-
-        payload = {
-            "contents": [{
-                "parts": [
-                    {"text": prompt},
-                    {"inline_data": {"mime_type": mime_type, "data": audio_b64}}
-                ]
-            }],
-            "generationConfig": {
-                "temperature": 0.2,
-                "maxOutputTokens": 1024,
-                "thinkingConfig": {
-                    "thinkingBudget": 0
-                }
-            }
-        }
-
-        logger.info("🔄 Transcribing audio with Gemini 2.5 Flash...")
-        response = requests.post(url, json=payload, timeout=60)
+        audio_b64 = audio_base64 or base64.b64encode(audio_bytes).decode("utf-8")
 
-        if response.status_code != 200:
-            logger.error(f"❌ Transcription API error: {response.status_code} - {response.text[:500]}")
-            return ""
-
-        result = response.json()
-        candidates = result.get("candidates", [])
-        if not candidates:
-            logger.error("❌ No candidates in transcription response")
-            return ""
-
-        parts = candidates[0].get("content", {}).get("parts", [])
-        if not parts:
-            logger.error("❌ No parts in transcription response")
-            return ""
+        payload = TRANSCRIBE_TEMPLATE.render(
+            prompt_contents(prompt, {"inline_data": {"mime_type": mime_type, "data": audio_b64}})
+        )
 
-        transcript_parts = []
-        for part in parts:
-            if "thought" in part:
-                continue
-            if "text" in part:
-                transcript_parts.append(part.get("text", ""))
+        logger.info(f"🔄 Transcribing audio with {GEMINI_MODEL}...")
+        transcript = generate(payload, timeout=60, stage="transcription").text
 
-        transcript = "\n".join(transcript_parts).strip()
         if transcript:
             logger.info(f"✅ Transcription complete: {transcript[:100]}...")
+        else:
+            logger.error("❌ Empty transcription response")
         return transcript
 
+    except GeminiAPIError as e:
+        logger.error(f"❌ Transcription API error: {e.status_code} - {e.body}")
+        return ""
+    except CircuitOpenError as e:
+        logger.warning(f"⏭️ Skipping transcription: {e}")
+        return ""
     except Exception as e:
         logger.error(f"❌ Transcription error: {e}", exc_info=True)
         return ""
 
 
+# ==================== HISTORY SUMMARIZATION ====================
+
+def summarize_conversation(previous_summary: str, messages: list) -> str:
+    """
+    Fold older conversation turns into a rolling summary using Gemini.
+
+    Args:
+        previous_summary: The current summary ("" if none)
+        messages: Turns to fold in [{"role": "user/assistant", "content": "..."}]
+
+    Returns:
+        The updated summary, or empty string if failed
+    """
+    if not GEMINI_API_KEY:
+        logger.warning("⚠️ GEMINI_API_KEY not set, skipping summarization")
+        return ""
+
+    try:
+        transcript = "\n\n".join(
+            f"{'Doctor' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+            for msg in messages
+        )
+
+        prompt = f"""You maintain a running clinical summary of a consultation between a doctor and a medical AI.
+Update the summary with the new turns below. Keep patient details, symptoms, findings, diagnoses
+considered, tests and treatments discussed, and open questions. Be concise and factual.
+Write in the same language as the conversation. Return ONLY the updated summary.
+
+Current summary:
+{previous_summary or "(none)"}
+
+New turns:
+{transcript}"""
+
+        payload = SUMMARY_TEMPLATE.render(prompt_contents(prompt))
+
+        logger.info(f"🔄 Summarizing {len(messages)} older messages...")
+        summary = generate(payload, timeout=60, stage="summary").text
+
+        if summary:
+            logger.info(f"✅ History summary updated ({len(summary)} chars)")
+        return summary
+
+    except GeminiAPIError as e:
+        logger.error(f"❌ Summarization API error: {e.status_code} - {e.body}")
+        return ""
+    except CircuitOpenError as e:
+        logger.warning(f"⏭️ Skipping summarization: {e}")
+        return ""
+    except Exception as e:
+        logger.error(f"❌ Summarization error: {e}")
+        return ""
+
+
 # ==================== SUGGESTION PROMPTS ====================
 
 SUGGESTION_PROMPTS = {
@@ -261,6 +281,58 @@ JSON format only:
 }
 
 
+def _compile_prompt(template: str) -> tuple:
+    """Split a str.format template into (literal, field name) pairs once"""
+    return tuple((literal, field) for literal, field, _, _ in Formatter().parse(template))
+
+
+def _render_prompt(compiled: tuple, **values) -> str:
+    """Fill a compiled template; equivalent to template.format(**values)"""
+    return "".join(literal + (values[field] if field else "") for literal, field in compiled)
+
+
+_SUGGESTION_TEMPLATES = {lang: _compile_prompt(template) for lang, template in SUGGESTION_PROMPTS.items()}
+
+
+def _extract_json_object(text: str) -> str:
+    """Strip markdown fences and surrounding prose from a free-text JSON answer"""
+    text = text.strip()
+
+    # Remove markdown code blocks if present
+    if "```" in text:
+        match = re.search(r'```(?:json)?\s*(.*?)\s*```', text, re.DOTALL)
+        if match:
+            text = match.group(1).strip()
+
+    # Try to find JSON object in the text
+    if not text.startswith("{"):
+        start_idx = text.find("{")
+        end_idx = text.rfind("}")
+        if start_idx != -1 and end_idx != -1:
+            text = text[start_idx:end_idx + 1]
+
+    return text
+
+
+def _parse_suggestions(text: str) -> list:
+    """
+    Parse {"suggestions": [...]} from the model output. Structured output is
+    plain JSON and parses directly; free text falls back to scraping.
+
+    Raises:
+        json.JSONDecodeError: if no JSON object can be recovered
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = json.loads(_extract_json_object(text))
+
+    if not isinstance(data, dict):
+        return []
+    suggestions = data.get("suggestions", [])
+    return suggestions if isinstance(suggestions, list) else []
+
+
 def generate_suggestions(user_message: str, assistant_response: str, language: str = "en") -> list:
     """
     Use Gemini 2.5 Flash to generate follow-up question suggestions.
@@ -280,107 +352,30 @@ def generate_suggestions(user_message: str, assistant_response: str, language: s
     text = ""  # Initialize for error handling
 
     try:
-        # Get the prompt template for the language
-        prompt_template = SUGGESTION_PROMPTS.get(language, SUGGESTION_PROMPTS["en"])
-        prompt = prompt_template.format(
+        # Fill the precompiled prompt template for the language
+        prompt = _render_prompt(
+            _SUGGESTION_TEMPLATES.get(language, _SUGGESTION_TEMPLATES["en"]),
             user_message=user_message[:500],  # Limit length
             assistant_response=assistant_response[:1500]  # Limit length
         )
 
-        # Use Gemini 2.5 Flash
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-
-        headers = {
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }],
-            "generationConfig": {
-                "temperature": 0.7,
-                "maxOutputTokens": 1024,
-                "thinkingConfig": {
-                    "thinkingBudget": 0
-                }
-            }
-        }
-
-        logger.info(f"🔄 Generating suggestions with Gemini 2.5 Flash (language: {language})...")
-
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-
-        if response.status_code != 200:
-            logger.error(f"❌ Gemini API error: {response.status_code} - {response.text[:500]}")
-            return []
-
-        result = response.json()
+        template = SUGGESTION_STRUCTURED_TEMPLATE if SUGGESTIONS_STRUCTURED_OUTPUT else SUGGESTION_TEMPLATE
+        payload = template.render(prompt_contents(prompt))
 
-        # Extract text from response - handle different response structures
-        candidates = result.get("candidates", [])
-        if not candidates:
-            logger.error(f"❌ No candidates in Gemini response: {result}")
-            return []
+        logger.info(f"🔄 Generating suggestions with {GEMINI_MODEL} (language: {language})...")
 
-        candidate = candidates[0]
-        content = candidate.get("content", {})
-        parts = content.get("parts", [])
+        result = generate(payload, timeout=60, stage="suggestions")
 
-        if not parts:
-            logger.error(f"❌ No parts in Gemini response. Candidate: {candidate}")
+        if not result.has_candidates:
             return []
 
-        # Log all parts to debug
-        logger.info(f"📥 Gemini response has {len(parts)} parts")
-        for i, part in enumerate(parts):
-            part_keys = list(part.keys())
-            logger.info(f"   Part {i}: keys={part_keys}")
-
-        # Gemini 2.5 Flash returns multiple parts:
-        # - Parts with "thought" key are thinking/reasoning (skip these)
-        # - Parts with "text" key are actual response (use these)
-        # Collect ALL text from non-thought parts
-        all_text_parts = []
-        for part in parts:
-            # Skip thinking parts
-            if "thought" in part:
-                continue
-            # Collect text parts
-            if "text" in part:
-                all_text_parts.append(part.get("text", ""))
-
-        text = "\n".join(all_text_parts)
-        logger.info(f"📝 Gemini combined text: {text}")
+        text = result.text
 
         if not text:
             logger.error("❌ Empty text in Gemini response")
             return []
 
-        # Parse JSON from response
-        # Clean up the text in case there's markdown formatting
-        text = text.strip()
-
-        # Remove markdown code blocks if present
-        if "```" in text:
-            # Extract content between ``` markers
-            match = re.search(r'```(?:json)?\s*(.*?)\s*```', text, re.DOTALL)
-            if match:
-                text = match.group(1)
-
-        text = text.strip()
-
-        # Try to find JSON object in the text
-        if not text.startswith("{"):
-            start_idx = text.find("{")
-            end_idx = text.rfind("}")
-            if start_idx != -1 and end_idx != -1:
-                text = text[start_idx:end_idx + 1]
-
-        logger.info(f"📝 Cleaned JSON text: {text}")
-
-        data = json.loads(text)
-        suggestions = data.get("suggestions", [])
+        suggestions = _parse_suggestions(text)
 
         # Ensure we have exactly 2 suggestions and they're not too long
         suggestions = [str(s)[:50] for s in suggestions[:2]]
@@ -388,10 +383,16 @@ def generate_suggestions(user_message: str, assistant_response: str, language: s
         logger.info(f"✅ Generated {len(suggestions)} suggestions: {suggestions}")
         return suggestions
 
+    except GeminiAPIError as e:
+        logger.error(f"❌ Gemini API error: {e.status_code} - {e.body}")
+        return []
     except json.JSONDecodeError as e:
         logger.error(f"❌ Failed to parse Gemini response as JSON: {e}")
         logger.error(f"❌ Text was: {text[:500] if text else 'empty'}")
         return []
+    except CircuitOpenError as e:
+        logger.warning(f"⏭️ Skipping suggestions: {e}")
+        return []
     except Exception as e:
         logger.error(f"❌ Error generating suggestions: {e}", exc_info=True)
         return []
@@ -0,0 +1,226 @@
+# Shared request/response core for all Gemini API calls
+import time
+from dataclasses import dataclass, field
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .breaker import circuit_breaker
+from .config import GEMINI_API_KEY, GEMINI_API_BASE, GEMINI_MODEL, logger
+from .metrics import counter, histogram
+from .payloads import PayloadTemplate
+from .usage import record_usage
+
+
+GENERATE_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent"
+CACHED_CONTENTS_URL = f"{GEMINI_API_BASE}/cachedContents"
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "x-goog-api-key": GEMINI_API_KEY or ""
+}
+
+# One pooled session for every Gemini call, so TLS connections are reused
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+
+gemini_requests = counter("gemini_requests_total", "Gemini generateContent calls", ("stage", "status"))
+gemini_seconds = histogram("gemini_request_seconds", "Gemini generateContent latency", ("stage",))
+
+# Each stage has its own breaker, so a failing answer model does not also
+# stop transcription; answers use the "gemini" one
+BREAKER_BACKENDS = {"answer": "gemini"}
+
+
+def stage_breaker(stage: str):
+    """The circuit breaker guarding Gemini calls for a stage"""
+    return circuit_breaker(BREAKER_BACKENDS.get(stage, stage))
+
+
+class GeminiAPIError(Exception):
+    """Raised when the Gemini API returns a non-200 status"""
+
+    def __init__(self, status_code: int, body: str):
+        self.status_code = status_code
+        self.body = body
+        super().__init__(f"Gemini API returned {status_code}: {body[:200]}")
+
+
+@dataclass
+class GeminiResult:
+    """Parsed generateContent response"""
+    text: str
+    usage: dict = field(default_factory=dict)
+    raw: dict = field(default_factory=dict)
+
+    @property
+    def has_candidates(self) -> bool:
+        return bool(self.raw.get("candidates"))
+
+
+# ==================== PAYLOAD BUILDING ====================
+
+def generation_config(temperature: float, max_output_tokens: int, **extra) -> dict:
+    """Build a generationConfig with thinking disabled"""
+    config = {
+        "temperature": temperature,
+        "maxOutputTokens": max_output_tokens,
+        "thinkingConfig": {
+            "thinkingBudget": 0
+        }
+    }
+    config.update(extra)
+    return config
+
+
+def history_to_contents(history: list = None) -> list:
+    """Convert stored history [{"role", "content"}] to Gemini contents"""
+    contents = []
+    if history:
+        for msg in history:
+            role = "user" if msg["role"] == "user" else "model"
+            contents.append({
+                "role": role,
+                "parts": [{"text": msg["content"]}]
+            })
+    return contents
+
+
+def prompt_contents(prompt: str, *extra_parts: dict) -> list:
+    """Single-turn contents with a text prompt and optional extra parts"""
+    return [{"parts": [{"text": prompt}, *extra_parts]}]
+
+
+def build_payload(contents: list, config: dict, system_prompt: str = None, cached_content: str = None) -> dict:
+    """Assemble a generateContent payload (cached_content replaces the system prompt)"""
+    payload = {}
+    if cached_content:
+        payload["cachedContent"] = cached_content
+    elif system_prompt:
+        payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+    payload["contents"] = contents
+    payload["generationConfig"] = config
+    return payload
+
+
+def payload_template(config: dict, system_prompt: str = None, cached_content: str = None) -> PayloadTemplate:
+    """Pre-serialize everything but `contents` of a generateContent payload"""
+    static = build_payload([], config, system_prompt, cached_content)
+    del static["contents"]
+    return PayloadTemplate(static, "contents")
+
+
+# ==================== RESPONSE PARSING ====================
+
+def extract_text(result: dict) -> str:
+    """Join the text of the first candidate, skipping thinking parts"""
+    candidates = result.get("candidates", [])
+    if not candidates:
+        return ""
+
+    parts = candidates[0].get("content", {}).get("parts", [])
+
+    # Parts with a "thought" key are reasoning, not the answer
+    text_parts = []
+    for part in parts:
+        if "thought" in part:
+            continue
+        if "text" in part:
+            text_parts.append(part.get("text", ""))
+
+    return "\n".join(text_parts).strip()
+
+
+def extract_usage(result: dict) -> dict:
+    """Extract token counts from usageMetadata"""
+    usage = result.get("usageMetadata", {})
+    return {
+        "prompt_tokens": usage.get("promptTokenCount", 0),
+        "output_tokens": usage.get("candidatesTokenCount", 0),
+        "cached_tokens": usage.get("cachedContentTokenCount", 0),
+        "total_tokens": usage.get("totalTokenCount", 0)
+    }
+
+
+# ==================== REQUEST ====================
+
+def generate(payload: dict | bytes, timeout: int = 60, stage: str = "other") -> GeminiResult:
+    """
+    Send a generateContent request (a dict, or bytes rendered from a template).
+    Token usage and latency are accounted under `stage` (answer, translation, ...).
+
+    Raises:
+        GeminiAPIError: on a non-200 response
+        requests.exceptions.RequestException: on network errors and timeouts
+        CircuitOpenError: without calling, while the stage's breaker is open
+    """
+    breaker = stage_breaker(stage)
+    breaker.before_call()
+
+    started = time.monotonic()
+    try:
+        if isinstance(payload, bytes):
+            response = _session.post(GENERATE_URL, headers=HEADERS, data=payload, timeout=timeout)
+        else:
+            response = _session.post(GENERATE_URL, headers=HEADERS, json=payload, timeout=timeout)
+    except requests.exceptions.Timeout:
+        gemini_requests.inc(stage=stage, status="timeout")
+        breaker.record_failure("timeout")
+        raise
+    except requests.exceptions.RequestException:
+        gemini_requests.inc(stage=stage, status="network_error")
+        breaker.record_failure("network error")
+        raise
+    except Exception as e:
+        # Anything else still resolves the call, so a half-open trial is not left taken
+        breaker.record_failure(type(e).__name__)
+        raise
+    latency = time.monotonic() - started
+    gemini_seconds.observe(latency, stage=stage)
+
+    if response.status_code != 200:
+        gemini_requests.inc(stage=stage, status=str(response.status_code))
+        # Other 4xx are our request's fault, not a sign the backend is unhealthy
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            breaker.record_success(latency, timeout)
+        raise GeminiAPIError(response.status_code, response.text[:500])
+
+    breaker.record_success(latency, timeout)
+    gemini_requests.inc(stage=stage, status="200")
+    result = response.json()
+    if not result.get("candidates"):
+        logger.warning(f"⚠️ No candidates in Gemini response: {str(result)[:500]}")
+
+    usage = extract_usage(result)
+    record_usage(stage, usage, latency)
+
+    return GeminiResult(text=extract_text(result), usage=usage, raw=result)
+
+
+def create_cached_content(system_prompt: str, ttl_seconds: int, display_name: str = "") -> dict:
+    """
+    Register a system prompt with the cachedContents API.
+
+    Returns:
+        The cachedContent resource ({"name": "cachedContents/...", "expireTime": ...})
+
+    Raises:
+        GeminiAPIError: on a non-200 response
+    """
+    payload = {
+        "model": f"models/{GEMINI_MODEL}",
+        "displayName": display_name,
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "ttl": f"{ttl_seconds}s"
+    }
+
+    response = _session.post(CACHED_CONTENTS_URL, headers=HEADERS, json=payload, timeout=30)
+
+    if response.status_code != 200:
+        raise GeminiAPIError(response.status_code, response.text[:500])
+
+    return response.json()
@@ -1,21 +1,37 @@
-import base64
+import asyncio
 import hashlib
+from contextlib import suppress
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from .config import LOCATION, logger
+from .config import ADMIN_USER_IDS, LOCATION, THINKING_DELAY, logger
 from .database import (
     get_user_language, set_user_language,
-    get_conversation_history, add_message, clear_user_history,
+    add_message, clear_user_history,
     store_suggestion, get_suggestion
 )
+from .history import build_history, compact_history
+from .jobs import StageFailed, jobs
+from .lifecycle import lifecycle
+from .formatting import sanitize_markdown, split_markdown
 from .messages import get_message
-from .llm import call_gemini, call_gemini_with_image
-from .gemini import generate_suggestions, translate_uz_to_en, translate_en_to_uz, transcribe_audio
+from .metrics import counter
+from .gemini import generate_suggestions, transcribe_audio, transcript_cache
+from .pipeline import answer_text, answer_image
+from .speculation import speculator
+from .stats import build_stats_report
+from .tracing import annotate, pipeline_errors, span, traced
+from .workers import cpu_pool, encode_base64, run_db
+
+
+markdown_sent = counter("telegram_markdown_messages_total", "Messages sent with parse_mode=Markdown")
+markdown_fallbacks = counter("telegram_markdown_fallback_total", "Markdown sends rejected by Telegram and resent as plain text")
+markdown_sanitized = counter("telegram_markdown_sanitized_total", "Responses the local Markdown sanitizer had to rewrite")
 
 
 async def send_markdown_message(message, text, reply_markup=None):
     """Send message with Markdown formatting, fallback to plain text if error"""
+    markdown_sent.inc()
     try:
         return await message.reply_text(
             text,
@@ -23,6 +39,7 @@ async def send_markdown_message(message, text, reply_markup=None):
             reply_markup=reply_markup
         )
     except Exception as e:
+        markdown_fallbacks.inc()
         logger.warning(f"⚠️ Markdown parse failed, sending plain text: {e}")
         return await message.reply_text(
             text,
@@ -30,6 +47,192 @@ async def send_markdown_message(message, text, reply_markup=None):
         )
 
 
+async def edit_markdown_message(target, text, reply_markup=None) -> bool:
+    """Edit a message into Markdown text, fallback to plain text; False if both fail"""
+    markdown_sent.inc()
+    try:
+        await target.edit_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+        return True
+    except Exception as e:
+        markdown_fallbacks.inc()
+        logger.warning(f"⚠️ Markdown parse failed on edit, using plain text: {e}")
+    try:
+        await target.edit_text(text, reply_markup=reply_markup)
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Could not edit placeholder: {e}")
+        return False
+
+
+class Placeholder:
+    """
+    Temporary status message ("thinking", "transcribing") that is only posted,
+    together with the typing action, if the answer is not ready within
+    THINKING_DELAY seconds. If it was posted, it is edited into the final
+    answer instead of being deleted.
+    """
+
+    def __init__(self, message, text: str, delay: float = THINKING_DELAY):
+        self.message = message
+        self.text = text
+        self.delay = delay
+        self.sent = None
+        self._task = None
+        self._posting = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._post_after_delay())
+
+    async def _post_after_delay(self):
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        self._posting = True
+        await self.message.chat.send_action(action="typing")
+        self.sent = await self.message.reply_text(self.text)
+
+    async def _settle(self):
+        """Stop the timer, or wait for a post that is already in flight"""
+        task = self._task
+        if task is None:
+            return
+        if not task.done() and not self._posting:
+            task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await task
+
+    async def update(self, text: str):
+        """Change the status text (edits the message if it is already shown)"""
+        self.text = text
+        if self.sent:
+            with suppress(Exception):
+                await self.sent.edit_text(text)
+
+    async def take(self):
+        """Claim the posted message to edit it into the answer; None if it was never shown"""
+        await self._settle()
+        sent, self.sent = self.sent, None
+        return sent
+
+    async def cleanup(self):
+        """Best-effort removal of a placeholder that was not used for the answer"""
+        sent = await self.take()
+        if sent:
+            with suppress(Exception):
+                await sent.delete()
+
+
+async def send_response(message, text, reply_markup=None, placeholder: Placeholder = None):
+    """
+    Send a response in Markdown-safe chunks, with the buttons on the last one.
+    A shown placeholder is edited into the first chunk.
+    """
+    # Fix up model Markdown locally so Telegram does not reject it and force a resend
+    sanitized = sanitize_markdown(text)
+    if sanitized != text:
+        markdown_sanitized.inc()
+
+    target = await placeholder.take() if placeholder else None
+
+    chunks = split_markdown(sanitized)
+    for i, chunk in enumerate(chunks):
+        is_last = i == len(chunks) - 1
+        markup = reply_markup if is_last else None
+        if i == 0 and target is not None:
+            if await edit_markdown_message(target, chunk, reply_markup=markup):
+                continue
+            with suppress(Exception):
+                await target.delete()
+        await send_markdown_message(message, chunk, reply_markup=markup)
+
+
+async def send_status(message, text, placeholder: Placeholder = None):
+    """Send a plain status/error message, reusing a shown placeholder"""
+    target = await placeholder.take() if placeholder else None
+    if target is not None:
+        try:
+            await target.edit_text(text)
+            return
+        except Exception:
+            with suppress(Exception):
+                await target.delete()
+    await message.reply_text(text)
+
+
+def save_turn(user_id: int, user_text: str, response_text: str) -> bool:
+    """Store a question and its answer in the conversation history"""
+    add_message(user_id, "user", user_text)
+    add_message(user_id, "assistant", response_text)
+    return True
+
+
+async def run_pipeline(job, modality: str, message, lang: str, status: str, answer, saved_prefix: str = ""):
+    """
+    Run a question pipeline after its job was claimed.
+
+    `answer(placeholder)` runs the modality's own stages and returns
+    (question, response_text, suggestions), or None if it already replied.
+    The shared stages follow: save the turn, suggest follow-ups, send the
+    reply, compact the history and speculate on the new buttons. Errors are
+    reported to the user and fail the job.
+    """
+    user_id = job.user_id
+
+    # Show typing indicator and a temporary status message if the answer takes a while
+    placeholder = Placeholder(message, get_message(lang, status))
+    placeholder.start()
+
+    try:
+        result = await answer(placeholder)
+        if result is None:
+            await job.finish()
+            return
+        question, response_text, suggestions = result
+
+        # Save messages to history (save in user's language)
+        with span("save"):
+            await job.step("saved", lambda: run_db(
+                save_turn, user_id, f"{saved_prefix}{question}", response_text
+            ))
+
+        # Generate follow-up suggestions using Gemini (unless they came with the answer)
+        with span("suggestions"):
+            if suggestions is None:
+                suggestions = await job.step("suggestions", lambda: asyncio.to_thread(
+                    generate_suggestions, question, response_text, language=lang
+                ))
+            suggestion_keyboard = await run_db(create_suggestion_keyboard, suggestions, user_id)
+
+        # Send response to user with suggestion buttons (split on Markdown boundaries)
+        with span("send"):
+            if not job.has("sent"):
+                await send_response(message, response_text, reply_markup=suggestion_keyboard, placeholder=placeholder)
+                await job.save("sent")
+
+        # Fold older turns into the rolling summary once the reply is out
+        with span("compact"):
+            await asyncio.to_thread(compact_history, user_id)
+
+        # Pre-compute answers for the buttons just shown
+        if speculator.enabled:
+            speculator.schedule(user_id, lang, suggestions, await run_db(build_history, user_id))
+
+        await job.finish()
+
+    except Exception as e:
+        if isinstance(e, StageFailed):
+            # The model client already logged the cause
+            logger.warning(f"⚠️ {modality.capitalize()} {e.stage} stage failed: {e}")
+        else:
+            logger.error(f"❌ Error: {str(e)}", exc_info=True)
+        pipeline_errors.inc(modality=modality)
+        error_msg = get_message(lang, "error", error=str(e)[:200])
+        await send_status(message, error_msg, placeholder)
+        await job.finish("failed")
+    finally:
+        # Best-effort cleanup of a status message that was not turned into the answer
+        await placeholder.cleanup()
+
+
 def get_language_keyboard() -> InlineKeyboardMarkup:
     """Create language selection keyboard"""
     keyboard = [
@@ -104,10 +307,16 @@ async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.reply_text(get_message(lang, "welcome"), parse_mode='Markdown')
 
 
+@traced("button")
+@lifecycle.drained
 async def suggestion_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle suggestion button press - sends the suggestion as a new message to Gemini"""
     query = update.callback_query
-    await query.answer()
+    try:
+        await query.answer()
+    except Exception as e:
+        # Too old to answer when the update is resumed after a restart
+        logger.warning(f"⚠️ Could not answer callback query: {e}")
 
     user_id = query.from_user.id
     user_name = query.from_user.first_name
@@ -127,6 +336,11 @@ async def suggestion_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     logger.info(f"📩 Suggestion selected by {user_name} (ID:{user_id}): {suggestion_text[:50]}...")
+    annotate(language=lang)
+
+    job = await jobs.begin(update)
+    if job is None:
+        return
 
     # Replace the buttons with the selected question text (shows what user chose)
     try:
@@ -143,60 +357,25 @@ async def suggestion_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         except Exception:
             pass
 
-    # Send a "thinking" message
-    thinking_msg = await query.message.reply_text(get_message(lang, "thinking"))
-
-    try:
+    async def answer(placeholder):
         # Get conversation history
-        history = get_conversation_history(user_id)
-
-        # For Uzbek: translate suggestion to English before sending to Gemini
-        message_for_llm = suggestion_text
-        llm_lang = lang
-        if lang == "uz":
-            message_for_llm = translate_uz_to_en(suggestion_text)
-            llm_lang = "en"  # Use English prompt for Gemini
-
-        # Call Gemini with the suggestion as the new message
-        logger.info("🔄 Calling Gemini endpoint with suggestion...")
-        response_text = call_gemini(message_for_llm, language=llm_lang, history=history)
+        with span("history"):
+            history = await run_db(build_history, user_id)
 
-        logger.info(f"✅ Response received ({len(response_text)} chars)")
+        async def compute_answer():
+            # Use the speculatively precomputed answer if there is one for this history
+            with span("speculation_wait"):
+                precomputed = await speculator.take(user_id, suggestion_text, history)
+            if precomputed:
+                return precomputed
+            # Call Gemini with the suggestion as the new message
+            logger.info("🔄 Calling Gemini endpoint with suggestion...")
+            return await asyncio.to_thread(answer_text, suggestion_text, lang, history)
 
-        # For Uzbek: translate response back to Uzbek
-        if lang == "uz":
-            response_text = translate_en_to_uz(response_text)
+        response_text, suggestions = await job.step("answer", compute_answer)
+        return suggestion_text, response_text, suggestions
 
-        # Save messages to history (save in user's language)
-        add_message(user_id, "user", suggestion_text)
-        add_message(user_id, "assistant", response_text)
-
-        # Generate new suggestions
-        suggestions = generate_suggestions(suggestion_text, response_text, language=lang)
-        suggestion_keyboard = create_suggestion_keyboard(suggestions, user_id)
-
-        # Send response with new suggestion buttons (Markdown with fallback)
-        if len(response_text) > 4000:
-            # Split long messages, add buttons to last one
-            chunks = [response_text[i:i+4000] for i in range(0, len(response_text), 4000)]
-            for i, chunk in enumerate(chunks):
-                if i == len(chunks) - 1:  # Last chunk
-                    await send_markdown_message(query.message, chunk, reply_markup=suggestion_keyboard)
-                else:
-                    await send_markdown_message(query.message, chunk)
-        else:
-            await send_markdown_message(query.message, response_text, reply_markup=suggestion_keyboard)
-
-    except Exception as e:
-        logger.error(f"❌ Error: {str(e)}", exc_info=True)
-        error_msg = get_message(lang, "error", error=str(e)[:200])
-        await query.message.reply_text(error_msg)
-    finally:
-        # Cleanup thinking message
-        try:
-            await thinking_msg.delete()
-        except Exception:
-            pass
+    await run_pipeline(job, "button", query.message, lang, "thinking", answer)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -215,8 +394,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show bot statistics in user's language"""
+    """Show bot statistics in user's language (live runtime numbers for admins)"""
     user_id = update.effective_user.id
+
+    if user_id in ADMIN_USER_IDS:
+        report = await asyncio.to_thread(build_stats_report)
+        await update.message.reply_text(report)
+        return
+
     lang = get_user_language(user_id)
 
     if not lang:
@@ -243,9 +428,12 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     clear_user_history(user_id)
+    speculator.cancel_user(user_id)
     await update.message.reply_text(get_message(lang, "history_cleared"))
 
 
+@traced("text")
+@lifecycle.drained
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle medical questions from users"""
     user_id = update.effective_user.id
@@ -263,64 +451,32 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     logger.info(f"📩 Question from {user_name} (ID:{user_id}, lang:{lang}): {user_message[:50]}...")
+    annotate(language=lang)
 
-    # Show typing indicator and send a temporary "thinking" message
-    await update.message.chat.send_action(action="typing")
-    thinking_msg = await update.message.reply_text(get_message(lang, "thinking"))
+    job = await jobs.begin(update)
+    if job is None:
+        return
 
-    try:
-        # Get conversation history
-        history = get_conversation_history(user_id)
+    # A new question makes pre-computed suggestion answers stale
+    speculator.cancel_user(user_id)
 
-        # For Uzbek: translate to English before sending to Gemini
-        message_for_llm = user_message
-        llm_lang = lang
-        if lang == "uz":
-            message_for_llm = translate_uz_to_en(user_message)
-            llm_lang = "en"  # Use English prompt for Gemini
+    async def answer(placeholder):
+        # Get conversation history
+        with span("history"):
+            history = await run_db(build_history, user_id)
 
         # Call Gemini with user's language and history
         logger.info("🔄 Calling Gemini endpoint...")
-        response_text = call_gemini(message_for_llm, language=llm_lang, history=history)
+        response_text, suggestions = await job.step(
+            "answer", lambda: asyncio.to_thread(answer_text, user_message, lang, history)
+        )
+        return user_message, response_text, suggestions
 
-        logger.info(f"✅ Response received ({len(response_text)} chars)")
-
-        # For Uzbek: translate response back to Uzbek
-        if lang == "uz":
-            response_text = translate_en_to_uz(response_text)
-
-        # Save messages to history (save in user's language)
-        add_message(user_id, "user", user_message)
-        add_message(user_id, "assistant", response_text)
-
-        # Generate follow-up suggestions using Gemini
-        suggestions = generate_suggestions(user_message, response_text, language=lang)
-        suggestion_keyboard = create_suggestion_keyboard(suggestions, user_id)
-
-        # Send response to user with suggestion buttons (Markdown with fallback)
-        if len(response_text) > 4000:
-            # Split long messages, add buttons to last one
-            chunks = [response_text[i:i+4000] for i in range(0, len(response_text), 4000)]
-            for i, chunk in enumerate(chunks):
-                if i == len(chunks) - 1:  # Last chunk
-                    await send_markdown_message(update.message, chunk, reply_markup=suggestion_keyboard)
-                else:
-                    await send_markdown_message(update.message, chunk)
-        else:
-            await send_markdown_message(update.message, response_text, reply_markup=suggestion_keyboard)
-
-    except Exception as e:
-        logger.error(f"❌ Error: {str(e)}", exc_info=True)
-        error_msg = get_message(lang, "error", error=str(e)[:200])
-        await update.message.reply_text(error_msg)
-    finally:
-        # Best-effort cleanup of the temporary thinking message
-        try:
-            await thinking_msg.delete()
-        except Exception:
-            pass
+    await run_pipeline(job, "text", update.message, lang, "thinking", answer)
 
 
+@traced("voice")
+@lifecycle.drained
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle voice messages from users"""
     user_id = update.effective_user.id
@@ -340,73 +496,65 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     logger.info(f"🎤 Voice from {user_name} (ID:{user_id}, lang:{lang}), duration: {voice.duration}s")
+    annotate(language=lang)
 
-    await update.message.chat.send_action(action="typing")
-    status_msg = await update.message.reply_text(get_message(lang, "transcribing"))
-
-    try:
-        voice_file = await context.bot.get_file(voice.file_id)
-        audio_bytes = await voice_file.download_as_bytearray()
-        mime_type = voice.mime_type or "audio/ogg"
+    job = await jobs.begin(update)
+    if job is None:
+        return
 
-        transcript = transcribe_audio(
-            audio_bytes=audio_bytes,
-            mime_type=mime_type,
-            language_hint=lang
-        ).strip()
+    # A new question makes pre-computed suggestion answers stale
+    speculator.cancel_user(user_id)
 
-        if not transcript:
-            await update.message.reply_text(get_message(lang, "no_transcript"))
-            return
+    async def compute_transcript():
+        # Forwarded voice notes and retries reuse the cached transcript
+        transcript = transcript_cache.get(voice.file_unique_id)
+        if transcript is not None:
+            logger.info(f"♻️ Using cached transcript for {voice.file_unique_id}")
+            return transcript
 
-        try:
-            await status_msg.edit_text(get_message(lang, "thinking"))
-        except Exception:
-            pass
+        with span("download"):
+            voice_file = await context.bot.get_file(voice.file_id)
+            audio_bytes = await voice_file.download_as_bytearray()
+        mime_type = voice.mime_type or "audio/ogg"
 
-        history = get_conversation_history(user_id)
+        with span("encode"):
+            audio_base64 = await cpu_pool.run(encode_base64, audio_bytes)
 
-        message_for_llm = transcript
-        llm_lang = lang
-        if lang == "uz":
-            message_for_llm = translate_uz_to_en(transcript)
-            llm_lang = "en"
+        with span("transcribe"):
+            transcript = (await asyncio.to_thread(
+                transcribe_audio,
+                audio_base64=audio_base64,
+                mime_type=mime_type,
+                language_hint=lang
+            )).strip()
 
-        logger.info("🔄 Calling Gemini endpoint (voice transcript)...")
-        response_text = call_gemini(message_for_llm, language=llm_lang, history=history)
+        if transcript:
+            transcript_cache.set(voice.file_unique_id, transcript)
+        return transcript
 
-        logger.info(f"✅ Response received ({len(response_text)} chars)")
+    async def answer(placeholder):
+        transcript = await job.step("transcript", compute_transcript)
 
-        if lang == "uz":
-            response_text = translate_en_to_uz(response_text)
+        if not transcript:
+            await send_status(update.message, get_message(lang, "no_transcript"), placeholder)
+            return None
 
-        add_message(user_id, "user", transcript)
-        add_message(user_id, "assistant", response_text)
+        await placeholder.update(get_message(lang, "thinking"))
 
-        suggestions = generate_suggestions(transcript, response_text, language=lang)
-        suggestion_keyboard = create_suggestion_keyboard(suggestions, user_id)
+        with span("history"):
+            history = await run_db(build_history, user_id)
 
-        if len(response_text) > 4000:
-            chunks = [response_text[i:i+4000] for i in range(0, len(response_text), 4000)]
-            for i, chunk in enumerate(chunks):
-                if i == len(chunks) - 1:
-                    await send_markdown_message(update.message, chunk, reply_markup=suggestion_keyboard)
-                else:
-                    await send_markdown_message(update.message, chunk)
-        else:
-            await send_markdown_message(update.message, response_text, reply_markup=suggestion_keyboard)
+        logger.info("🔄 Calling Gemini endpoint (voice transcript)...")
+        response_text, suggestions = await job.step(
+            "answer", lambda: asyncio.to_thread(answer_text, transcript, lang, history)
+        )
+        return transcript, response_text, suggestions
 
-    except Exception as e:
-        logger.error(f"❌ Error: {str(e)}", exc_info=True)
-        error_msg = get_message(lang, "error", error=str(e)[:200])
-        await update.message.reply_text(error_msg)
-    finally:
-        try:
-            await status_msg.delete()
-        except Exception:
-            pass
+    await run_pipeline(job, "voice", update.message, lang, "transcribing", answer)
 
 
+@traced("image")
+@lifecycle.drained
 async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle medical images from users"""
     user_id = update.effective_user.id
@@ -426,73 +574,39 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caption = update.message.caption or ""
 
     logger.info(f"🖼️ Image from {user_name} (ID:{user_id}, lang:{lang}), caption: {caption[:50] if caption else 'None'}...")
+    annotate(language=lang)
 
-    # Show typing indicator and send a temporary "thinking" message
-    await update.message.chat.send_action(action="typing")
-    thinking_msg = await update.message.reply_text(get_message(lang, "thinking"))
+    job = await jobs.begin(update)
+    if job is None:
+        return
 
-    try:
+    # A new question makes pre-computed suggestion answers stale
+    speculator.cancel_user(user_id)
+
+    async def compute_answer():
         # Get the largest photo (best quality)
         photo = update.message.photo[-1]
 
         # Download the photo
-        photo_file = await context.bot.get_file(photo.file_id)
-        image_bytes = await photo_file.download_as_bytearray()
+        with span("download"):
+            photo_file = await context.bot.get_file(photo.file_id)
+            image_bytes = await photo_file.download_as_bytearray()
 
-        # Convert to base64
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        # Convert to base64 on the CPU pool, off the event loop
+        with span("encode"):
+            image_base64 = await cpu_pool.run(encode_base64, image_bytes)
 
         # Get conversation history
-        history = get_conversation_history(user_id)
-
-        # For Uzbek: translate caption to English before sending to Gemini
-        caption_for_llm = caption
-        llm_lang = lang
-        if lang == "uz" and caption:
-            caption_for_llm = translate_uz_to_en(caption)
-            llm_lang = "en"  # Use English prompt for Gemini
-        elif lang == "uz":
-            llm_lang = "en"
+        with span("history"):
+            history = await run_db(build_history, user_id)
 
         logger.info("🔄 Calling Gemini endpoint with image...")
-        response_text = call_gemini_with_image(
-            image_base64, caption_for_llm, language=llm_lang, history=history
-        )
+        return await asyncio.to_thread(answer_image, image_base64, caption, lang, history)
 
-        logger.info(f"✅ Response received ({len(response_text)} chars)")
-
-        # For Uzbek: translate response back to Uzbek
-        if lang == "uz":
-            response_text = translate_en_to_uz(response_text)
-
-        # Save to history (store caption or default message, not the image)
-        user_msg = caption or get_message(lang, "analyze_image")
-        add_message(user_id, "user", f"[Image] {user_msg}")
-        add_message(user_id, "assistant", response_text)
-
-        # Generate follow-up suggestions using Gemini
-        suggestions = generate_suggestions(user_msg, response_text, language=lang)
-        suggestion_keyboard = create_suggestion_keyboard(suggestions, user_id)
-
-        # Send response to user with suggestion buttons (Markdown with fallback)
-        if len(response_text) > 4000:
-            # Split long messages, add buttons to last one
-            chunks = [response_text[i:i+4000] for i in range(0, len(response_text), 4000)]
-            for i, chunk in enumerate(chunks):
-                if i == len(chunks) - 1:  # Last chunk
-                    await send_markdown_message(update.message, chunk, reply_markup=suggestion_keyboard)
-                else:
-                    await send_markdown_message(update.message, chunk)
-        else:
-            await send_markdown_message(update.message, response_text, reply_markup=suggestion_keyboard)
+    async def answer(placeholder):
+        # A resumed job skips the download as well as the model call
+        response_text, suggestions = await job.step("answer", compute_answer)
+        # Save to history the caption or a default message, not the image
+        return caption or get_message(lang, "analyze_image"), response_text, suggestions
 
-    except Exception as e:
-        logger.error(f"❌ Error: {str(e)}", exc_info=True)
-        error_msg = get_message(lang, "error", error=str(e)[:200])
-        await update.message.reply_text(error_msg)
-    finally:
-        # Best-effort cleanup of the temporary thinking message
-        try:
-            await thinking_msg.delete()
-        except Exception:
-            pass
+    await run_pipeline(job, "image", update.message, lang, "thinking", answer, saved_prefix="[Image] ")
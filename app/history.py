@@ -0,0 +1,130 @@
+# Token-budgeted conversation history with a rolling summary of older turns
+import time
+
+from .breaker import circuit_breaker
+from .cache import LRUCache
+from .config import GEMINI_API_KEY, HISTORY_TOKEN_BUDGET, MAX_MEMORY_MESSAGES, logger
+from .database import get_messages_since, get_history_summary, set_history_summary
+from .gemini import summarize_conversation
+
+CHARS_PER_TOKEN = 4  # Rough average for Gemini tokenizers across uz/ru/en text
+
+SUMMARY_HEADER = "[Summary of the earlier consultation]"
+SUMMARY_ACK = "Understood. I will take this earlier context into account."
+
+MAX_FOLD = MAX_MEMORY_MESSAGES * 2  # Messages folded per summarization call, oldest first
+RETRY_AFTER_FAILURE = 300  # Seconds before compacting a user's history again after a failed summary
+
+_retry_at = LRUCache(10000)  # user_id -> monotonic time compaction may run again
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate without a tokenizer round trip"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _truncate(text: str, tokens: int) -> str:
+    """Cut text down to roughly `tokens` tokens"""
+    limit = max(0, tokens - 1) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:max(0, limit - 1)].rstrip() + "…"
+
+
+def _last_turn(messages: list, budget: int) -> list:
+    """The newest doctor turn and the replies after it, truncated to share the budget"""
+    starts = [i for i, msg in enumerate(messages) if msg["role"] == "user"]
+    if not starts:
+        return []
+    turn = messages[starts[-1]:]
+    share = budget // len(turn)
+    return [{**msg, "content": _truncate(msg["content"], share)} for msg in turn]
+
+
+def _fit_newest(messages: list, budget: int) -> list:
+    """
+    Keep the newest messages whose total size fits the token budget. If not
+    even the last turn fits, it is kept truncated rather than dropping all
+    context.
+    """
+    kept = []
+    used = 0
+    for msg in reversed(messages):
+        tokens = estimate_tokens(msg["content"])
+        if used + tokens > budget:
+            break
+        kept.append(msg)
+        used += tokens
+    kept.reverse()
+
+    # History must open with a doctor turn
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    if not kept:
+        kept = _last_turn(messages, budget)
+    return kept
+
+
+def build_history(user_id: int) -> list:
+    """
+    Build the history sent to the model: the rolling summary (if any)
+    followed by the newest turns that fit HISTORY_TOKEN_BUDGET verbatim.
+
+    Returns:
+        List of messages [{"role": "user/assistant", "content": "..."}]
+    """
+    summary, last_message_id = get_history_summary(user_id)
+    messages = get_messages_since(user_id, last_message_id, MAX_MEMORY_MESSAGES)
+
+    budget = HISTORY_TOKEN_BUDGET
+    history = []
+    if summary:
+        budget -= estimate_tokens(summary)
+        history.append({"role": "user", "content": f"{SUMMARY_HEADER}\n{summary}"})
+        history.append({"role": "assistant", "content": SUMMARY_ACK})
+
+    for msg in _fit_newest(messages, budget):
+        history.append({"role": msg["role"], "content": msg["content"]})
+    return history
+
+
+def compact_history(user_id: int):
+    """
+    Fold older turns into the rolling summary once the verbatim history
+    outgrows its budget. Folds down to half the budget so that compaction
+    (one summarization call) runs every few turns rather than every turn.
+
+    Skipped without a Gemini key or while the summary circuit is open, and
+    for RETRY_AFTER_FAILURE seconds after a failed summary. One call folds
+    at most MAX_FOLD messages, so turns that piled up meanwhile are caught
+    up over several compactions instead of one ever-growing prompt.
+    """
+    if not GEMINI_API_KEY or circuit_breaker("summary").is_open():
+        return
+    if _retry_at.get(user_id, 0) > time.monotonic():
+        return
+
+    summary, last_message_id = get_history_summary(user_id)
+    # Every unsummarized message (-1: no limit); storage keeps at most MAX_MEMORY_MESSAGES * 4
+    messages = get_messages_since(user_id, last_message_id, -1)
+
+    total = sum(estimate_tokens(msg["content"]) for msg in messages)
+    if total <= HISTORY_TOKEN_BUDGET and len(messages) <= MAX_MEMORY_MESSAGES:
+        return
+
+    keep = _fit_newest(messages[-(MAX_MEMORY_MESSAGES // 2):], HISTORY_TOKEN_BUDGET // 2)
+    fold = messages[:len(messages) - len(keep)][:MAX_FOLD]
+    if not fold:
+        return
+
+    new_summary = summarize_conversation(summary, fold)
+    if not new_summary:
+        logger.warning(
+            f"⚠️ Could not compact history for user {user_id}, keeping raw turns for {RETRY_AFTER_FAILURE}s"
+        )
+        _retry_at.set(user_id, time.monotonic() + RETRY_AFTER_FAILURE)
+        return
+    _retry_at.pop(user_id)
+
+    set_history_summary(user_id, new_summary, fold[-1]["id"])
+    logger.info(f"🗜️ Folded {len(fold)} messages into summary for user {user_id}")
@@ -0,0 +1,171 @@
+# Durable job queue: pipeline stage results checkpointed per update
+import asyncio
+import inspect
+import json
+import time
+from typing import Optional
+
+from telegram import Update
+
+from .config import JOB_QUEUE, JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_RESUME_WINDOW, JOB_SWEEP_INTERVAL, logger
+from .database import claim_job, record_job, save_job, finish_job, release_job, get_resumable_jobs
+from .metrics import counter
+from .workers import run_db
+
+jobs_total = counter("jobs_total", "Pipeline jobs by outcome", ("outcome",))
+
+
+class StageFailed(Exception):
+    """A stage returned an "Error: ..." answer; it is not checkpointed, so a retry runs it again"""
+
+    def __init__(self, stage: str, error: str):
+        self.stage = stage
+        super().__init__(error)
+
+
+def _error_answer(value) -> str | None:
+    """The error text if a stage result is an "Error: ..." answer (the model clients return these instead of raising)"""
+    text = value[0] if isinstance(value, tuple) and value else value
+    if isinstance(text, str) and text.startswith("Error:"):
+        return text
+    return None
+
+
+class Job:
+    """One update's pipeline; finished stages are stored and skipped on a retry"""
+
+    def __init__(self, queue, update_id: int, user_id: int, partial: dict = None):
+        self.queue = queue
+        self.update_id = update_id
+        self.user_id = user_id
+        self.partial = partial or {}
+
+    def has(self, stage: str) -> bool:
+        return stage in self.partial
+
+    async def save(self, stage: str, value=True):
+        """Checkpoint a stage result (must be JSON-serializable)"""
+        self.partial[stage] = value
+        if self.queue.enabled:
+            now = time.time()
+            await run_db(
+                save_job, self.user_id, self.update_id, json.dumps(self.partial), now, now + self.queue.lease
+            )
+
+    async def step(self, stage: str, compute):
+        """
+        Return the stored result of `stage`, or run `compute()` (sync or async) and store it.
+
+        Raises:
+            StageFailed: if the result is an "Error: ..." answer
+        """
+        if stage in self.partial:
+            return self.partial[stage]
+        value = compute()
+        if inspect.isawaitable(value):
+            value = await value
+        error = _error_answer(value)
+        if error:
+            raise StageFailed(stage, error)
+        await self.save(stage, value)
+        return value
+
+    async def finish(self, state: str = "done"):
+        """Mark the job done (the reply went out) or failed (an error message did)"""
+        self.queue._active.pop(self.update_id, None)
+        jobs_total.inc(outcome=state)
+        if self.queue.enabled:
+            await run_db(finish_job, self.user_id, self.update_id, state, time.time())
+
+
+class JobQueue:
+    """
+    Every pipeline update becomes a job row keyed by update_id, leased to the
+    worker running it. A redelivered update whose job is finished or still
+    leased is skipped. Jobs abandoned by a crash or a shutdown are put back
+    on the application's update queue by a periodic sweep. They then resume
+    through the normal handlers, past the stages already checkpointed.
+    """
+
+    def __init__(self, enabled: bool = True, lease: int = 600, max_attempts: int = 3,
+                 resume_window: int = 3600, sweep_interval: int = 60):
+        self.enabled = enabled
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.resume_window = resume_window
+        self.sweep_interval = sweep_interval
+        self._active = {}  # update_id -> Job running in this process
+
+    @staticmethod
+    def _user_id(update: Update) -> int:
+        return update.effective_user.id if update.effective_user else 0
+
+    async def begin(self, update: Update) -> Optional[Job]:
+        """
+        Claim the job for an update.
+
+        Returns:
+            The Job (possibly with stages already done), or None if the
+            update was already handled or is being handled elsewhere
+        """
+        user_id = self._user_id(update)
+        if not self.enabled:
+            return Job(self, update.update_id, user_id)
+
+        now = time.time()
+        claimed = await run_db(
+            claim_job, update.update_id, user_id, update.to_json(), now, now + self.lease, self.max_attempts
+        )
+        if claimed is None:
+            jobs_total.inc(outcome="duplicate")
+            logger.info(f"♻️ Update {update.update_id} already handled or in progress, skipping")
+            return None
+
+        partial, attempts = claimed
+        job = Job(self, update.update_id, user_id, json.loads(partial))
+        if attempts > 1:
+            jobs_total.inc(outcome="resumed")
+            logger.info(f"♻️ Resuming update {update.update_id} (attempt {attempts}, done: {list(job.partial) or 'none'})")
+        else:
+            jobs_total.inc(outcome="started")
+        self._active[update.update_id] = job
+        return job
+
+    def record(self, update: Update):
+        """Persist an update that will not be handled by this process"""
+        if self.enabled:
+            record_job(update.update_id, self._user_id(update), update.to_json(), time.time())
+
+    def release_active(self):
+        """Hand this process's unfinished jobs to the next worker without waiting for the lease"""
+        if self.enabled:
+            for job in list(self._active.values()):
+                release_job(job.user_id, job.update_id)
+        self._active.clear()
+
+    async def resume_abandoned(self, application):
+        """Put unfinished, unleased jobs back on the update queue"""
+        now = time.time()
+        payloads = await run_db(
+            get_resumable_jobs, now, now - self.resume_window, self.max_attempts
+        )
+        resumed = 0
+        for payload in payloads:
+            update = Update.de_json(json.loads(payload), application.bot)
+            if update.update_id not in self._active:
+                await application.update_queue.put(update)
+                resumed += 1
+        if resumed:
+            logger.info(f"♻️ Re-queued {resumed} unfinished jobs")
+
+    async def run(self, application):
+        """Sweep for abandoned jobs until cancelled"""
+        while True:
+            try:
+                await self.resume_abandoned(application)
+            except Exception as e:
+                logger.error(f"❌ Job sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+
+jobs = JobQueue(JOB_QUEUE, JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_RESUME_WINDOW, JOB_SWEEP_INTERVAL)
@@ -0,0 +1,146 @@
+# Graceful shutdown: stop fetching updates, drain in-flight pipelines, flush buffers
+import asyncio
+import functools
+import signal
+import time
+
+from telegram.ext import ApplicationHandlerStop
+
+from .config import DRAIN_TIMEOUT, logger
+from .jobs import jobs
+from .speculation import speculator
+from .tracing import flush_traces
+from .usage import flush_usage
+from .workers import cpu_pool, run_db, shutdown_db
+
+
+class Lifecycle:
+    """
+    On SIGTERM/SIGINT, polling stops first so Telegram keeps undelivered
+    updates for the next instance. Pipelines that are running or already
+    queued then get up to `drain_timeout` seconds to finish and reply.
+    After that, what is left is cancelled and queued updates are dropped;
+    both stay in the job queue, so the next instance resumes them.
+    A second signal skips the drain.
+    """
+
+    def __init__(self, drain_timeout: float = 25):
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.expired = False
+        self._tasks = set()
+        self._shutdown_task = None
+        self._sweep_task = None
+
+    def drained(self, handler):
+        """Decorator for pipeline handlers: shutdown waits for them (up to the deadline)"""
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            # Own task, so the deadline can cancel the pipeline without
+            # cancelling the application's update fetcher that awaits it
+            task = asyncio.ensure_future(handler(update, context))
+            self._tasks.add(task)
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self._tasks.discard(task)
+
+            if task.cancelled():
+                logger.warning(f"⏹️ Update {update.update_id} abandoned at the shutdown deadline")
+                return None
+            return task.result()
+        wrapper.drained = True  # Copied onto outer decorators by functools.wraps
+        return wrapper
+
+    @staticmethod
+    def _is_pipeline(application, update) -> bool:
+        """Whether a drained (pipeline) handler would take this update"""
+        return any(
+            getattr(handler.callback, "drained", False) and handler.check_update(update)
+            for handler in application.handlers.get(0, [])
+        )
+
+    async def reject_after_deadline(self, update, context):
+        """Group -1 handler: once the drain deadline passed, drop updates still queued"""
+        if self.expired:
+            if self._is_pipeline(context.application, update):
+                logger.warning(f"⏹️ Update {update.update_id} dropped at shutdown, left for the next instance")
+                await run_db(jobs.record, update)
+            else:
+                logger.warning(f"⏹️ Update {update.update_id} dropped at shutdown")
+            raise ApplicationHandlerStop
+
+    # ==================== APPLICATION HOOKS ====================
+
+    async def start(self, application):
+        """post_init hook: take over the stop signals, start resuming abandoned jobs"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._on_signal, application)
+            except NotImplementedError:
+                logger.warning(f"⚠️ Cannot handle {sig.name} on this platform; shutdown will not drain")
+        if jobs.enabled:
+            self._sweep_task = asyncio.create_task(jobs.run(application))
+
+    def _on_signal(self, application):
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.create_task(self.drain(application))
+        else:
+            logger.warning("🛑 Second stop signal, stopping without waiting")
+            application.stop_running()
+
+    async def drain(self, application):
+        """Stop fetching updates, wait for in-flight work, then stop the application"""
+        if self.draining:
+            return
+        self.draining = True
+        deadline = time.monotonic() + self.drain_timeout
+
+        if self._sweep_task:
+            self._sweep_task.cancel()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+
+        logger.info(
+            f"🛑 Shutting down: {len(self._tasks)} in flight, "
+            f"{application.update_queue.qsize()} queued, waiting up to {self.drain_timeout:.0f}s"
+        )
+        # join() also covers updates already taken off the queue that are
+        # still running concurrently or waiting for their chat
+        try:
+            await asyncio.wait_for(application.update_queue.join(), max(0.0, deadline - time.monotonic()))
+            finished = True
+        except asyncio.TimeoutError:
+            finished = False
+
+        if not finished:
+            self.expired = True
+            logger.warning(
+                f"⚠️ Drain deadline passed: cancelling {len(self._tasks)} pipelines, "
+                f"dropping {application.update_queue.qsize()} queued updates"
+            )
+            cancelled = list(self._tasks)
+            for task in cancelled:
+                task.cancel()
+            await asyncio.wait(cancelled, timeout=1)
+            await run_db(jobs.release_active)
+        else:
+            logger.info("✅ All in-flight updates finished")
+
+        application.stop_running()
+
+    async def flush(self, application):
+        """post_shutdown hook: persist everything still buffered in memory"""
+        speculator.cancel_all()
+        await run_db(flush_usage)
+        flush_traces()
+        await asyncio.to_thread(cpu_pool.shutdown)
+        await asyncio.to_thread(shutdown_db)
+        logger.info("💾 Usage and traces flushed")
+
+
+lifecycle = Lifecycle(DRAIN_TIMEOUT)
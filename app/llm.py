@@ -1,7 +1,184 @@
 # Gemini 2.5 Flash LLM for medical chat
+import json
+from functools import lru_cache
+
 import requests
-from .config import GEMINI_API_KEY, logger
-from .prompts import get_system_prompt
+from .breaker import CircuitOpenError
+from .config import GEMINI_API_KEY, GEMINI_MODEL, logger
+from .gemini_client import (
+    GeminiAPIError, generation_config, history_to_contents, payload_template, generate
+)
+from .payloads import PayloadTemplate
+from .prompt_cache import prompt_cache
+from .prompts import SYSTEM_PROMPTS
+
+
+CHAT_CONFIG = generation_config(temperature=0.7, max_output_tokens=4096)
+
+# Combined mode: the answer and two follow-up questions in one structured response
+ANSWER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "answer": {"type": "STRING"},
+        "suggestions": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"},
+            "minItems": 2,
+            "maxItems": 2
+        }
+    },
+    "required": ["answer", "suggestions"],
+    "propertyOrdering": ["answer", "suggestions"]
+}
+COMBINED_CONFIG = generation_config(
+    temperature=0.7,
+    max_output_tokens=4096,
+    responseMimeType="application/json",
+    responseSchema=ANSWER_SCHEMA
+)
+
+SUGGESTION_LANGUAGES = {
+    "uz": "Uzbek (Latin script)",
+    "ru": "Russian",
+    "en": "English"
+}
+
+# Appended to the current user turn (not the system prompt, so that stays cacheable)
+COMBINED_INSTRUCTION = (
+    "Respond as JSON. Put your complete answer, formatted exactly as you normally would, in \"answer\". "
+    "In \"suggestions\", write 2 short, professional follow-up questions the doctor might ask next "
+    "(max 50 characters each), in {language}."
+)
+
+# Inline-system-prompt payload templates for every language, built at startup
+CHAT_TEMPLATES = {
+    language: payload_template(CHAT_CONFIG, system_prompt=prompt)
+    for language, prompt in SYSTEM_PROMPTS.items()
+}
+COMBINED_TEMPLATES = {
+    language: payload_template(COMBINED_CONFIG, system_prompt=prompt)
+    for language, prompt in SYSTEM_PROMPTS.items()
+}
+
+
+@lru_cache(maxsize=16)
+def _cached_chat_template(cached_content: str, combined: bool = False) -> PayloadTemplate:
+    """Template referencing a cachedContent (names change on re-registration)"""
+    return payload_template(COMBINED_CONFIG if combined else CHAT_CONFIG, cached_content=cached_content)
+
+
+def _cache_rejected(error: GeminiAPIError) -> bool:
+    """Whether the API refused the request because its cachedContent expired or is gone"""
+    body = error.body.lower()
+    return error.status_code in (400, 403, 404) and ("cachedcontent" in body or "cached content" in body)
+
+
+def _chat(contents: list, language: str, combined: bool = False) -> str:
+    """Send chat contents with the language's system prompt and return the answer text"""
+    templates = COMBINED_TEMPLATES if combined else CHAT_TEMPLATES
+    inline_template = templates.get(language, templates["en"])
+    try:
+        cached_content = prompt_cache.get(language)
+        template = _cached_chat_template(cached_content, combined) if cached_content else inline_template
+
+        try:
+            result = generate(template.render(contents), timeout=120, stage="answer")
+        except GeminiAPIError as e:
+            if not cached_content or not _cache_rejected(e):
+                raise
+            # Cache expired or was evicted server-side: re-register next time, answer inline now
+            logger.warning(f"⚠️ Cached system prompt rejected ({e.status_code}), retrying inline")
+            prompt_cache.invalidate(language)
+            result = generate(inline_template.render(contents), timeout=120, stage="answer")
+
+        if not result.has_candidates:
+            return "Error: No response from model"
+
+        if not result.text:
+            logger.error("❌ Empty response from Gemini")
+            return "Error: Empty response from model"
+
+        return result.text
+
+    except GeminiAPIError as e:
+        logger.error(f"❌ Gemini API error: {e.status_code} - {e.body}")
+        return f"Error: API returned {e.status_code}"
+    except requests.exceptions.Timeout:
+        logger.error("❌ Gemini API timeout")
+        return "Error: Request timeout"
+    except CircuitOpenError as e:
+        logger.warning(f"⚠️ {e}")
+        return "Error: Model temporarily unavailable"
+    except Exception as e:
+        logger.error(f"❌ Gemini error: {e}", exc_info=True)
+        return f"Error: {str(e)}"
+
+
+def _chat_combined(contents: list, language: str, suggestion_language: str) -> tuple:
+    """
+    Like _chat, but the model also returns follow-up suggestions.
+
+    Returns:
+        (response_text, suggestions); suggestions is [] on errors
+    """
+    instruction = COMBINED_INSTRUCTION.format(
+        language=SUGGESTION_LANGUAGES.get(suggestion_language, SUGGESTION_LANGUAGES["en"])
+    )
+    contents[-1]["parts"].append({"text": instruction})
+
+    text = _chat(contents, language, combined=True)
+    if text.startswith("Error:"):
+        return text, []
+
+    try:
+        data = json.loads(text)
+        answer = str(data.get("answer", "")).strip()
+        suggestions = data.get("suggestions", [])
+        if not isinstance(suggestions, list):
+            suggestions = []
+        # Only non-empty strings; a string instead of a list would otherwise be sliced into letters
+        suggestions = [s.strip()[:50] for s in suggestions if isinstance(s, str) and s.strip()][:2]
+    except (json.JSONDecodeError, AttributeError) as e:
+        answer, suggestions = "", []
+        logger.warning(f"⚠️ Could not parse combined response ({e}), retrying without suggestions")
+
+    if not answer:
+        # Truncated or malformed JSON: fall back to a plain answer
+        contents[-1]["parts"].pop()
+        return _chat(contents, language), []
+
+    return answer, suggestions
+
+
+def _text_contents(message: str, history: list = None) -> list:
+    """Conversation history followed by the current message"""
+    contents = history_to_contents(history)
+    contents.append({
+        "role": "user",
+        "parts": [{"text": message}]
+    })
+    return contents
+
+
+def _image_contents(image_base64: str, caption: str = "", history: list = None) -> list:
+    """Conversation history (text only) followed by the image message"""
+    contents = history_to_contents(history)
+
+    image_prompt = caption if caption else "Please analyze this medical image and provide clinical insights."
+
+    contents.append({
+        "role": "user",
+        "parts": [
+            {"text": image_prompt},
+            {
+                "inline_data": {
+                    "mime_type": "image/jpeg",
+                    "data": image_base64
+                }
+            }
+        ]
+    })
+    return contents
 
 
 def call_gemini(message: str, language: str = "en", history: list = None) -> str:
@@ -20,84 +197,12 @@ def call_gemini(message: str, language: str = "en", history: list = None) -> str
         logger.error("❌ GEMINI_API_KEY not set")
         return "Error: API key not configured"
 
-    try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-
-        # Get system prompt for the language
-        system_prompt = get_system_prompt(language)
-
-        # Build conversation contents
-        contents = []
-
-        # Add conversation history
-        if history:
-            for msg in history:
-                role = "user" if msg["role"] == "user" else "model"
-                contents.append({
-                    "role": role,
-                    "parts": [{"text": msg["content"]}]
-                })
-
-        # Add current message
-        contents.append({
-            "role": "user",
-            "parts": [{"text": message}]
-        })
-
-        payload = {
-            "systemInstruction": {
-                "parts": [{"text": system_prompt}]
-            },
-            "contents": contents,
-            "generationConfig": {
-                "temperature": 0.7,
-                "maxOutputTokens": 4096,
-                "thinkingConfig": {
-                    "thinkingBudget": 0
-                }
-            }
-        }
-
-        logger.info(f"🔄 Calling Gemini 2.5 Flash (lang: {language}, history: {len(history) if history else 0} msgs)...")
-
-        response = requests.post(url, json=payload, timeout=120)
-
-        if response.status_code != 200:
-            logger.error(f"❌ Gemini API error: {response.status_code} - {response.text[:500]}")
-            return f"Error: API returned {response.status_code}"
-
-        result = response.json()
-        candidates = result.get("candidates", [])
-
-        if not candidates:
-            logger.error(f"❌ No candidates in response: {result}")
-            return "Error: No response from model"
-
-        parts = candidates[0].get("content", {}).get("parts", [])
-
-        # Collect text parts (skip thinking parts)
-        text_parts = []
-        for part in parts:
-            if "thought" in part:
-                continue
-            if "text" in part:
-                text_parts.append(part.get("text", ""))
-
-        response_text = "\n".join(text_parts).strip()
-
-        if not response_text:
-            logger.error("❌ Empty response from Gemini")
-            return "Error: Empty response from model"
+    logger.info(f"🔄 Calling {GEMINI_MODEL} (lang: {language}, history: {len(history) if history else 0} msgs)...")
 
+    response_text = _chat(_text_contents(message, history), language)
+    if not response_text.startswith("Error:"):
         logger.info(f"✅ Gemini response received ({len(response_text)} chars)")
-        return response_text
-
-    except requests.exceptions.Timeout:
-        logger.error("❌ Gemini API timeout")
-        return "Error: Request timeout"
-    except Exception as e:
-        logger.error(f"❌ Gemini error: {e}", exc_info=True)
-        return f"Error: {str(e)}"
+    return response_text
 
 
 def call_gemini_with_image(image_base64: str, caption: str = "", language: str = "en", history: list = None) -> str:
@@ -117,91 +222,68 @@ def call_gemini_with_image(image_base64: str, caption: str = "", language: str =
         logger.error("❌ GEMINI_API_KEY not set")
         return "Error: API key not configured"
 
-    try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-
-        # Get system prompt for the language
-        system_prompt = get_system_prompt(language)
-
-        # Build conversation contents
-        contents = []
-
-        # Add conversation history (text only)
-        if history:
-            for msg in history:
-                role = "user" if msg["role"] == "user" else "model"
-                contents.append({
-                    "role": role,
-                    "parts": [{"text": msg["content"]}]
-                })
-
-        # Build the image message
-        image_prompt = caption if caption else "Please analyze this medical image and provide clinical insights."
-
-        contents.append({
-            "role": "user",
-            "parts": [
-                {"text": image_prompt},
-                {
-                    "inline_data": {
-                        "mime_type": "image/jpeg",
-                        "data": image_base64
-                    }
-                }
-            ]
-        })
-
-        payload = {
-            "systemInstruction": {
-                "parts": [{"text": system_prompt}]
-            },
-            "contents": contents,
-            "generationConfig": {
-                "temperature": 0.7,
-                "maxOutputTokens": 4096,
-                "thinkingConfig": {
-                    "thinkingBudget": 0
-                }
-            }
-        }
+    logger.info(f"🔄 Calling {GEMINI_MODEL} with image (lang: {language})...")
 
-        logger.info(f"🔄 Calling Gemini 2.5 Flash with image (lang: {language})...")
+    response_text = _chat(_image_contents(image_base64, caption, history), language)
+    if not response_text.startswith("Error:"):
+        logger.info(f"✅ Gemini image response received ({len(response_text)} chars)")
+    return response_text
 
-        response = requests.post(url, json=payload, timeout=120)
 
-        if response.status_code != 200:
-            logger.error(f"❌ Gemini API error: {response.status_code} - {response.text[:500]}")
-            return f"Error: API returned {response.status_code}"
+def call_gemini_combined(
+    message: str,
+    language: str = "en",
+    history: list = None,
+    suggestion_language: str = None
+) -> tuple:
+    """
+    Call Gemini for medical chat and get follow-up suggestions in the same response.
 
-        result = response.json()
-        candidates = result.get("candidates", [])
+    Args:
+        message: User's message
+        language: Language code of the system prompt (uz, ru, en)
+        history: List of previous messages
+        suggestion_language: Language for the suggestions (defaults to language)
 
-        if not candidates:
-            logger.error(f"❌ No candidates in response: {result}")
-            return "Error: No response from model"
+    Returns:
+        (response_text, suggestions)
+    """
+    if not GEMINI_API_KEY:
+        logger.error("❌ GEMINI_API_KEY not set")
+        return "Error: API key not configured", []
 
-        parts = candidates[0].get("content", {}).get("parts", [])
+    logger.info(f"🔄 Calling {GEMINI_MODEL} with suggestions (lang: {language}, history: {len(history) if history else 0} msgs)...")
 
-        # Collect text parts (skip thinking parts)
-        text_parts = []
-        for part in parts:
-            if "thought" in part:
-                continue
-            if "text" in part:
-                text_parts.append(part.get("text", ""))
+    response_text, suggestions = _chat_combined(
+        _text_contents(message, history), language, suggestion_language or language
+    )
+    if not response_text.startswith("Error:"):
+        logger.info(f"✅ Gemini response received ({len(response_text)} chars, {len(suggestions)} suggestions)")
+    return response_text, suggestions
 
-        response_text = "\n".join(text_parts).strip()
 
-        if not response_text:
-            logger.error("❌ Empty response from Gemini")
-            return "Error: Empty response from model"
+def call_gemini_with_image_combined(
+    image_base64: str,
+    caption: str = "",
+    language: str = "en",
+    history: list = None,
+    suggestion_language: str = None
+) -> tuple:
+    """
+    Call Gemini with an image and get follow-up suggestions in the same response.
 
-        logger.info(f"✅ Gemini image response received ({len(response_text)} chars)")
-        return response_text
+    Returns:
+        (response_text, suggestions)
+    """
+    if not GEMINI_API_KEY:
+        logger.error("❌ GEMINI_API_KEY not set")
+        return "Error: API key not configured", []
 
-    except requests.exceptions.Timeout:
-        logger.error("❌ Gemini API timeout")
-        return "Error: Request timeout"
-    except Exception as e:
-        logger.error(f"❌ Gemini error: {e}", exc_info=True)
-        return f"Error: {str(e)}"
+    logger.info(f"🔄 Calling {GEMINI_MODEL} with image and suggestions (lang: {language})...")
+
+    response_text, suggestions = _chat_combined(
+        _image_contents(image_base64, caption, history), language, suggestion_language or language
+    )
+    if not response_text.startswith("Error:"):
+        logger.info(f"✅ Gemini image response received ({len(response_text)} chars, {len(suggestions)} suggestions)")
+    return response_text, suggestions
@@ -1,19 +1,73 @@
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+
 import requests
-from google.auth import default
-from google.auth.transport.requests import Request
 
+from .breaker import circuit_breaker
 from .config import (
-    PROJECT_ID, LOCATION, ENDPOINT_ID, DEDICATED_ENDPOINT_DNS, logger
+    PROJECT_ID, LOCATION, ENDPOINT_ID, MEDGEMMA_API_BASE, MEDGEMMA_ACCESS_TOKEN,
+    MEDGEMMA_BATCH_WINDOW_MS, MEDGEMMA_BATCH_SIZE, MEDGEMMA_MAX_IN_FLIGHT, logger
 )
-from .prompts import get_system_prompt
+from .metrics import counter, histogram
+from .payloads import to_json_bytes
+from .prompts import SYSTEM_PROMPTS
+
+PREDICT_URL = f"{MEDGEMMA_API_BASE}/v1/projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/{ENDPOINT_ID}:predict"
+
+medgemma_requests = counter("medgemma_requests_total", "MedGemma :predict calls", ("status",))
+medgemma_batch_size = histogram(
+    "medgemma_batch_size", "Instances per MedGemma :predict call", buckets=(1, 2, 4, 8, 16, 32)
+)
+medgemma_seconds = histogram("medgemma_request_seconds", "MedGemma :predict call latency")
+
+# Serialized start of a chatCompletions instance, up to and including the
+# language's system message; per request only the chat messages are appended
+_INSTANCE_PREFIXES = {
+    language: (
+        b'{"@requestFormat":"chatCompletions","messages":['
+        + to_json_bytes({"role": "system", "content": prompt})
+    )
+    for language, prompt in SYSTEM_PROMPTS.items()
+}
+
+
+def _render_instance(language: str, messages: list) -> bytes:
+    """Serialize one chatCompletions instance: system prompt + messages"""
+    prefix = _INSTANCE_PREFIXES.get(language, _INSTANCE_PREFIXES["en"])
+    body = b"".join(b"," + to_json_bytes(msg) for msg in messages)
+    return prefix + body + b"]}"
+
+
+def _render_predict_body(instances: list) -> bytes:
+    """Wrap serialized instances into a :predict request body"""
+    return b'{"instances":[' + b",".join(instances) + b"]}"
+
+
+_credentials = None
 
 
 def _get_credentials():
     """Get and refresh Google Cloud credentials"""
-    credentials, _ = default()
-    if not credentials.valid:
-        credentials.refresh(Request())
-    return credentials
+    # Imported here: google.auth is slow to import and only MedGemma needs it
+    from google.auth import default
+    from google.auth.transport.requests import Request
+
+    global _credentials
+    if _credentials is None:
+        _credentials, _ = default()
+    if not _credentials.valid:
+        _credentials.refresh(Request())
+    return _credentials
+
+
+def _headers() -> dict:
+    """Request headers with a bearer token (static for local stubs, else Google credentials)"""
+    token = MEDGEMMA_ACCESS_TOKEN or _get_credentials().token
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
 
 
 def _parse_response(result: dict) -> str:
@@ -28,6 +82,11 @@ def _parse_response(result: dict) -> str:
     else:
         return "Sorry, I couldn't generate a response."
 
+    return _parse_prediction(prediction)
+
+
+def _parse_prediction(prediction) -> str:
+    """Extract the answer text from one prediction"""
     # Extract content
     content = None
     if isinstance(prediction, dict):
@@ -51,6 +110,153 @@ def _parse_response(result: dict) -> str:
     return content
 
 
+# ==================== PREDICT ====================
+
+def _post_predict(instances: list, timeout: int) -> dict:
+    """
+    Send serialized instances in one :predict call.
+
+    Raises:
+        Exception: on a non-200 response
+        CircuitOpenError: without calling, while the endpoint's breaker is open
+    """
+    payload = _render_predict_body(instances)
+    medgemma_batch_size.observe(len(instances))
+
+    breaker = circuit_breaker("medgemma")
+    breaker.before_call()
+
+    started = time.monotonic()
+    try:
+        response = requests.post(PREDICT_URL, headers=_headers(), data=payload, timeout=timeout)
+    except Exception as e:
+        # Credential refresh errors too, so a half-open trial always gets an outcome
+        network = isinstance(e, requests.exceptions.RequestException)
+        medgemma_requests.inc(status="network_error" if network else "error")
+        breaker.record_failure(type(e).__name__)
+        raise
+    medgemma_seconds.observe(time.monotonic() - started)
+    medgemma_requests.inc(status=str(response.status_code))
+
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure(f"HTTP {response.status_code}")
+    else:
+        breaker.record_success(time.monotonic() - started, timeout)
+
+    if response.status_code != 200:
+        logger.error(f"❌ HTTP {response.status_code}: {response.text}")
+        raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
+
+    return response.json()
+
+
+class PredictBatcher:
+    """
+    Micro-batches concurrent :predict calls. The first instance waits up to
+    `window` seconds for others (or until `max_size` are pending); they all
+    go out as one multi-instance request, and each caller gets back the
+    prediction at its own index. An error fails every caller in the batch.
+
+    At most `max_in_flight` requests are outstanding. While the endpoint is
+    busy, new calls collect here instead of queueing on the GPU one by one,
+    so batches grow with load.
+    """
+
+    def __init__(self, window: float, max_size: int, max_in_flight: int = 4):
+        self.window = window
+        self.max_size = max_size
+        self.max_in_flight = max_in_flight
+        self._pending = []  # [(instance bytes, timeout, Future)]
+        self._ready = threading.Condition()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._dispatcher = None
+        self._senders = None
+
+    def predict(self, instance: bytes, timeout: int) -> str:
+        """
+        Queue one serialized instance and wait for its answer text.
+
+        Raises:
+            TimeoutError: if no answer came within twice `timeout` (queueing
+                behind busy batches, then the call itself)
+        """
+        future = Future()
+        with self._ready:
+            if self._dispatcher is None:
+                self._senders = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="medgemma")
+                self._dispatcher = threading.Thread(target=self._dispatch, name="medgemma-batcher", daemon=True)
+                self._dispatcher.start()
+            self._pending.append((instance, timeout, future))
+            self._ready.notify()
+        try:
+            return future.result(timeout=2 * timeout)
+        except TimeoutError:
+            # Cancelled, so a late answer is dropped instead of set on it
+            future.cancel()
+            raise
+
+    @staticmethod
+    def _settle(batch: list, results: list = None, error: Exception = None):
+        """Resolve every caller's future that is still waiting"""
+        for i, (_, _, future) in enumerate(batch):
+            try:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(results[i])
+            except InvalidStateError:
+                pass  # The caller gave up (timed out)
+
+    def _dispatch(self):
+        while True:
+            self._in_flight.acquire()
+            batch = []
+            try:
+                with self._ready:
+                    self._ready.wait_for(lambda: self._pending)
+                    deadline = time.monotonic() + self.window
+                    self._ready.wait_for(
+                        lambda: len(self._pending) >= self.max_size, timeout=max(0.0, deadline - time.monotonic())
+                    )
+                    batch = self._pending[:self.max_size]
+                    del self._pending[:self.max_size]
+                self._senders.submit(self._send, batch)
+            except Exception as e:
+                # Keep dispatching; the callers of this batch get the error
+                logger.error(f"❌ MedGemma batch dispatch failed: {e}", exc_info=True)
+                self._in_flight.release()
+                self._settle(batch, error=e)
+
+    def _send(self, batch: list):
+        try:
+            result = _post_predict([instance for instance, _, _ in batch], max(t for _, t, _ in batch))
+            predictions = result.get("predictions")
+            if not isinstance(predictions, list) or len(predictions) != len(batch):
+                raise Exception(f"Expected {len(batch)} predictions, got {str(predictions)[:200]}")
+            answers = [_parse_prediction(prediction) for prediction in predictions]
+        except Exception as e:
+            self._settle(batch, error=e)
+            return
+        finally:
+            self._in_flight.release()
+
+        self._settle(batch, answers)
+
+
+# Window 0 sends every request on its own
+_batcher = (
+    PredictBatcher(MEDGEMMA_BATCH_WINDOW_MS / 1000, MEDGEMMA_BATCH_SIZE, MEDGEMMA_MAX_IN_FLIGHT)
+    if MEDGEMMA_BATCH_WINDOW_MS else None
+)
+
+
+def _predict(instance: bytes, timeout: int) -> str:
+    """Answer text for one serialized instance, batched with concurrent calls if enabled"""
+    if _batcher is not None:
+        return _batcher.predict(instance, timeout)
+    return _parse_response(_post_predict([instance], timeout))
+
+
 def call_medgemma(
     user_message: str,
     language: str = "en",
@@ -69,44 +275,13 @@ def call_medgemma(
     Returns:
         The model's response text
     """
-    credentials = _get_credentials()
-
-    url = f"https://{DEDICATED_ENDPOINT_DNS}/v1/projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/{ENDPOINT_ID}:predict"
-
-    headers = {
-        "Authorization": f"Bearer {credentials.token}",
-        "Content-Type": "application/json"
-    }
-
-    system_prompt = get_system_prompt(language)
-
-    # Build messages list
-    messages = [{"role": "system", "content": system_prompt}]
-
-    # Add conversation history if provided
-    if history:
-        messages.extend(history)
-
-    # Add current user message
+    # Conversation history (if provided) followed by the current user message
+    messages = list(history) if history else []
     messages.append({"role": "user", "content": user_message})
 
-    payload = {
-        "instances": [{
-            "@requestFormat": "chatCompletions",
-            "messages": messages
-        }]
-    }
-
     logger.info(f"🔄 Calling MedGemma (language: {language}, history: {len(history) if history else 0} messages)...")
 
-    response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-
-    if response.status_code != 200:
-        logger.error(f"❌ HTTP {response.status_code}: {response.text}")
-        raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
-
-    result = response.json()
-    return _parse_response(result)
+    return _predict(_render_instance(language, messages), timeout)
 
 
 def call_medgemma_with_image(
@@ -129,17 +304,6 @@ def call_medgemma_with_image(
     Returns:
         The model's response text
     """
-    credentials = _get_credentials()
-
-    url = f"https://{DEDICATED_ENDPOINT_DNS}/v1/projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/{ENDPOINT_ID}:predict"
-
-    headers = {
-        "Authorization": f"Bearer {credentials.token}",
-        "Content-Type": "application/json"
-    }
-
-    system_prompt = get_system_prompt(language)
-
     # Default message if user didn't provide caption
     if not user_message:
         default_prompts = {
@@ -163,30 +327,10 @@ def call_medgemma_with_image(
         }
     ]
 
-    # Build messages list
-    messages = [{"role": "system", "content": system_prompt}]
-
-    # Add conversation history if provided (text only from history)
-    if history:
-        messages.extend(history)
-
-    # Add current user message with image
+    # Conversation history (text only, if provided) followed by the message with the image
+    messages = list(history) if history else []
     messages.append({"role": "user", "content": user_content})
 
-    payload = {
-        "instances": [{
-            "@requestFormat": "chatCompletions",
-            "messages": messages
-        }]
-    }
-
     logger.info(f"🔄 Calling MedGemma with image (language: {language})...")
 
-    response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-
-    if response.status_code != 200:
-        logger.error(f"❌ HTTP {response.status_code}: {response.text}")
-        raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
-
-    result = response.json()
-    return _parse_response(result)
+    return _predict(_render_instance(language, messages), timeout)
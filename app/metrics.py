@@ -0,0 +1,217 @@
+# In-process metrics registry
+import threading
+
+_lock = threading.Lock()
+_registry = {}
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str = "", labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> list:
+        """[(labels dict, value)]"""
+        with _lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """Value that can go up and down, with optional labels"""
+
+    def __init__(self, name: str, help_text: str = "", labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def samples(self) -> list:
+        """[(labels dict, value)]"""
+        with _lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+# Latency buckets in seconds, from fast Telegram calls up to model timeouts
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, help_text: str = "", labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # label key -> [bucket counts..., count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._values[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """
+        Estimate a quantile by interpolating within buckets, over all series
+        matching the given labels. None if nothing was observed.
+        """
+        wanted = {name: str(value) for name, value in labels.items()}
+        merged = [0] * (len(self.buckets) + 1)
+        with _lock:
+            for key, series in self._values.items():
+                series_labels = dict(zip(self.labelnames, key))
+                if all(series_labels.get(name) == value for name, value in wanted.items()):
+                    for i in range(len(self.buckets)):
+                        merged[i] += series[i]
+                    merged[-1] += series[-2]
+
+        count = merged[-1]
+        if not count:
+            return None
+        rank = q * count
+        lower_bound, lower_count = 0.0, 0
+        for bound, cumulative in zip(self.buckets, merged):
+            if cumulative >= rank:
+                in_bucket = cumulative - lower_count
+                fraction = (rank - lower_count) / in_bucket if in_bucket else 0
+                return lower_bound + (bound - lower_bound) * fraction
+            lower_bound, lower_count = bound, cumulative
+        return self.buckets[-1]
+
+    def samples(self) -> list:
+        """[(labels dict, bucket counts, count, sum)]"""
+        with _lock:
+            return [
+                (dict(zip(self.labelnames, key)), series[:-2], series[-2], series[-1])
+                for key, series in self._values.items()
+            ]
+
+
+def _get_or_create(cls, name: str, help_text: str, labelnames: tuple, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, help_text, labelnames, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name: str, help_text: str = "", labelnames: tuple = ()) -> Counter:
+    """Get or create a counter"""
+    return _get_or_create(Counter, name, help_text, labelnames)
+
+
+def gauge(name: str, help_text: str = "", labelnames: tuple = ()) -> Gauge:
+    """Get or create a gauge"""
+    return _get_or_create(Gauge, name, help_text, labelnames)
+
+
+def histogram(name: str, help_text: str = "", labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a histogram"""
+    return _get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+
+def all_metrics() -> list:
+    """All registered metrics, sorted by name"""
+    with _lock:
+        return [_registry[name] for name in sorted(_registry)]
+
+
+# ==================== EXPOSITION ====================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict, extra: dict = None) -> str:
+    merged = dict(labels)
+    if extra:
+        merged.update(extra)
+    if not merged:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in merged.items()) + "}"
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in all_metrics():
+        kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        if isinstance(metric, Histogram):
+            for labels, buckets, count, total in metric.samples():
+                for bound, bucket_count in zip(metric.buckets, buckets):
+                    lines.append(f"{metric.name}_bucket{_format_labels(labels, {'le': bound})} {bucket_count}")
+                lines.append(f"{metric.name}_bucket{_format_labels(labels, {'le': '+Inf'})} {count}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {count}")
+        else:
+            for labels, value in metric.samples():
+                lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port: int):
+    """Serve /metrics for Prometheus scraping from a background thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,153 @@
+# Versioned schema migrations for SQLite storage
+import sqlite3
+
+from .config import logger
+
+# (version, description, statements), applied in order. PRAGMA user_version
+# records the last version applied, so each one runs once per database file.
+# Never edit a released migration; add a new one instead.
+MIGRATIONS = [
+    (1, "initial tables", [
+        # Users table
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            language TEXT,
+            first_name TEXT,
+            username TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Messages table for conversation memory
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            role TEXT,
+            content TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_user_id
+        ON messages (user_id, created_at DESC)
+        ''',
+        # Suggestions table for storing button suggestions temporarily
+        '''
+        CREATE TABLE IF NOT EXISTS suggestions (
+            suggestion_id TEXT PRIMARY KEY,
+            text TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Rolling summaries of conversation turns that dropped out of the verbatim history
+        '''
+        CREATE TABLE IF NOT EXISTS history_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT,
+            last_message_id INTEGER,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Token usage rollups per day, user, language and pipeline stage
+        '''
+        CREATE TABLE IF NOT EXISTS token_usage (
+            day TEXT,
+            user_id INTEGER,
+            language TEXT,
+            stage TEXT,
+            calls INTEGER DEFAULT 0,
+            prompt_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
+            cached_tokens INTEGER DEFAULT 0,
+            total_tokens INTEGER DEFAULT 0,
+            latency_ms INTEGER DEFAULT 0,
+            PRIMARY KEY (day, user_id, language, stage)
+        )
+        '''
+    ]),
+    (2, "indexes matching the history, trim and cleanup queries", [
+        # History reads and the trim walk one user's rows by id. The index also
+        # carries role and content, so reads never touch the table; the trim
+        # keeps it to MAX_MEMORY_MESSAGES * 2 rows per user, so the copy stays small.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_user_history
+        ON messages (user_id, id, role, content)
+        ''',
+        # Ordered by created_at, which no query uses any more
+        'DROP INDEX IF EXISTS idx_messages_user_id',
+        # The 24h cleanup in store_suggestion scanned the whole table
+        '''
+        CREATE INDEX IF NOT EXISTS idx_suggestions_created_at
+        ON suggestions (created_at)
+        '''
+    ]),
+    (3, "durable job queue", [
+        # One row per update that started a pipeline; partial holds the JSON
+        # results of finished stages so a retry resumes where it stopped.
+        # Times are epoch seconds; a job is leased to one worker until locked_until.
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            update_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            payload TEXT,
+            state TEXT DEFAULT 'pending',
+            partial TEXT DEFAULT '{}',
+            attempts INTEGER DEFAULT 0,
+            locked_until REAL DEFAULT 0,
+            created_at REAL,
+            updated_at REAL
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_jobs_state
+        ON jobs (state, locked_until)
+        '''
+    ]),
+    (4, "token usage cost", [
+        # USD at the model's list prices when the calls were made
+        'ALTER TABLE token_usage ADD COLUMN cost_usd REAL DEFAULT 0'
+    ])
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(path: str, busy_timeout: float) -> int:
+    """
+    Bring the database at `path` up to SCHEMA_VERSION.
+
+    Safe against a live database: the file is switched to WAL, so readers keep
+    going while a migration holds the write lock, and each migration commits
+    together with its version bump under BEGIN IMMEDIATE. A second process
+    migrating at the same time waits, then re-reads the version and skips
+    what is already applied.
+
+    Returns:
+        The schema version before migrating
+    """
+    conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        initial = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for version, description, statements in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                # PRAGMA arguments cannot be bound parameters
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info(f"🗄️ {path}: migrated to schema v{version} ({description})")
+
+        return initial
+    finally:
+        conn.close()
@@ -0,0 +1,25 @@
+# Pre-serialized JSON payload fragments
+import json
+
+
+def to_json_bytes(obj) -> bytes:
+    """Compact UTF-8 JSON (Cyrillic/Uzbek text stays 2 bytes/char instead of \\uXXXX)"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class PayloadTemplate:
+    """
+    A JSON object whose static fields are serialized once. Only the value
+    of `open_key` is encoded per request and spliced in at render time.
+    """
+
+    __slots__ = ("_prefix",)
+
+    def __init__(self, static: dict, open_key: str):
+        head = to_json_bytes(static)[:-1]  # drop closing brace
+        separator = b"," if static else b""
+        self._prefix = head + separator + to_json_bytes(open_key) + b":"
+
+    def render(self, value) -> bytes:
+        """Serialize the payload with `value` under the open key"""
+        return self._prefix + to_json_bytes(value) + b"}"
@@ -0,0 +1,132 @@
+# Shared answer pipeline: translation in, model call, translation out
+from .breaker import CircuitOpenError, circuit_breaker
+from .config import COMBINED_SUGGESTIONS, LLM_BACKEND, logger
+from .gemini import translate_uz_to_en, translate_en_to_uz
+from .llm import call_gemini, call_gemini_with_image, call_gemini_combined, call_gemini_with_image_combined
+from .tracing import span
+
+
+class PipelineCancelled(Exception):
+    """Raised between stages once the caller no longer wants the answer"""
+
+
+def _check(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise PipelineCancelled()
+
+
+def _medgemma():
+    """The MedGemma client, imported on first use so Gemini-only deployments never load Google Cloud libraries"""
+    from . import medgemma
+    return medgemma
+
+
+def _translates(lang: str) -> bool:
+    """Uzbek goes through English, unless translation is failing; then the model answers in Uzbek directly"""
+    if lang != "uz":
+        return False
+    if circuit_breaker("translation").is_open():
+        logger.warning("⏭️ Translation circuit open, answering in Uzbek directly")
+        return False
+    return True
+
+
+def answer_text(message: str, lang: str, history: list, cancelled=None) -> tuple:
+    """
+    Answer a text question in the user's language.
+
+    Uzbek questions are translated to English for the model (LLM_BACKEND)
+    and the answer is translated back. If MedGemma's circuit is open,
+    Gemini answers instead.
+
+    `cancelled` (a threading.Event) is checked before each stage, so work
+    nobody waits for any more stops at the next stage boundary.
+
+    Returns:
+        (response_text, suggestions); suggestions is None unless they came
+        with the answer (COMBINED_SUGGESTIONS, Gemini only) and still need generating
+
+    Raises:
+        PipelineCancelled: if `cancelled` was set
+    """
+    message_for_llm = message
+    llm_lang = lang
+    translate = _translates(lang)
+    if translate:
+        _check(cancelled)
+        with span("translate_in"):
+            message_for_llm = translate_uz_to_en(message)
+        llm_lang = "en"  # Use English prompt for Gemini
+
+    _check(cancelled)
+    suggestions = None
+    with span("model"):
+        if LLM_BACKEND == "medgemma":
+            try:
+                response_text = _medgemma().call_medgemma(message_for_llm, language=llm_lang, history=history)
+            except CircuitOpenError as e:
+                logger.warning(f"⚠️ {e}, answering with Gemini")
+                response_text = call_gemini(message_for_llm, language=llm_lang, history=history)
+        elif COMBINED_SUGGESTIONS:
+            response_text, suggestions = call_gemini_combined(
+                message_for_llm, language=llm_lang, history=history, suggestion_language=lang
+            )
+        else:
+            response_text = call_gemini(message_for_llm, language=llm_lang, history=history)
+
+    logger.info(f"✅ Response received ({len(response_text)} chars)")
+
+    # For Uzbek: translate response back to Uzbek (errors stay as they are)
+    if translate and not response_text.startswith("Error:"):
+        _check(cancelled)
+        with span("translate_out"):
+            response_text = translate_en_to_uz(response_text)
+
+    return response_text, suggestions
+
+
+def answer_image(image_base64: str, caption: str, lang: str, history: list) -> tuple:
+    """
+    Answer an image (with optional caption) in the user's language.
+
+    Returns:
+        (response_text, suggestions) as for answer_text
+    """
+    caption_for_llm = caption
+    llm_lang = lang
+    translate = _translates(lang)
+    if translate:
+        if caption:
+            with span("translate_in"):
+                caption_for_llm = translate_uz_to_en(caption)
+        llm_lang = "en"  # Use English prompt for Gemini
+
+    suggestions = None
+    with span("model"):
+        if LLM_BACKEND == "medgemma":
+            try:
+                response_text = _medgemma().call_medgemma_with_image(
+                    image_base64, caption_for_llm, language=llm_lang, history=history
+                )
+            except CircuitOpenError as e:
+                logger.warning(f"⚠️ {e}, answering with Gemini")
+                response_text = call_gemini_with_image(
+                    image_base64, caption_for_llm, language=llm_lang, history=history
+                )
+        elif COMBINED_SUGGESTIONS:
+            response_text, suggestions = call_gemini_with_image_combined(
+                image_base64, caption_for_llm, language=llm_lang, history=history, suggestion_language=lang
+            )
+        else:
+            response_text = call_gemini_with_image(
+                image_base64, caption_for_llm, language=llm_lang, history=history
+            )
+
+    logger.info(f"✅ Response received ({len(response_text)} chars)")
+
+    # For Uzbek: translate response back to Uzbek (errors stay as they are)
+    if translate and not response_text.startswith("Error:"):
+        with span("translate_out"):
+            response_text = translate_en_to_uz(response_text)
+
+    return response_text, suggestions
@@ -0,0 +1,99 @@
+# Server-side context caching of the per-language system prompts
+import threading
+import time
+
+from .config import GEMINI_CONTEXT_CACHE, GEMINI_CONTEXT_CACHE_TTL, logger
+from .gemini_client import GeminiAPIError, create_cached_content
+from .prompts import get_system_prompt
+
+REFRESH_MARGIN = 60  # Re-register this many seconds before the cache expires
+RETRY_AFTER_ERROR = 600  # Back off after a failed registration
+
+
+class PromptCache:
+    """
+    Registers each language's system prompt once with Gemini's cachedContents
+    API and hands out the cache name for later requests. Entries are
+    re-registered shortly before their TTL runs out or after the API reports
+    them missing.
+
+    Registration (a network call of up to 30 s) holds only that language's
+    lock, so other languages keep answering from their entries meanwhile.
+    """
+
+    def __init__(self, enabled: bool = True, ttl_seconds: int = 3600):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # language -> (cache name, expires_at)
+        self._retry_at = {}  # language -> time after which registration may be retried
+        self._unsupported = set()  # languages whose prompt the API refuses to cache
+        self._lock = threading.Lock()  # Guards the dicts and counters; never held across a request
+        self._language_locks = {}  # language -> lock held while registering it
+
+    def _fresh(self, language: str, now: float) -> str | None:
+        entry = self._entries.get(language)
+        if entry and entry[1] - REFRESH_MARGIN > now:
+            return entry[0]
+        return None
+
+    def get(self, language: str) -> str | None:
+        """Get the cachedContent name for a language, registering it if needed"""
+        if not self.enabled or language in self._unsupported:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            name = self._fresh(language, now)
+            if name:
+                self.hits += 1
+                return name
+            self.misses += 1
+            language_lock = self._language_locks.setdefault(language, threading.Lock())
+
+        with language_lock:
+            # Another thread may have registered it (or failed to) while this one waited
+            with self._lock:
+                name = self._fresh(language, time.monotonic())
+                if name or language in self._unsupported or self._retry_at.get(language, 0) > now:
+                    return name
+            return self._register(language, now)
+
+    def invalidate(self, language: str):
+        """Forget a cache entry the API no longer accepts"""
+        with self._lock:
+            self._entries.pop(language, None)
+
+    def _register(self, language: str, now: float) -> str | None:
+        try:
+            resource = create_cached_content(
+                get_system_prompt(language),
+                self.ttl_seconds,
+                display_name=f"system-prompt-{language}"
+            )
+        except GeminiAPIError as e:
+            if e.status_code == 400:
+                # Typically the prompt is below the model's minimum cacheable size
+                logger.warning(f"⚠️ System prompt ({language}) cannot be cached, sending inline: {e.body[:200]}")
+                with self._lock:
+                    self._unsupported.add(language)
+            else:
+                logger.error(f"❌ Context cache registration failed ({language}): {e.status_code}")
+                with self._lock:
+                    self._retry_at[language] = now + RETRY_AFTER_ERROR
+            return None
+        except Exception as e:
+            logger.error(f"❌ Context cache registration error ({language}): {e}")
+            with self._lock:
+                self._retry_at[language] = now + RETRY_AFTER_ERROR
+            return None
+
+        name = resource["name"]
+        with self._lock:
+            self._entries[language] = (name, now + self.ttl_seconds)
+        logger.info(f"✅ System prompt ({language}) cached as {name}")
+        return name
+
+
+prompt_cache = PromptCache(enabled=GEMINI_CONTEXT_CACHE, ttl_seconds=GEMINI_CONTEXT_CACHE_TTL)
@@ -0,0 +1,174 @@
+# Outbound Telegram Bot API scheduling: flood limits, RetryAfter and edit merging
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from .cache import LRUCache
+from .config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES, logger
+)
+from .metrics import counter, gauge, histogram
+
+queue_depth = gauge("telegram_send_queue_depth", "Bot API requests waiting for a rate-limit slot")
+send_latency = histogram(
+    "telegram_send_seconds", "Bot API request latency including queueing", ("endpoint",)
+)
+retry_after_total = counter("telegram_retry_after_total", "RetryAfter flood-control responses", ("endpoint",))
+merged_edits_total = counter("telegram_merged_edits_total", "Edits skipped because a newer edit superseded them")
+
+# Endpoints that create or change a visible message and count towards per-chat limits
+_CHAT_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+# Endpoints that are never throttled (answering a callback must stay instant)
+_UNLIMITED_ENDPOINTS = {"answerCallbackQuery", "getFile", "getMe"}
+
+
+class _TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # Set by a RetryAfter for this bucket's chat
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class OutboundRateLimiter(BaseRateLimiter[int]):
+    """
+    Rate limiter plugged into the Application, so every Bot API call made by
+    the handlers (reply_text, edit_message_text, send_action, delete, ...)
+    passes through it.
+
+    - Requests are throttled against a global and a per-chat token bucket
+      (private chats and groups have different limits).
+    - A RetryAfter response pauses sending to that chat for the requested
+      time (all sending, for requests without a chat) and the request is
+      retried up to `rate_limit_args` / TELEGRAM_MAX_RETRIES.
+    - An editMessageText still waiting for its slot is dropped when a newer
+      edit of the same message arrives; only the latest text is sent, and
+      the dropped edit gives back any tokens it already took.
+    """
+
+    def __init__(self):
+        self._global = _TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._chats = LRUCache(10000)
+        self._paused_until = 0.0
+        self._edit_versions = {}  # (chat_id, message_id) -> latest edit sequence number
+        self._edit_seq = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._edit_versions.clear()
+
+    def _chat_bucket(self, chat_id) -> _TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = _TokenBucket(TELEGRAM_GROUP_RATE / 60, TELEGRAM_CHAT_BURST)
+            else:
+                bucket = _TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def _wait_for_slot(self, endpoint: str, chat_id, superseded=None) -> bool:
+        """
+        Wait out any flood-control pause, then take a token from the chat and
+        global buckets. `superseded()` is checked after every wait; once it is
+        true, tokens already taken are refunded and False is returned.
+        """
+        superseded = superseded or (lambda: False)
+        paused_until = self._paused_until
+        if chat_id is not None:
+            paused_until = max(paused_until, self._chat_bucket(chat_id).paused_until)
+        pause = paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if superseded():
+            return False
+
+        chat_bucket = None
+        if chat_id is not None and endpoint.startswith(_CHAT_LIMITED_PREFIXES) and endpoint != "sendChatAction":
+            chat_bucket = self._chat_bucket(chat_id)
+            await chat_bucket.acquire()
+            if superseded():
+                chat_bucket.refund()
+                return False
+
+        await self._global.acquire()
+        if superseded():
+            self._global.refund()
+            if chat_bucket:
+                chat_bucket.refund()
+            return False
+        return True
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in _UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        max_retries = rate_limit_args or TELEGRAM_MAX_RETRIES
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        edit_key = superseded = None
+        if endpoint == "editMessageText" and chat_id is not None and data.get("message_id"):
+            edit_key = (chat_id, data["message_id"])
+            self._edit_seq += 1
+            version = self._edit_seq
+            self._edit_versions[edit_key] = version
+
+            def superseded():
+                return self._edit_versions.get(edit_key) != version
+
+        started = time.monotonic()
+        queue_depth.inc()
+        try:
+            for attempt in range(max_retries + 1):
+                if not await self._wait_for_slot(endpoint, chat_id, superseded):
+                    # A newer edit of this message is queued; it will carry the final text
+                    merged_edits_total.inc()
+                    return True
+
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    retry_after_total.inc(endpoint=endpoint)
+                    if attempt == max_retries:
+                        raise
+                    logger.warning(f"⏳ Flood control on {endpoint}, retrying in {e.retry_after}s")
+                    # One chat over its limit must not hold up every other chat
+                    resume_at = time.monotonic() + e.retry_after
+                    if chat_id is not None:
+                        bucket = self._chat_bucket(chat_id)
+                        bucket.paused_until = max(bucket.paused_until, resume_at)
+                    else:
+                        self._paused_until = max(self._paused_until, resume_at)
+        finally:
+            queue_depth.dec()
+            send_latency.observe(time.monotonic() - started, endpoint=endpoint)
+            if edit_key and self._edit_versions.get(edit_key) == version:
+                del self._edit_versions[edit_key]
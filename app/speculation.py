@@ -0,0 +1,183 @@
+# Speculative pre-generation of answers for shown suggestion buttons
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import SPECULATIVE_ANSWERS, SPECULATION_TTL, SPECULATION_HOURLY_BUDGET, SPECULATION_WORKERS, logger
+from .pipeline import PipelineCancelled, answer_text
+from .tracing import trace
+
+
+def _precompute(user_id: int, text: str, lang: str, history: list, cancelled: threading.Event):
+    """Run the answer pipeline for a suggestion; None if the answer is an error or was cancelled"""
+    if cancelled.is_set():  # Cancelled before a worker thread picked it up
+        return None
+    try:
+        # Traced on its own, not as part of the update that showed the buttons
+        with trace(None, user_id, "speculative", lang):
+            response_text, suggestions = answer_text(text, lang, history, cancelled)
+    except PipelineCancelled:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ Speculative answer failed: {e}")
+        return None
+    if response_text.startswith("Error:"):
+        return None
+    return response_text, suggestions
+
+
+class Speculator:
+    """
+    Pre-computes answers for the suggestion buttons shown to a user, using
+    the history snapshot taken when the buttons were sent. A tap is served
+    from the precomputed result if the history has not changed since.
+
+    Speculation is bounded by an hourly budget of speculative answers across
+    all users, cancelled when the user sends anything else and evicted after
+    a TTL. It runs on its own `workers` threads, never the ones real
+    questions use, and is skipped while they are all busy: a cancelled
+    answer only lets go of its thread after the model call in progress.
+    """
+
+    def __init__(self, enabled: bool = False, ttl: int = 600, hourly_budget: int = 100, workers: int = 2):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.hourly_budget = hourly_budget
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self._pending = {}  # user_id -> {suggestion text: (task, cancelled event, history, created_at)}
+        self._spent = deque()  # start times of speculative answers in the last hour
+        self._executor: ThreadPoolExecutor | None = None
+        self._running = set()  # executor futures, until their thread is free again
+
+    def _within_budget(self, now: float) -> bool:
+        while self._spent and now - self._spent[0] > 3600:
+            self._spent.popleft()
+        return len(self._spent) < self.hourly_budget
+
+    def _saturated(self) -> bool:
+        """Whether every speculation thread is taken, including by cancelled answers still finishing"""
+        self._running = {future for future in self._running if not future.done()}
+        return len(self._running) >= self.workers
+
+    def _submit(self, *args) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="speculation")
+        future = self._executor.submit(_precompute, *args)
+        self._running.add(future)
+        return future
+
+    @staticmethod
+    def _stop(task: asyncio.Future, cancelled: threading.Event):
+        """
+        Cancel a speculative answer. Cancelling the task only stops the
+        awaiting wrapper (or a not yet started call); the event stops the
+        worker thread at its next stage.
+        """
+        cancelled.set()
+        task.cancel()
+
+    def _evict_expired(self, now: float):
+        for user_id in list(self._pending):
+            entries = self._pending[user_id]
+            for text, (task, cancelled, _, created_at) in list(entries.items()):
+                if now - created_at > self.ttl:
+                    self._stop(task, cancelled)
+                    del entries[text]
+            if not entries:
+                del self._pending[user_id]
+
+    def schedule(self, user_id: int, lang: str, suggestions: list, history: list):
+        """Start pre-computing answers for the suggestions just shown to a user"""
+        if not self.enabled or not suggestions:
+            return
+
+        self.cancel_user(user_id)
+        now = time.monotonic()
+        self._evict_expired(now)
+
+        entries = {}
+        for text in suggestions:
+            if not self._within_budget(now):
+                logger.info("💸 Speculation budget exhausted for this hour")
+                break
+            if self._saturated():
+                logger.info("⏭️ Speculation threads busy, not speculating")
+                break
+            self._spent.append(now)
+            cancelled = threading.Event()
+            task = asyncio.wrap_future(self._submit(user_id, text, lang, history, cancelled))
+            entries[text] = (task, cancelled, history, now)
+
+        if entries:
+            self._pending[user_id] = entries
+            logger.info(f"🔮 Speculating {len(entries)} answers for user {user_id}")
+
+    def cancel_user(self, user_id: int):
+        """Drop all speculation for a user (they sent something else)"""
+        for task, cancelled, _, _ in self._pending.pop(user_id, {}).values():
+            if not task.done():
+                self._stop(task, cancelled)
+                self.cancelled += 1
+
+    def cancel_all(self, wait: bool = False):
+        """Drop all speculation and stop its threads (shutdown); `wait` for running answers to stop"""
+        for user_id in list(self._pending):
+            self.cancel_user(user_id)
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    async def take(self, user_id: int, text: str, history: list):
+        """
+        Claim the precomputed answer for a tapped suggestion, waiting for it
+        if still running. Other speculation for the user is cancelled.
+
+        Returns:
+            (response_text, suggestions) or None if there is no usable result
+        """
+        entries = self._pending.pop(user_id, {})
+        entry = entries.pop(text, None)
+        for task, cancelled, _, _ in entries.values():
+            self._stop(task, cancelled)
+
+        if entry is None:
+            if self.enabled:
+                self.misses += 1
+            return None
+
+        task, cancelled, snapshot, created_at = entry
+        if time.monotonic() - created_at > self.ttl or snapshot != history:
+            self._stop(task, cancelled)
+            self.misses += 1
+            return None
+
+        try:
+            # Shielded, so cancelling the handler does not look like cancelled speculation
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # The handler itself is being cancelled; nobody will use the answer
+                self._stop(task, cancelled)
+                raise
+            result = None
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.info(f"⚡ Serving speculative answer for user {user_id}")
+        return result
+
+
+speculator = Speculator(
+    enabled=SPECULATIVE_ANSWERS,
+    ttl=SPECULATION_TTL,
+    hourly_budget=SPECULATION_HOURLY_BUDGET,
+    workers=SPECULATION_WORKERS
+)
@@ -0,0 +1,37 @@
+# Cold-start timing: how long each startup phase took until polling began
+import sys
+import time
+
+from .metrics import gauge
+
+# Imported first by bot.py, so this is close to process start
+_started = time.perf_counter()
+_last = _started
+_phases = []  # [(phase, seconds)]
+
+# Slow to import; a Gemini-only deployment with the default thread pool loads none of them
+HEAVY_MODULES = ("google.auth", "google.cloud.aiplatform", "vertexai", "multiprocessing")
+
+cold_start_seconds = gauge("cold_start_seconds", "Startup time by phase", ("phase",))
+
+
+def mark(phase: str):
+    """End the current startup phase, recording it as `phase`"""
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    cold_start_seconds.set(now - _last, phase=phase)
+    cold_start_seconds.set(now - _started, phase="total")
+    _last = now
+
+
+def total() -> float:
+    """Seconds from process start to the last phase marked"""
+    return _last - _started
+
+
+def report() -> str:
+    """One-line summary for the startup log"""
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in _phases)
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    return f"Cold start {total():.2f}s ({phases}); heavy modules loaded: {', '.join(loaded) or 'none'}"
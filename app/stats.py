@@ -0,0 +1,132 @@
+# Live runtime numbers for the admin /stats command
+import os
+import time
+
+from .breaker import all_breakers
+from .config import LLM_BACKEND
+from .database import database_files
+from .gemini import transcript_cache
+from .gemini_client import gemini_requests, gemini_seconds
+from .prompt_cache import prompt_cache
+from .rate_limiter import queue_depth, retry_after_total, send_latency
+from .speculation import speculator
+from .startup import total as cold_start
+from .tracing import pipeline_errors, recent_activity, update_seconds
+
+STARTED_AT = time.time()
+ACTIVE_WINDOW = 15 * 60  # Seconds a user counts as active after their last update
+RATE_WINDOW = 5 * 60  # Seconds the request rate is averaged over
+
+
+def _ms(seconds) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+
+def _hit_rate(hits: int, misses: int) -> str:
+    total = hits + misses
+    return f"{hits / total:.0%} ({hits}/{total})" if total else "-"
+
+
+def _uptime(seconds: float) -> str:
+    days, seconds = divmod(int(seconds), 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes = seconds // 60
+    return f"{days}d {hours}h {minutes}m" if days else f"{hours}h {minutes}m"
+
+
+def _database_size() -> int:
+    """Database files plus their WALs, in bytes"""
+    size = 0
+    for database_file in database_files():
+        for path in (database_file, f"{database_file}-wal"):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+    return size
+
+
+def _latency_lines() -> list:
+    """p50/p95 per Gemini stage, for MedGemma (if it answers) and for Telegram sends"""
+    lines = []
+    stages = sorted({labels["stage"] for labels, *_ in gemini_seconds.samples()})
+    for stage in stages:
+        lines.append(
+            f"  gemini/{stage}: p50 {_ms(gemini_seconds.quantile(0.5, stage=stage))}, "
+            f"p95 {_ms(gemini_seconds.quantile(0.95, stage=stage))}"
+        )
+    if LLM_BACKEND == "medgemma":
+        # Imported here like in pipeline.py: Gemini-only deployments never load the client
+        from .medgemma import medgemma_seconds
+        lines.append(
+            f"  medgemma/predict: p50 {_ms(medgemma_seconds.quantile(0.5))}, "
+            f"p95 {_ms(medgemma_seconds.quantile(0.95))}"
+        )
+    lines.append(
+        f"  telegram: p50 {_ms(send_latency.quantile(0.5))}, p95 {_ms(send_latency.quantile(0.95))}"
+    )
+    lines.append(
+        f"  end-to-end: p50 {_ms(update_seconds.quantile(0.5))}, p95 {_ms(update_seconds.quantile(0.95))}"
+    )
+    return lines
+
+
+def _error_counts() -> dict:
+    """Failed Gemini calls by status (HTTP code, timeout, network_error)"""
+    counts = {}
+    for labels, value in gemini_requests.samples():
+        if labels["status"] != "200":
+            counts[labels["status"]] = counts.get(labels["status"], 0) + int(value)
+    return counts
+
+
+def _medgemma_lines() -> list:
+    """MedGemma :predict calls by outcome and how well they were batched"""
+    # Imported here like in pipeline.py: Gemini-only deployments never load the client
+    from .medgemma import medgemma_batch_size, medgemma_requests
+
+    statuses = {labels["status"]: int(value) for labels, value in medgemma_requests.samples()}
+    calls = sum(statuses.values())
+    failed = ", ".join(f"{status}: {n}" for status, n in sorted(statuses.items()) if status != "200") or "0"
+    instances = sum(total for _, _, _, total in medgemma_batch_size.samples())
+    batches = sum(count for _, _, count, _ in medgemma_batch_size.samples())
+    p95 = medgemma_batch_size.quantile(0.95)
+    return [
+        f"MedGemma: {calls} predict calls, errors: {failed}",
+        f"  batch size: avg {instances / batches:.1f}, p95 {p95:.0f}" if batches else "  batch size: -",
+    ]
+
+
+def build_stats_report() -> str:
+    """Plain-text snapshot of the in-process metrics registry"""
+    updates, _ = recent_activity(RATE_WINDOW)
+    _, active_users = recent_activity(ACTIVE_WINDOW)
+    errors = _error_counts()
+    timeouts = errors.pop("timeout", 0)
+
+    lines = [
+        "📊 Live stats",
+        f"Uptime: {_uptime(time.time() - STARTED_AT)} (cold start {cold_start():.1f}s)",
+        f"Active users (15 min): {active_users}",
+        f"Requests/min (5 min avg): {updates / (RATE_WINDOW / 60):.1f}",
+        "",
+        "Latency:",
+        *_latency_lines(),
+        "",
+        "Cache hit rates:",
+        f"  transcripts: {_hit_rate(transcript_cache.hits, transcript_cache.misses)}",
+        f"  system prompts: {_hit_rate(prompt_cache.hits, prompt_cache.misses)}",
+        f"  speculative answers: {_hit_rate(speculator.hits, speculator.misses)}",
+        "",
+        f"Telegram send queue: {queue_depth.value():.0f} waiting, {retry_after_total.total():.0f} RetryAfter",
+        f"Gemini timeouts: {timeouts}",
+        "Gemini errors: " + (", ".join(f"{status}: {n}" for status, n in sorted(errors.items())) or "0"),
+        f"Handler errors: {pipeline_errors.total():.0f}",
+        *(_medgemma_lines() if LLM_BACKEND == "medgemma" else []),
+        "Circuit breakers: " + (
+            ", ".join(f"{b.name} {b.state.replace('_', '-')}" for b in all_breakers() if b.state != "closed")
+            or "all closed"
+        ),
+        f"Database: {_database_size() / 1024 / 1024:.1f} MB",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,585 @@
+# Storage backends behind the functions in database.py
+import json
+import os
+import sqlite3
+import zlib
+from typing import Optional
+
+from .config import MAX_MEMORY_MESSAGES, SQLITE_BUSY_TIMEOUT, logger
+from .migrations import migrate
+
+
+def user_shard(user_id: int, shard_count: int) -> int:
+    """Shard holding a user's rows"""
+    return (user_id or 0) % shard_count
+
+
+def key_shard(key: str, shard_count: int) -> int:
+    """Shard holding a row keyed by a string (stable across processes, unlike hash())"""
+    return zlib.crc32(key.encode()) % shard_count
+
+
+# (table, column, SQL function placing the row) for copying a single file into shards
+_SHARDED_TABLES = (
+    ("users", "user_id", "user_shard"),
+    ("messages", "user_id", "user_shard"),
+    ("history_summaries", "user_id", "user_shard"),
+    ("token_usage", "user_id", "user_shard"),
+    ("jobs", "user_id", "user_shard"),
+    ("suggestions", "suggestion_id", "key_shard"),
+)
+
+
+class SQLiteStorage:
+    """All tables in one SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def connect(self):
+        """Get database connection"""
+        return sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+
+    def files(self) -> list:
+        """Database files backing this storage"""
+        return [self.path]
+
+    def init_schema(self):
+        """Create or migrate the tables"""
+        migrate(self.path, SQLITE_BUSY_TIMEOUT)
+
+    def has_users(self) -> bool:
+        """Whether any user has a language or history stored here"""
+        conn = self.connect()
+        try:
+            cursor = conn.execute('SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM messages)')
+            return bool(cursor.fetchone()[0])
+        except sqlite3.OperationalError:  # No tables yet
+            return False
+        finally:
+            conn.close()
+
+    def copy_shard(self, source_path: str, index: int, shard_count: int) -> int:
+        """
+        Copy the rows of shard `index` (of `shard_count`) from a database
+        with the same schema version. Message ids are kept, so summaries
+        still point at the right rows.
+
+        Returns:
+            Users copied
+        """
+        conn = self.connect()
+        conn.create_function("user_shard", 1, lambda user_id: user_shard(user_id, shard_count))
+        conn.create_function("key_shard", 1, lambda key: key_shard(key, shard_count))
+        conn.execute('ATTACH DATABASE ? AS source', (source_path,))
+        users = 0
+        with conn:
+            for table, column, function in _SHARDED_TABLES:
+                cursor = conn.execute(
+                    f'INSERT OR IGNORE INTO main.{table} SELECT * FROM source.{table} WHERE {function}({column}) = ?',
+                    (index,)
+                )
+                if table == "users":
+                    users = cursor.rowcount
+        conn.execute('DETACH DATABASE source')
+        conn.close()
+        return users
+
+    # ==================== USER FUNCTIONS ====================
+
+    def get_user_language(self, user_id: int) -> Optional[str]:
+        """Get user's selected language"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else None
+
+    def set_user_language(self, user_id: int, language: str, first_name: str = None, username: str = None):
+        """Set or update user's language preference"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO users (user_id, language, first_name, username)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                language = excluded.language,
+                first_name = COALESCE(excluded.first_name, users.first_name),
+                username = COALESCE(excluded.username, users.username)
+        ''', (user_id, language, first_name, username))
+
+        conn.commit()
+        conn.close()
+        logger.info(f"👤 User {user_id} language set to: {language}")
+
+    def user_exists(self, user_id: int) -> bool:
+        """Check if user exists in database"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result is not None
+
+    # ==================== MEMORY FUNCTIONS ====================
+
+    def add_message(self, user_id: int, role: str, content: str):
+        """Add a message to conversation history"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # Insert new message
+        cursor.execute('''
+            INSERT INTO messages (user_id, role, content)
+            VALUES (?, ?, ?)
+        ''', (user_id, role, content))
+
+        # Clean up old messages (keep only last MAX_MEMORY_MESSAGES * 2 to have buffer):
+        # everything at or below the id just past the kept window, one index range.
+        # Only messages already folded into the summary go; unsummarized ones
+        # stay until compaction succeeds, up to a hard ceiling of
+        # MAX_MEMORY_MESSAGES * 4 in case it never does.
+        cursor.execute('''
+            DELETE FROM messages
+            WHERE user_id = ? AND id <= (
+                SELECT id FROM messages
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT 1 OFFSET ?
+            ) AND (
+                id <= COALESCE((SELECT last_message_id FROM history_summaries WHERE user_id = ?), 0)
+                OR id <= (
+                    SELECT id FROM messages
+                    WHERE user_id = ?
+                    ORDER BY id DESC
+                    LIMIT 1 OFFSET ?
+                )
+            )
+        ''', (user_id, user_id, MAX_MEMORY_MESSAGES * 2, user_id, user_id, MAX_MEMORY_MESSAGES * 4))
+
+        conn.commit()
+        conn.close()
+
+    def get_conversation_history(self, user_id: int, limit: int = None) -> list:
+        """Get recent conversation history for a user"""
+        if limit is None:
+            limit = MAX_MEMORY_MESSAGES
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT role, content FROM (
+                SELECT id, role, content
+                FROM messages
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY id ASC
+        ''', (user_id, limit))
+
+        messages = [{"role": row[0], "content": row[1]} for row in cursor.fetchall()]
+        conn.close()
+
+        return messages
+
+    def get_messages_since(self, user_id: int, after_id: int = 0, limit: int = None) -> list:
+        """Get the newest messages with id > after_id, oldest first, including their ids"""
+        if limit is None:
+            limit = MAX_MEMORY_MESSAGES * 2
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, role, content FROM (
+                SELECT id, role, content
+                FROM messages
+                WHERE user_id = ? AND id > ?
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY id ASC
+        ''', (user_id, after_id, limit))
+
+        messages = [{"id": row[0], "role": row[1], "content": row[2]} for row in cursor.fetchall()]
+        conn.close()
+
+        return messages
+
+    def get_history_summary(self, user_id: int) -> tuple:
+        """Get (summary, last_message_id) for a user, or ("", 0) if none"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT summary, last_message_id FROM history_summaries WHERE user_id = ?',
+            (user_id,)
+        )
+        result = cursor.fetchone()
+        conn.close()
+        return (result[0], result[1]) if result else ("", 0)
+
+    def set_history_summary(self, user_id: int, summary: str, last_message_id: int):
+        """Store the rolling summary covering messages up to last_message_id"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO history_summaries (user_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_message_id = excluded.last_message_id,
+                updated_at = excluded.updated_at
+        ''', (user_id, summary, last_message_id))
+
+        conn.commit()
+        conn.close()
+
+    def clear_user_history(self, user_id: int):
+        """Clear conversation history for a user"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM history_summaries WHERE user_id = ?', (user_id,))
+        conn.commit()
+        conn.close()
+        logger.info(f"🗑️ Cleared history for user {user_id}")
+
+    # ==================== SUGGESTION FUNCTIONS ====================
+
+    def store_suggestion(self, suggestion_id: str, text: str):
+        """Store a suggestion text for later retrieval"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # Insert or replace suggestion
+        cursor.execute('''
+            INSERT OR REPLACE INTO suggestions (suggestion_id, text)
+            VALUES (?, ?)
+        ''', (suggestion_id, text))
+
+        # Clean up old suggestions (older than 24 hours)
+        cursor.execute('''
+            DELETE FROM suggestions
+            WHERE created_at < datetime('now', '-24 hours')
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def get_suggestion(self, suggestion_id: str) -> Optional[str]:
+        """Get suggestion text by ID"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT text FROM suggestions WHERE suggestion_id = ?', (suggestion_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else None
+
+    # ==================== USAGE FUNCTIONS ====================
+
+    def add_token_usage(self, rows: list):
+        """
+        Add aggregated usage to the rollups.
+
+        Args:
+            rows: [(day, user_id, language, stage, calls, prompt_tokens,
+                    output_tokens, cached_tokens, total_tokens, latency_ms, cost_usd)]
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # user_id is NULL for calls made outside an update; COALESCE keeps them in one row
+        cursor.executemany('''
+            INSERT INTO token_usage (
+                day, user_id, language, stage, calls, prompt_tokens,
+                output_tokens, cached_tokens, total_tokens, latency_ms, cost_usd
+            )
+            VALUES (?, COALESCE(?, 0), ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, user_id, language, stage) DO UPDATE SET
+                calls = calls + excluded.calls,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cached_tokens = cached_tokens + excluded.cached_tokens,
+                total_tokens = total_tokens + excluded.total_tokens,
+                latency_ms = latency_ms + excluded.latency_ms,
+                cost_usd = cost_usd + excluded.cost_usd
+        ''', rows)
+
+        conn.commit()
+        conn.close()
+
+    def get_token_usage_by_stage(self, days: int = 1) -> list:
+        """Token totals per stage over the last `days` days, biggest spender first"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT stage, SUM(calls), SUM(prompt_tokens), SUM(output_tokens),
+                   SUM(cached_tokens), SUM(total_tokens), SUM(latency_ms), SUM(cost_usd)
+            FROM token_usage
+            WHERE day >= date('now', ?)
+            GROUP BY stage
+            ORDER BY SUM(total_tokens) DESC
+        ''', (f"-{days - 1} days",))
+
+        keys = (
+            "stage", "calls", "prompt_tokens", "output_tokens", "cached_tokens", "total_tokens", "latency_ms", "cost_usd"
+        )
+        rows = [dict(zip(keys, row)) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    # ==================== JOB FUNCTIONS ====================
+
+    def claim_job(self, update_id: int, user_id: int, payload: str, now: float, lease_until: float,
+                  max_attempts: int) -> Optional[tuple]:
+        """
+        Lease a job: create it, or take over a pending one whose lease expired.
+
+        Returns:
+            (partial JSON, attempts) if claimed, None if the job is finished,
+            leased elsewhere or out of attempts
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT OR IGNORE INTO jobs (update_id, user_id, payload, attempts, locked_until, created_at, updated_at)
+            VALUES (?, ?, ?, 1, ?, ?, ?)
+        ''', (update_id, user_id, payload, lease_until, now, now))
+
+        if cursor.rowcount:
+            conn.commit()
+            conn.close()
+            return "{}", 1
+
+        # Existing job: only one worker can win this update
+        cursor.execute('''
+            UPDATE jobs SET attempts = attempts + 1, locked_until = ?, updated_at = ?
+            WHERE update_id = ? AND state = 'pending' AND locked_until < ? AND attempts < ?
+        ''', (lease_until, now, update_id, now, max_attempts))
+
+        result = None
+        if cursor.rowcount:
+            cursor.execute('SELECT partial, attempts FROM jobs WHERE update_id = ?', (update_id,))
+            result = cursor.fetchone()
+
+        conn.commit()
+        conn.close()
+        return result
+
+    def record_job(self, update_id: int, user_id: int, payload: str, now: float):
+        """Store an update as a pending, unleased job (e.g. received but not started)"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO jobs (update_id, user_id, payload, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (update_id, user_id, payload, now, now))
+        conn.commit()
+        conn.close()
+
+    def save_job(self, user_id: int, update_id: int, partial: str, now: float, lease_until: float):
+        """Store stage results and extend the lease"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE jobs SET partial = ?, locked_until = ?, updated_at = ?
+            WHERE update_id = ?
+        ''', (partial, lease_until, now, update_id))
+        conn.commit()
+        conn.close()
+
+    def finish_job(self, user_id: int, update_id: int, state: str, now: float):
+        """Mark a job done or failed"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE jobs SET state = ?, locked_until = 0, updated_at = ?
+            WHERE update_id = ?
+        ''', (state, now, update_id))
+        conn.commit()
+        conn.close()
+
+    def release_job(self, user_id: int, update_id: int):
+        """Give up the lease so another worker can resume the job right away"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('UPDATE jobs SET locked_until = 0 WHERE update_id = ?', (update_id,))
+        conn.commit()
+        conn.close()
+
+    def get_resumable_jobs(self, now: float, created_after: float, max_attempts: int, limit: int = 100) -> list:
+        """
+        Payloads of pending jobs whose lease expired, oldest first.
+        Also expires jobs too old to answer, fails jobs out of attempts and
+        deletes finished jobs after a day.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE jobs SET state = CASE WHEN created_at < ? THEN 'expired' ELSE 'failed' END, updated_at = ?
+            WHERE state = 'pending' AND locked_until < ? AND (created_at < ? OR attempts >= ?)
+        ''', (created_after, now, now, created_after, max_attempts))
+        cursor.execute('''
+            DELETE FROM jobs WHERE state != 'pending' AND updated_at < ?
+        ''', (now - 86400,))
+
+        cursor.execute('''
+            SELECT payload FROM jobs
+            WHERE state = 'pending' AND locked_until < ?
+            ORDER BY update_id
+            LIMIT ?
+        ''', (now, limit))
+        payloads = [row[0] for row in cursor.fetchall()]
+
+        conn.commit()
+        conn.close()
+        return payloads
+
+
+class ShardedStorage:
+    """
+    Users spread over several SQLite files by user_id, so writes for
+    different users do not queue behind one writer lock. Suggestions are
+    placed by their id. The shard count must not change once data exists.
+
+    `single_file` is the database used before switching STORAGE_BACKEND to
+    sharded. While every shard is still empty, its rows are copied over once,
+    so users keep their language and history. The file itself is left as is.
+    """
+
+    def __init__(self, shards: list, single_file: SQLiteStorage = None):
+        self.shards = shards
+        self.single_file = single_file
+
+    def files(self) -> list:
+        return [path for shard in self.shards for path in shard.files()]
+
+    def _user(self, user_id: int) -> SQLiteStorage:
+        return self.shards[user_shard(user_id, len(self.shards))]
+
+    def _key(self, key: str) -> SQLiteStorage:
+        return self.shards[key_shard(key, len(self.shards))]
+
+    def init_schema(self):
+        for shard in self.shards:
+            shard.init_schema()
+        if self.single_file and os.path.exists(self.single_file.path):
+            self._copy_single_file()
+
+    def _copy_single_file(self):
+        if not self.single_file.has_users() or any(shard.has_users() for shard in self.shards):
+            return
+        # Same schema version as the shards, so SELECT * lines up column for column
+        self.single_file.init_schema()
+        logger.info(f"📦 Copying {self.single_file.path} into {len(self.shards)} empty shards...")
+        users = sum(
+            shard.copy_shard(self.single_file.path, index, len(self.shards))
+            for index, shard in enumerate(self.shards)
+        )
+        logger.info(f"📦 Copied {users} users from {self.single_file.path}; the file can be removed once checked")
+
+    # ==================== USER FUNCTIONS ====================
+
+    def get_user_language(self, user_id: int) -> Optional[str]:
+        return self._user(user_id).get_user_language(user_id)
+
+    def set_user_language(self, user_id: int, language: str, first_name: str = None, username: str = None):
+        self._user(user_id).set_user_language(user_id, language, first_name, username)
+
+    def user_exists(self, user_id: int) -> bool:
+        return self._user(user_id).user_exists(user_id)
+
+    # ==================== MEMORY FUNCTIONS ====================
+
+    def add_message(self, user_id: int, role: str, content: str):
+        self._user(user_id).add_message(user_id, role, content)
+
+    def get_conversation_history(self, user_id: int, limit: int = None) -> list:
+        return self._user(user_id).get_conversation_history(user_id, limit)
+
+    def get_messages_since(self, user_id: int, after_id: int = 0, limit: int = None) -> list:
+        return self._user(user_id).get_messages_since(user_id, after_id, limit)
+
+    def get_history_summary(self, user_id: int) -> tuple:
+        return self._user(user_id).get_history_summary(user_id)
+
+    def set_history_summary(self, user_id: int, summary: str, last_message_id: int):
+        self._user(user_id).set_history_summary(user_id, summary, last_message_id)
+
+    def clear_user_history(self, user_id: int):
+        self._user(user_id).clear_user_history(user_id)
+
+    # ==================== SUGGESTION FUNCTIONS ====================
+
+    def store_suggestion(self, suggestion_id: str, text: str):
+        self._key(suggestion_id).store_suggestion(suggestion_id, text)
+
+    def get_suggestion(self, suggestion_id: str) -> Optional[str]:
+        return self._key(suggestion_id).get_suggestion(suggestion_id)
+
+    # ==================== USAGE FUNCTIONS ====================
+
+    def add_token_usage(self, rows: list):
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(user_shard(row[1], len(self.shards)), []).append(row)
+        for index, shard_rows in by_shard.items():
+            self.shards[index].add_token_usage(shard_rows)
+
+    def get_token_usage_by_stage(self, days: int = 1) -> list:
+        totals = {}
+        for shard in self.shards:
+            for row in shard.get_token_usage_by_stage(days):
+                merged = totals.setdefault(row["stage"], dict.fromkeys(row, 0))
+                merged["stage"] = row["stage"]
+                for key, value in row.items():
+                    if key != "stage":
+                        merged[key] += value or 0
+        return sorted(totals.values(), key=lambda row: row["total_tokens"], reverse=True)
+
+    # ==================== JOB FUNCTIONS ====================
+
+    def claim_job(self, update_id: int, user_id: int, payload: str, now: float, lease_until: float,
+                  max_attempts: int) -> Optional[tuple]:
+        return self._user(user_id).claim_job(update_id, user_id, payload, now, lease_until, max_attempts)
+
+    def record_job(self, update_id: int, user_id: int, payload: str, now: float):
+        self._user(user_id).record_job(update_id, user_id, payload, now)
+
+    def save_job(self, user_id: int, update_id: int, partial: str, now: float, lease_until: float):
+        self._user(user_id).save_job(user_id, update_id, partial, now, lease_until)
+
+    def finish_job(self, user_id: int, update_id: int, state: str, now: float):
+        self._user(user_id).finish_job(user_id, update_id, state, now)
+
+    def release_job(self, user_id: int, update_id: int):
+        self._user(user_id).release_job(user_id, update_id)
+
+    def get_resumable_jobs(self, now: float, created_after: float, max_attempts: int, limit: int = 100) -> list:
+        payloads = []
+        for shard in self.shards:
+            payloads.extend(shard.get_resumable_jobs(now, created_after, max_attempts, limit))
+        # Oldest first across shards too, so a user's updates resume in order
+        payloads.sort(key=lambda payload: json.loads(payload)["update_id"])
+        return payloads[:limit]
+
+
+def create_storage(backend: str, path: str, shard_count: int = 1):
+    """Build the configured backend ("sqlite" or "sharded")"""
+    if backend == "sqlite":
+        return SQLiteStorage(path)
+    if backend == "sharded":
+        stem, dot, extension = path.rpartition(".")
+        if not dot:
+            stem, extension = path, "db"
+        return ShardedStorage(
+            [SQLiteStorage(f"{stem}.shard{i}.{extension}") for i in range(shard_count)],
+            single_file=SQLiteStorage(path)
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,157 @@
+# Per-update tracing of handler pipeline stages
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .config import TRACE_FILE, logger
+from .metrics import counter, histogram
+
+stage_seconds = histogram(
+    "pipeline_stage_seconds", "Time spent in each pipeline stage", ("stage", "language", "modality")
+)
+update_seconds = histogram(
+    "pipeline_update_seconds", "End-to-end handling time per update", ("language", "modality")
+)
+pipeline_errors = counter("pipeline_errors_total", "Updates whose handler failed with an exception", ("modality",))
+
+_current = contextvars.ContextVar("current_trace", default=None)
+
+_trace_file = None
+_trace_file_lock = threading.Lock()
+
+ACTIVITY_WINDOW = 3600  # Seconds of finished updates kept for live rates
+_recent_updates = deque()  # (finished_at, user_id)
+_activity_lock = threading.Lock()
+
+
+class Trace:
+    """Spans recorded while handling one update"""
+
+    def __init__(self, update_id, user_id, modality: str, language: str = ""):
+        self.update_id = update_id
+        self.user_id = user_id
+        self.modality = modality
+        self.language = language
+        self.started = time.time()
+        self._started_monotonic = time.monotonic()
+        self.spans = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started_monotonic
+
+    def to_dict(self) -> dict:
+        return {
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "language": self.language,
+            "modality": self.modality,
+            "start": self.started,
+            "duration": round(self.elapsed(), 4),
+            "spans": self.spans
+        }
+
+
+def current_trace() -> Trace | None:
+    """Trace of the update being handled in this context, if any"""
+    return _current.get()
+
+
+def annotate(**fields):
+    """Set fields (e.g. language) on the current trace"""
+    trace = _current.get()
+    if trace:
+        for key, value in fields.items():
+            setattr(trace, key, value)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage and attribute it to the current trace"""
+    trace = _current.get()
+    started = time.monotonic()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        duration = time.monotonic() - started
+        language = trace.language if trace else ""
+        modality = trace.modality if trace else ""
+        stage_seconds.observe(duration, stage=stage, language=language, modality=modality)
+        if trace:
+            trace.spans.append({
+                "stage": stage,
+                "offset": round(started - trace._started_monotonic, 4),
+                "duration": round(duration, 4),
+                "error": error
+            })
+
+
+@contextmanager
+def trace(update_id, user_id, modality: str, language: str = ""):
+    """Start a trace for one update; spans recorded inside belong to it"""
+    current = Trace(update_id, user_id, modality, language)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        update_seconds.observe(current.elapsed(), language=current.language, modality=modality)
+        if modality != "speculative":
+            _record_activity(current.user_id)
+        if TRACE_FILE:
+            _export(current)
+
+
+def traced(modality: str):
+    """Decorator for update handlers: trace the whole handler call"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            user = update.effective_user
+            with trace(update.update_id, user.id if user else None, modality):
+                return await handler(update, context)
+        return wrapper
+    return decorator
+
+
+def _record_activity(user_id):
+    now = time.monotonic()
+    with _activity_lock:
+        _recent_updates.append((now, user_id))
+        while _recent_updates and now - _recent_updates[0][0] > ACTIVITY_WINDOW:
+            _recent_updates.popleft()
+
+
+def recent_activity(window: int = 300) -> tuple:
+    """(updates handled, distinct users) over the last `window` seconds"""
+    cutoff = time.monotonic() - window
+    with _activity_lock:
+        recent = [user_id for finished_at, user_id in _recent_updates if finished_at >= cutoff]
+    return len(recent), len(set(recent))
+
+
+def _export(finished: Trace):
+    """Append a finished trace to TRACE_FILE as one JSON line"""
+    global _trace_file
+    try:
+        line = json.dumps(finished.to_dict(), ensure_ascii=False)
+        with _trace_file_lock:
+            if _trace_file is None:
+                _trace_file = open(TRACE_FILE, "a", encoding="utf-8")
+            _trace_file.write(line + "\n")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not export trace: {e}")
+
+
+def flush_traces():
+    """Flush buffered trace lines to disk"""
+    with _trace_file_lock:
+        if _trace_file is not None:
+            _trace_file.flush()
@@ -0,0 +1,43 @@
+# Concurrent update handling that keeps each chat's updates in order
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles up to `max_concurrent_updates` updates at once, so one slow model
+    call no longer holds up every other doctor (and concurrent MedGemma
+    calls can be batched). Updates from the same chat still run one after
+    another in arrival order, so a follow-up sees the previous answer in
+    its history. Updates waiting for their chat count against the limit.
+    """
+
+    __slots__ = ("_chats",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}  # chat_id -> [lock, updates holding or waiting for it]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+
+        entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+
+    async def initialize(self) -> None:
+        """Nothing to set up"""
+
+    async def shutdown(self) -> None:
+        """Nothing to release"""
@@ -0,0 +1,97 @@
+# Token usage and cost accounting from Gemini usageMetadata
+import threading
+import time
+from datetime import datetime, timezone
+
+from .config import GEMINI_MODEL, USAGE_FLUSH_INTERVAL, logger
+from .database import add_token_usage
+from .metrics import counter
+from .tracing import current_trace
+
+tokens_total = counter("gemini_tokens_total", "Gemini tokens by stage and kind", ("stage", "kind"))
+cost_total = counter("gemini_cost_usd_total", "Gemini spend in USD at list prices, by stage", ("stage",))
+
+# USD per million tokens: (prompt, output, cached prompt). Text/image/video
+# list prices for prompts up to 200k tokens; output includes thinking tokens.
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00, 0.31),
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+    "gemini-2.0-flash": (0.10, 0.40, 0.025),
+    "gemini-2.0-flash-lite": (0.075, 0.30, 0.01875),
+}
+
+_lock = threading.Lock()
+_pending = {}  # (day, user_id, language, stage) -> [calls, prompt, output, cached, total, latency_ms, cost_usd]
+_last_flush = time.monotonic()
+
+if GEMINI_MODEL not in MODEL_PRICES:
+    logger.warning(f"⚠️ No prices for {GEMINI_MODEL}, token usage will be stored without cost")
+
+
+def usage_cost(usage: dict, model: str = GEMINI_MODEL) -> float:
+    """USD for one call; cached prompt tokens are billed at the cached rate, thinking tokens as output"""
+    prompt_price, output_price, cached_price = MODEL_PRICES.get(model, (0, 0, 0))
+    prompt = usage.get("prompt_tokens", 0)
+    cached = usage.get("cached_tokens", 0)
+    # totalTokenCount also counts thinking tokens, which candidatesTokenCount leaves out
+    output = max(usage.get("output_tokens", 0), usage.get("total_tokens", 0) - prompt)
+    return ((prompt - cached) * prompt_price + cached * cached_price + output * output_price) / 1_000_000
+
+
+def record_usage(stage: str, usage: dict, latency: float):
+    """
+    Account one Gemini call. The user and language come from the update
+    being traced. Rows are aggregated in memory and written to the
+    token_usage rollup table every USAGE_FLUSH_INTERVAL seconds.
+    """
+    global _last_flush
+
+    for kind in ("prompt_tokens", "output_tokens", "cached_tokens"):
+        if usage.get(kind):
+            tokens_total.inc(usage[kind], stage=stage, kind=kind.replace("_tokens", ""))
+
+    cost = usage_cost(usage)
+    if cost:
+        cost_total.inc(cost, stage=stage)
+
+    trace = current_trace()
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    key = (day, trace.user_id if trace else None, trace.language if trace else "", stage)
+
+    with _lock:
+        row = _pending.setdefault(key, [0, 0, 0, 0, 0, 0, 0.0])
+        row[0] += 1
+        row[1] += usage.get("prompt_tokens", 0)
+        row[2] += usage.get("output_tokens", 0)
+        row[3] += usage.get("cached_tokens", 0)
+        row[4] += usage.get("total_tokens", 0)
+        row[5] += int(latency * 1000)
+        row[6] += cost
+        due = time.monotonic() - _last_flush >= USAGE_FLUSH_INTERVAL
+
+    if due:
+        flush_usage()
+
+
+def flush_usage():
+    """Write aggregated usage to the database; on failure the rows are kept for the next flush"""
+    global _last_flush
+
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    if not pending:
+        return
+    try:
+        add_token_usage([key + tuple(values) for key, values in pending.items()])
+    except Exception as e:
+        logger.error(f"❌ Could not store token usage, retrying at the next flush: {e}")
+        # Merge back, adding to anything recorded since
+        with _lock:
+            for key, values in pending.items():
+                row = _pending.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    row[i] += value
@@ -0,0 +1,139 @@
+# Worker pool for CPU-bound stages, so they stay off the event loop
+import asyncio
+import base64
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from .config import CONCURRENT_UPDATES, CPU_POOL, CPU_WORKERS, CPU_QUEUE_SIZE, DB_WORKERS, IO_WORKERS, logger
+from .metrics import counter, gauge, histogram
+
+cpu_tasks = counter("cpu_pool_tasks_total", "CPU pool tasks by function", ("function",))
+cpu_waiting = gauge("cpu_pool_waiting", "Callers waiting for a free CPU pool slot")
+cpu_wait_seconds = histogram(
+    "cpu_pool_wait_seconds", "Time spent waiting for a CPU pool slot",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+cpu_seconds = histogram(
+    "cpu_pool_task_seconds", "CPU pool task duration, including hand-off to the worker", ("function",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+
+# ==================== TASKS ====================
+# Module-level so a process pool can pickle them
+
+def encode_base64(data: bytes) -> str:
+    """Base64 for inline image/audio parts"""
+    return base64.b64encode(data).decode("utf-8")
+
+
+# ==================== POOL ====================
+
+class CPUPool:
+    """
+    Runs CPU-bound functions on "thread" or "process" workers (or "inline"
+    on the calling thread).
+
+    At most `workers + queue_size` tasks are submitted at once; further
+    callers wait for a slot, so a burst of images queues in the pipelines
+    instead of piling up bytes in the executor. Threads share the GIL,
+    so they keep the loop responsive but do not add cores. Processes do,
+    at the cost of copying arguments and results between processes, which
+    only pays off for work heavier than the copy.
+    """
+
+    def __init__(self, mode: str = "thread", workers: int = 0, queue_size: int = 16):
+        if mode not in ("inline", "thread", "process"):
+            raise ValueError(f"Unknown CPU pool mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self._executor: Executor | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                # Imported here: multiprocessing is only needed in process mode
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # Spawned, not forked: the parent has an event loop and threads running
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu")
+            logger.info(f"⚙️ CPU pool started ({self.mode}, {self.workers} workers, queue {self.queue_size})")
+        return self._executor
+
+    async def run(self, function, *args):
+        """Run `function(*args)` on the pool, waiting for a slot if it is full"""
+        if self.mode == "inline":
+            return function(*args)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+        waited = time.monotonic()
+        cpu_waiting.inc()
+        try:
+            await self._slots.acquire()
+        finally:
+            cpu_waiting.dec()
+        cpu_wait_seconds.observe(time.monotonic() - waited)
+
+        try:
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), function, *args)
+            cpu_tasks.inc(function=function.__name__)
+            cpu_seconds.observe(time.monotonic() - started, function=function.__name__)
+            return result
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """Stop the workers; running tasks finish, queued ones are cancelled"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+cpu_pool = CPUPool(CPU_POOL, CPU_WORKERS, CPU_QUEUE_SIZE)
+
+
+# ==================== I/O THREADS ====================
+# Blocking model calls go through asyncio.to_thread, i.e. the loop's default
+# executor. Its stock size is min(32, CPUs + 4), five threads on one core,
+# which would cap CONCURRENT_UPDATES at five. Short SQLite calls get their
+# own threads so they never queue behind 60-120 s model calls.
+
+_db_executor: ThreadPoolExecutor | None = None
+
+
+def install_io_executor():
+    """Give the running loop a default executor with a thread for every concurrent update"""
+    workers = IO_WORKERS or CONCURRENT_UPDATES + 4
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(workers, thread_name_prefix="io"))
+    logger.info(f"⚙️ I/O threads: {workers} for model calls, {DB_WORKERS} for the database")
+
+
+async def run_db(function, *args):
+    """Run a short SQLite call on the database threads (with the caller's context, like asyncio.to_thread)"""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(DB_WORKERS, thread_name_prefix="db")
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _db_executor, functools.partial(context.run, function, *args)
+    )
+
+
+def shutdown_db():
+    """Stop the database threads once nothing writes any more"""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
@@ -0,0 +1,268 @@
+"""
+Micro-benchmarks for app/database.py as the tables grow.
+
+The database is filled up to each size in turn, then every storage function is
+timed on its own and under concurrent writer threads (throughput, latency and
+"database is locked" failures). Results can be saved as a baseline and later
+runs compared against it:
+
+    python -m benchmarks.db_bench --sizes 10000,100000,1000000 --save before.json
+    python -m benchmarks.db_bench --sizes 10000,100000,1000000 --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+CONTENT = (
+    "Patient with fever for three days, dry cough and mild shortness of breath. "
+    "SpO2 95%, no chest pain. Started paracetamol, considering a chest X-ray. "
+)
+
+
+def _summarize(latencies: list) -> dict:
+    """Latency summary in milliseconds"""
+    if not latencies:
+        return {"count": 0}
+    values = sorted(latencies)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 3),
+        "p50_ms": round(pick(0.5), 3),
+        "p95_ms": round(pick(0.95), 3),
+        "p99_ms": round(pick(0.99), 3)
+    }
+
+
+# ==================== FILLING ====================
+
+def fill(files: list, start: int, target: int, users: int, suggestions_per_message: float, epoch: float):
+    """
+    Bulk-insert messages (spread over users, in time order) and suggestions up
+    to `target` messages, routing rows to shards the way the storage does
+    """
+    from app.storage import key_shard, user_shard
+
+    def timestamp(seconds):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+    shard_count = len(files)
+    # Suggestions from the last day stay in the table until the 24h cleanup removes them
+    recent = time.time() - 12 * 3600
+    suggestion_range = range(int(start * suggestions_per_message), int(target * suggestions_per_message))
+
+    for shard, database_file in enumerate(files):
+        conn = sqlite3.connect(database_file)
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, language, first_name) VALUES (?, ?, ?)",
+            (
+                (user_id, random.choice(("uz", "ru", "en")), f"Doctor{user_id}")
+                for user_id in range(1, users + 1) if user_shard(user_id, shard_count) == shard
+            )
+        )
+        conn.executemany(
+            "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            (
+                (i % users + 1, "user" if i % 2 == 0 else "assistant", CONTENT, timestamp(epoch + i * 2))
+                for i in range(start, target) if user_shard(i % users + 1, shard_count) == shard
+            )
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO suggestions (suggestion_id, text, created_at) VALUES (?, ?, ?)",
+            (
+                (f"{i:012x}", "Which tests should I order?", timestamp(recent + i % 40000))
+                for i in suggestion_range if key_shard(f"{i:012x}", shard_count) == shard
+            )
+        )
+        conn.commit()
+        conn.close()
+
+
+# ==================== MEASUREMENT ====================
+
+def single_threaded(database, users: int, ops: int, rng: random.Random) -> dict:
+    """Time each storage function in isolation"""
+    def user():
+        return rng.randint(1, users)
+
+    cases = {
+        "add_message": lambda: database.add_message(user(), "user", CONTENT),
+        "get_conversation_history": lambda: database.get_conversation_history(user()),
+        "get_messages_since": lambda: database.get_messages_since(user()),
+        "store_suggestion": lambda: database.store_suggestion(f"bench{rng.getrandbits(48):012x}", "Red flags?"),
+        "get_suggestion": lambda: database.get_suggestion(f"{rng.randrange(users):012x}"),
+        "get_user_language": lambda: database.get_user_language(user()),
+        "set_user_language": lambda: database.set_user_language(user(), "en")
+    }
+
+    results = {}
+    for name, call in cases.items():
+        latencies = []
+        for _ in range(ops):
+            started = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - started)
+        results[name] = _summarize(latencies)
+    return results
+
+
+def concurrent_writers(database, users: int, writers: int, ops: int) -> dict:
+    """Writer threads each storing a turn (two messages plus a suggestion) per op"""
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def writer(seed):
+        rng = random.Random(seed)
+        mine, errors = [], 0
+        for _ in range(ops):
+            user_id = rng.randint(1, users)
+            started = time.perf_counter()
+            try:
+                database.add_message(user_id, "user", CONTENT)
+                database.add_message(user_id, "assistant", CONTENT)
+                database.store_suggestion(f"bench{rng.getrandbits(48):012x}", "Red flags?")
+            except sqlite3.OperationalError:
+                errors += 1  # "database is locked" after the busy timeout
+                continue
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+            failures.append(errors)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "writers": writers,
+        "turns_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "locked_failures": sum(failures),
+        **_summarize(latencies)
+    }
+
+
+# ==================== REPORTING ====================
+
+def compare(current: dict, baseline: dict):
+    """Print p50/p95 changes against a saved baseline"""
+    print("\nChange vs baseline (negative = faster):")
+    for size, result in current["sizes"].items():
+        previous = baseline.get("sizes", {}).get(size)
+        if not previous:
+            print(f"  {size} rows: no baseline")
+            continue
+        for name, row in result["functions"].items():
+            old = previous["functions"].get(name)
+            if not old or not old.get("p50_ms"):
+                continue
+            deltas = [
+                f"{key[:-3]} {(row[key] - old[key]) / old[key]:+.0%}"
+                for key in ("p50_ms", "p95_ms") if old.get(key)
+            ]
+            print(f"  {size:>9} {name:<26} " + ", ".join(deltas))
+        for row in result["concurrent"]:
+            old = next((r for r in previous["concurrent"] if r["writers"] == row["writers"]), None)
+            if old and old.get("turns_per_second"):
+                change = (row["turns_per_second"] - old["turns_per_second"]) / old["turns_per_second"]
+                print(f"  {size:>9} {'writers=' + str(row['writers']):<26} throughput {change:+.0%}")
+
+
+def print_result(size: int, result: dict):
+    print(f"\n=== {size} messages ({result['database_mb']:.1f} MB) ===")
+    print(f"{'function':<26} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, row in result["functions"].items():
+        print(f"{name:<26} " + " ".join(f"{row[key]:>7.2f}ms" for key in ("mean_ms", "p50_ms", "p95_ms", "p99_ms")))
+    print(f"\n{'writers':<8} {'turns/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'locked':>7}")
+    for row in result["concurrent"]:
+        print(f"{row['writers']:<8} {row['turns_per_second']:>9.1f} " + " ".join(
+            f"{row.get(key, 0):>7.2f}ms" for key in ("p50_ms", "p95_ms", "p99_ms")
+        ) + f" {row['locked_failures']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app/database.py as tables grow")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Message row counts to measure at")
+    parser.add_argument("--messages-per-user", type=int, default=28,
+                        help="Rows per user (the trim keeps MAX_MEMORY_MESSAGES * 2)")
+    parser.add_argument("--suggestions-per-message", type=float, default=1.0,
+                        help="Suggestion rows per message row")
+    parser.add_argument("--writers", default="1,4,8", help="Concurrent writer thread counts")
+    parser.add_argument("--ops", type=int, default=200, help="Calls per function / turns per writer")
+    parser.add_argument("--database", help="Database file to grow (default: a temporary file)")
+    parser.add_argument("--backend", choices=("sqlite", "sharded"), help="STORAGE_BACKEND to benchmark")
+    parser.add_argument("--shards", type=int, help="STORAGE_SHARDS for the sharded backend")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare against results saved with --save")
+    args = parser.parse_args()
+
+    tmp = None
+    if not args.database:
+        tmp = tempfile.TemporaryDirectory()
+        args.database = os.path.join(tmp.name, "bench.db")
+    os.environ["DATABASE_FILE"] = args.database
+    if args.backend:
+        os.environ["STORAGE_BACKEND"] = args.backend
+    if args.shards:
+        os.environ["STORAGE_SHARDS"] = str(args.shards)
+
+    # Imported only now: app.config reads the storage settings at import time
+    import logging
+    from app import database
+    logging.getLogger().setLevel(logging.WARNING)
+
+    database.init_database()
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+
+    report = {"config": {k: v for k, v in vars(args).items() if k not in ("save", "compare")}, "sizes": {}}
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    epoch = time.time() - sizes[-1] * 2  # Distinct, increasing timestamps ending around now
+    filled = 0
+    try:
+        for size in sizes:
+            users = max(1, size // args.messages_per_user)
+            started = time.perf_counter()
+            fill(database.database_files(), filled, size, users, args.suggestions_per_message, epoch)
+            filled = size
+            print(f"Filled to {size} messages / {users} users in {time.perf_counter() - started:.1f}s")
+
+            result = {
+                "users": users,
+                "functions": single_threaded(database, users, args.ops, rng),
+                "concurrent": [
+                    concurrent_writers(database, users, int(w), args.ops) for w in args.writers.split(",")
+                ],
+                "database_mb": round(sum(map(os.path.getsize, database.database_files())) / 1024 / 1024, 1)
+            }
+            report["sizes"][str(size)] = result
+            print_result(size, result)
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
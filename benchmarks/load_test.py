@@ -0,0 +1,332 @@
+"""
+Offline load test: replay synthetic doctor conversations through the real
+handlers against local stub APIs (see stubs.py), then report throughput,
+end-to-end latency percentiles and peak memory.
+
+Updates go through the application's update queue and update processor,
+so CONCURRENT_UPDATES (--concurrent-updates) limits them as in production.
+
+    python -m benchmarks.load_test --users 50 --turns 8 --gemini-latency 1.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+from . import stubs
+
+QUESTIONS = {
+    "en": [
+        "58-year-old man with chest pain radiating to the left arm for 30 minutes. Next steps?",
+        "Child, 4 years, fever 39.5 for two days and a rash on the trunk. Differential?",
+        "What is the first-line treatment for newly diagnosed type 2 diabetes?",
+        "Pregnant woman at 32 weeks with headache and BP 160/100. What should I do?"
+    ],
+    "ru": [
+        "Мужчина 58 лет, боль в груди с иррадиацией в левую руку 30 минут. Тактика?",
+        "Ребёнок 4 лет, температура 39,5 два дня и сыпь на туловище. Дифференциальный диагноз?",
+        "Какая терапия первой линии при впервые выявленном сахарном диабете 2 типа?"
+    ],
+    "uz": [
+        "58 yoshli erkak, chap qo'lga tarqaluvchi ko'krak og'rig'i 30 daqiqadan beri. Keyingi qadamlar?",
+        "4 yoshli bola, ikki kundan beri harorat 39,5 va tanada toshma. Differensial tashxis?",
+        "Yangi aniqlangan 2-tur qandli diabetda birinchi qator davolash qanday?"
+    ]
+}
+
+MODALITIES = ("text", "voice", "image", "button")
+
+
+def _parse_mix(value: str) -> dict:
+    """'text=5,voice=2' -> weight per modality (unlisted ones get 0)"""
+    weights = dict.fromkeys(MODALITIES, 0.0)
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in weights:
+            raise argparse.ArgumentTypeError(f"unknown modality: {name}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# ==================== STUB SERVER ====================
+
+def start_stubs(args) -> tuple:
+    """Run the stub APIs in a child process so they do not skew our memory numbers"""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=stubs.serve,
+        args=(stubs.profiles_from_args(args), 0, args.answer_chars, sender),
+        daemon=True
+    )
+    process.start()
+    port = receiver.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+
+def _stub_get(base: str, path: str):
+    with urllib.request.urlopen(f"{base}{path}", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def configure_environment(stub_base: str, database_file: str, llm_backend: str = "gemini"):
+    """Point the bot at the stubs; must run before anything from app/ is imported"""
+    os.environ.update({
+        "LLM_BACKEND": llm_backend,
+        "TELEGRAM_TOKEN": "123456:BENCH",
+        "TELEGRAM_API_BASE": f"{stub_base}/bot",
+        "TELEGRAM_FILE_BASE": f"{stub_base}/file/bot",
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_BASE": f"{stub_base}/v1beta",
+        "MEDGEMMA_API_BASE": stub_base,
+        "MEDGEMMA_ACCESS_TOKEN": "bench",
+        "DATABASE_FILE": database_file,
+        "METRICS_PORT": "0"
+    })
+
+
+# ==================== SYNTHETIC UPDATES ====================
+
+class UpdateFactory:
+    """Builds Bot API update payloads for synthetic doctors"""
+
+    def __init__(self, rng: random.Random, voice_repeat: float):
+        self.rng = rng
+        self.voice_repeat = voice_repeat
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.voice_ids = []
+
+    def _message(self, user_id: int, **content) -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Doctor{user_id}"},
+            **content
+        }
+
+    def text(self, user_id: int, lang: str) -> dict:
+        message = self._message(user_id, text=self.rng.choice(QUESTIONS[lang]))
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def voice(self, user_id: int, lang: str) -> dict:
+        if self.voice_ids and self.rng.random() < self.voice_repeat:
+            file_id = self.rng.choice(self.voice_ids)  # Forwarded voice note
+        else:
+            file_id = f"voice-{len(self.voice_ids)}"
+            self.voice_ids.append(file_id)
+        voice = {"file_id": file_id, "file_unique_id": file_id, "duration": 12, "mime_type": "audio/ogg"}
+        return {"update_id": next(self.update_ids), "message": self._message(user_id, voice=voice)}
+
+    def image(self, user_id: int, lang: str) -> dict:
+        file_id = f"photo-{next(self.message_ids)}"
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+        caption = self.rng.choice(QUESTIONS[lang]) if self.rng.random() < 0.5 else None
+        message = self._message(user_id, photo=photo, **({"caption": caption} if caption else {}))
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def button(self, user_id: int, callback_data: str) -> dict:
+        message = self._message(user_id, text="Previous answer")
+        message["from"] = {"id": 1, "is_bot": True, "first_name": "Bench"}
+        callback = {
+            "id": str(next(self.message_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Doctor{user_id}"},
+            "chat_instance": str(user_id),
+            "data": callback_data,
+            "message": message
+        }
+        return {"update_id": next(self.update_ids), "callback_query": callback}
+
+
+# ==================== RUN ====================
+
+async def run_doctor(application, factory, stub_base, user_id, lang, args, results, handled):
+    """One doctor's conversation: each update is sent once the previous one was answered"""
+    from telegram import Update
+
+    modalities = list(args.mix)
+    weights = list(args.mix.values())
+    for _ in range(args.turns):
+        modality = factory.rng.choices(modalities, weights)[0]
+        if modality == "button":
+            buttons = await asyncio.to_thread(_stub_get, stub_base, f"/_keyboard?chat_id={user_id}")
+            payload = factory.button(user_id, factory.rng.choice(buttons)) if buttons else None
+            if payload is None:
+                modality, payload = "text", factory.text(user_id, lang)
+        else:
+            payload = getattr(factory, modality)(user_id, lang)
+
+        update = Update.de_json(payload, application.bot)
+        finished = asyncio.get_running_loop().create_future()
+        handled[update.update_id] = finished
+        started = time.perf_counter()
+        await application.update_queue.put(update)
+        await finished
+        results.append((modality, lang, time.perf_counter() - started))
+
+        if args.think:
+            await asyncio.sleep(factory.rng.expovariate(1 / args.think))
+
+
+async def run(args, stub_base: str) -> dict:
+    # Imported only now: app.config reads the environment at import time
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from bot import build_application
+    from app.database import init_database, set_user_language
+    from app.gemini_client import gemini_requests
+    from app.speculation import speculator
+    from app.tracing import pipeline_errors
+    from app.workers import install_io_executor
+
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    init_database()
+    rng = random.Random(args.seed)
+    languages = [lang.strip() for lang in args.languages.split(",")]
+    doctors = [(1000 + i, rng.choice(languages)) for i in range(args.users)]
+    for user_id, lang in doctors:
+        set_user_language(user_id, lang, f"Doctor{user_id}")
+
+    factory = UpdateFactory(rng, args.voice_repeat)
+    application = build_application()
+    results = []
+    handled = {}  # update_id -> future resolved once the handlers are done with it
+
+    async def mark_handled(update, context):
+        finished = handled.pop(update.update_id, None)
+        if finished is not None:
+            finished.set_result(None)
+
+    # Runs after the group 0 handler has finished with the update
+    application.add_handler(TypeHandler(Update, mark_handled), group=99)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    async with application:
+        # As bot.post_init does (run_polling is not used here)
+        install_io_executor()
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_doctor(application, factory, stub_base, user_id, lang, args, results, handled)
+            for user_id, lang in doctors
+        ))
+        elapsed = time.perf_counter() - started
+        await application.stop()
+        # Before the stubs go away; production does this in the post_shutdown hook
+        await asyncio.to_thread(speculator.cancel_all, True)
+
+    report = {
+        "config": {
+            **{k: v for k, v in vars(args).items() if k != "json"},
+            "concurrent_updates": application.update_processor.max_concurrent_updates
+        },
+        "updates": len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(len(results) / elapsed, 2) if elapsed else 0,
+        "latency": {},
+        "handler_errors": pipeline_errors.total(),
+        "gemini_status": {labels["status"]: 0 for labels, _ in gemini_requests.samples()},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stubs": await asyncio.to_thread(_stub_get, stub_base, "/_stats")
+    }
+    for labels, value in gemini_requests.samples():
+        report["gemini_status"][labels["status"]] += int(value)
+    if args.tracemalloc:
+        report["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+
+    groups = {"all": [r[2] for r in results]}
+    for name in MODALITIES + tuple(f"lang:{lang}" for lang in languages):
+        groups[name] = [seconds for modality, lang, seconds in results if name in (modality, f"lang:{lang}")]
+    for name, values in groups.items():
+        if not values:
+            continue
+        values.sort()
+        report["latency"][name] = {
+            "count": len(values),
+            **{f"p{int(q * 100)}": round(_percentile(values, q), 3) for q in (0.5, 0.9, 0.95, 0.99)},
+            "max": round(values[-1], 3)
+        }
+    return report
+
+
+def print_report(report: dict):
+    print(f"\nUpdates: {report['updates']} in {report['elapsed_seconds']:.1f}s "
+          f"({report['config']['concurrent_updates']} at once) "
+          f"-> {report['updates_per_second']:.2f} updates/s "
+          f"(handler errors: {report['handler_errors']:.0f})")
+    print(f"\n{'group':<10} {'count':>6} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, row in report["latency"].items():
+        print(f"{name:<10} {row['count']:>6} " + " ".join(
+            f"{row[key]:>7.2f}s" for key in ("p50", "p90", "p95", "p99", "max")
+        ))
+    memory = f"Peak RSS: {report['peak_rss_mb']:.1f} MB"
+    if "tracemalloc_peak_mb" in report:
+        memory += f" (Python heap peak: {report['tracemalloc_peak_mb']:.1f} MB)"
+    print(f"\n{memory}")
+    print(f"Gemini responses: {report['gemini_status']}")
+    print(f"Stub calls: {report['stubs']['calls']}")
+    if report["stubs"]["errors"]:
+        print(f"Injected errors: {report['stubs']['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the bot handlers")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent synthetic doctors")
+    parser.add_argument("--turns", type=int, default=5, help="Updates sent by each doctor")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("text=5,voice=2,image=1,button=2"),
+                        help="Modality weights, e.g. text=5,voice=2,image=1,button=2")
+    parser.add_argument("--languages", default="uz,ru,en", help="Languages doctors are assigned from")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean pause between a doctor's updates (s)")
+    parser.add_argument("--voice-repeat", type=float, default=0.1, help="Share of voice notes that are forwards")
+    parser.add_argument("--llm-backend", choices=("gemini", "medgemma"), default="gemini",
+                        help="Answer model (MEDGEMMA_BATCH_* env vars tune batching)")
+    parser.add_argument("--concurrent-updates", type=int,
+                        help="Override CONCURRENT_UPDATES (1 = one update at a time, like PTB's default)")
+    parser.add_argument("--answer-chars", type=int, default=0, help="Length of model answers (0 = canned)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="Also track the Python heap peak (slower)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Write the report to this file")
+    stubs.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    process, stub_base = start_stubs(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(stub_base, os.path.join(tmp, "bench.db"), args.llm_backend)
+        if args.concurrent_updates:
+            os.environ["CONCURRENT_UPDATES"] = str(args.concurrent_updates)
+        try:
+            report = asyncio.run(run(args, stub_base))
+        finally:
+            process.terminate()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# Local stand-ins for the Telegram Bot API, Gemini and the MedGemma predict endpoint
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class Profile:
+    """Latency and error behaviour of one stubbed backend"""
+    latency: float = 0.0  # Mean seconds per request
+    jitter: float = 0.0  # Standard deviation of the latency
+    error_rate: float = 0.0  # Fraction of requests answered with an error
+    concurrency: int = 0  # Requests served at once, others queue (0 = unlimited); models a dedicated GPU
+    _slots: threading.Semaphore = field(default=None, init=False, repr=False)
+
+    def delay(self):
+        if not (self.latency or self.jitter):
+            return
+        if self.concurrency and self._slots is None:
+            self._slots = threading.BoundedSemaphore(self.concurrency)
+        if self._slots is None:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+            return
+        with self._slots:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+ANSWER = (
+    "*Assessment*\n"
+    "The symptoms are most consistent with an uncomplicated viral infection.\n\n"
+    "*Recommendations*\n"
+    "- Check temperature and oxygen saturation twice a day\n"
+    "- Keep the patient well hydrated\n"
+    "- Reassess in 48 hours or earlier if breathing gets worse\n\n"
+    "_This is decision support, not a diagnosis._"
+)
+SUGGESTIONS = ["What are the red flags?", "Which tests should I order?"]
+TRANSCRIPT = "Patient reports fever for three days and a dry cough."
+
+# Small payloads served for getFile downloads
+VOICE_BYTES = b"OggS" + os.urandom(16 * 1024)
+IMAGE_BYTES = b"\xff\xd8\xff\xe0" + os.urandom(128 * 1024)
+
+
+class StubState:
+    """Request counters plus what the bot has shown each chat"""
+
+    def __init__(self, profiles: dict, answer_chars: int = 0):
+        self.profiles = profiles
+        self.answer = (ANSWER * (answer_chars // len(ANSWER) + 1))[:answer_chars] if answer_chars else ANSWER
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.errors = {}
+        self.keyboards = {}  # chat_id -> callback_data of the last inline keyboard
+        self.message_ids = {}
+
+    def count(self, key: str, error: bool = False, amount: int = 1):
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + amount
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def next_message_id(self, chat_id: int) -> int:
+        with self.lock:
+            self.message_ids[chat_id] = self.message_ids.get(chat_id, 1000) + 1
+            return self.message_ids[chat_id]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+
+# ==================== BACKENDS ====================
+
+def _telegram(state: StubState, method: str, params: dict):
+    """(status, body) for a Bot API method"""
+    profile = state.profiles["telegram"]
+    profile.delay()
+    if profile.fails():
+        state.count(f"telegram.{method}", error=True)
+        return 429, {
+            "ok": False, "error_code": 429,
+            "description": "Too Many Requests: retry after 1",
+            "parameters": {"retry_after": 1}
+        }
+    state.count(f"telegram.{method}")
+
+    chat_id = int(params.get("chat_id", 0) or 0)
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+    elif method == "getFile":
+        file_id = params.get("file_id", "")
+        kind = "voice" if file_id.startswith("voice") else "photos"
+        result = {"file_id": file_id, "file_unique_id": file_id, "file_path": f"{kind}/{file_id}"}
+    elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+        markup = json.loads(params.get("reply_markup") or "{}")
+        buttons = [b["callback_data"] for row in markup.get("inline_keyboard", []) for b in row if "callback_data" in b]
+        if buttons:
+            with state.lock:
+                state.keyboards[chat_id] = buttons
+        message_id = int(params.get("message_id") or state.next_message_id(chat_id))
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", "")
+        }
+    else:
+        # sendChatAction, deleteMessage, answerCallbackQuery, ...
+        result = True
+    return 200, {"ok": True, "result": result}
+
+
+def _gemini_text(payload: dict, answer: str) -> str:
+    """Canned response shaped like what the calling stage expects"""
+    config = payload.get("generationConfig", {})
+    if config.get("responseMimeType") == "application/json":
+        properties = config.get("responseSchema", {}).get("properties", {})
+        if "answer" in properties:
+            return json.dumps({"answer": answer, "suggestions": SUGGESTIONS})
+        return json.dumps({"suggestions": SUGGESTIONS})
+
+    parts = [part for content in payload.get("contents", []) for part in content.get("parts", [])]
+    if any(part.get("inline_data", {}).get("mime_type", "").startswith("audio/") for part in parts):
+        return TRANSCRIPT
+    if "systemInstruction" in payload or "cachedContent" in payload:
+        return answer
+    # Translation, summaries and plain-text suggestions
+    return parts[0].get("text", "")[-200:] if parts else ""
+
+
+def _gemini(state: StubState, path: str, payload: dict):
+    profile = state.profiles["gemini"]
+    if path.endswith("/cachedContents"):
+        state.count("gemini.cachedContents")
+        name = f"cachedContents/stub-{random.getrandbits(32):08x}"
+        expire = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+        return 200, {"name": name, "expireTime": expire}
+
+    profile.delay()
+    if profile.fails():
+        state.count("gemini.generateContent", error=True)
+        return 503, {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}}
+    state.count("gemini.generateContent")
+
+    text = _gemini_text(payload, state.answer)
+    prompt_tokens = sum(len(json.dumps(c)) for c in payload.get("contents", [])) // 4
+    output_tokens = len(text) // 4
+    return 200, {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens
+        }
+    }
+
+
+def _medgemma(state: StubState, payload: dict):
+    profile = state.profiles["medgemma"]
+    profile.delay()
+    if profile.fails():
+        state.count("medgemma.predict", error=True)
+        return 500, {"error": {"code": 500, "message": "Internal error", "status": "INTERNAL"}}
+    state.count("medgemma.predict")
+    instances = payload.get("instances", [])
+    state.count("medgemma.instances", amount=len(instances))
+    predictions = [{"choices": [{"message": {"role": "assistant", "content": state.answer}}]} for _ in instances]
+    return 200, {"predictions": predictions}
+
+
+# ==================== SERVER ====================
+
+def make_handler(state: StubState):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status: int, body, content_type: str = "application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> bytes:
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/_stats":
+                self._reply(200, state.snapshot())
+            elif url.path == "/_keyboard":
+                chat_id = int(parse_qs(url.query).get("chat_id", ["0"])[0])
+                with state.lock:
+                    self._reply(200, state.keyboards.pop(chat_id, []))
+            elif url.path.startswith("/file/bot"):
+                state.count("telegram.download")
+                state.profiles["telegram"].delay()
+                self._reply(200, VOICE_BYTES if "/voice/" in url.path else IMAGE_BYTES, "application/octet-stream")
+            else:
+                self._reply(404, {"ok": False, "description": "Not Found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            raw = self._body()
+            if path.startswith("/bot"):
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(raw or b"{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                self._reply(*_telegram(state, path.rsplit("/", 1)[-1], params))
+            elif path.startswith("/v1beta"):
+                self._reply(*_gemini(state, path, json.loads(raw or b"{}")))
+            elif path.endswith(":predict"):
+                self._reply(*_medgemma(state, json.loads(raw or b"{}")))
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(profiles: dict, port: int = 0, answer_chars: int = 0, ready=None):
+    """
+    Run the stub server until the process is stopped.
+    `ready` (a multiprocessing connection) receives the bound port.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(StubState(profiles, answer_chars)))
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    if ready is not None:
+        ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """--<backend>-latency/-jitter/-errors/-concurrency for every stubbed backend"""
+    defaults = {"telegram": (0.03, 0.01), "gemini": (0.8, 0.3), "medgemma": (1.5, 0.5)}
+    for backend, (latency, jitter) in defaults.items():
+        parser.add_argument(f"--{backend}-latency", type=float, default=latency, help=f"{backend} mean latency (s)")
+        parser.add_argument(f"--{backend}-jitter", type=float, default=jitter, help=f"{backend} latency std dev (s)")
+        parser.add_argument(f"--{backend}-errors", type=float, default=0.0, help=f"{backend} error rate (0-1)")
+        parser.add_argument(f"--{backend}-concurrency", type=int, default=0,
+                            help=f"{backend} requests served at once (0 = unlimited)")
+
+
+def profiles_from_args(args) -> dict:
+    return {
+        backend: Profile(
+            getattr(args, f"{backend}_latency"),
+            getattr(args, f"{backend}_jitter"),
+            getattr(args, f"{backend}_errors"),
+            getattr(args, f"{backend}_concurrency")
+        )
+        for backend in ("telegram", "gemini", "medgemma")
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve fake Telegram, Gemini and MedGemma APIs")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--answer-chars", type=int, default=0, help="Length of chat answers (0 = canned)")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    print(f"Stub APIs on http://127.0.0.1:{args.port}")
+    print(f"  TELEGRAM_API_BASE=http://127.0.0.1:{args.port}/bot")
+    print(f"  TELEGRAM_FILE_BASE=http://127.0.0.1:{args.port}/file/bot")
+    print(f"  GEMINI_API_BASE=http://127.0.0.1:{args.port}/v1beta")
+    print(f"  MEDGEMMA_API_BASE=http://127.0.0.1:{args.port}")
+    serve(profiles_from_args(args), args.port, args.answer_chars)
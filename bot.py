@@ -1,33 +1,52 @@
+# Imported first, so the cold-start report covers every other import
+from app import startup
+
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
 
-from app.config import TELEGRAM_TOKEN, PROJECT_ID, LOCATION, ENDPOINT_ID, logger
+from app.config import (
+    TELEGRAM_TOKEN, TELEGRAM_API_BASE, TELEGRAM_FILE_BASE, CONCURRENT_UPDATES,
+    PROJECT_ID, LOCATION, ENDPOINT_ID, METRICS_PORT, logger
+)
 from app.database import init_database
+from app.lifecycle import lifecycle
+from app.metrics import start_metrics_server
+from app.rate_limiter import OutboundRateLimiter
+from app.update_processor import ChatOrderedUpdateProcessor
+from app.workers import install_io_executor
 from app.handlers import (
     start, help_command, stats_command, language_command, clear_command,
     language_callback, suggestion_callback, handle_message, handle_image, handle_voice
 )
 
+startup.mark("imports")
+
+
+async def post_init(application: Application):
+    """Runs once the bot is initialized, right before polling starts"""
+    install_io_executor()
+    await lifecycle.start(application)
+    startup.mark("telegram")
+    logger.info(f"⏱️ {startup.report()}")
+
+
+def build_application() -> Application:
+    """Create the application with all handlers registered"""
+    # All outbound Bot API calls go through the rate limiter
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(TELEGRAM_API_BASE)
+        .base_file_url(TELEGRAM_FILE_BASE)
+        .rate_limiter(OutboundRateLimiter())
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(lifecycle.flush)
+        .build()
+    )
 
-def main():
-    """Start the bot"""
-
-    if not TELEGRAM_TOKEN:
-        raise ValueError("❌ TELEGRAM_TOKEN environment variable not set!")
-
-    # Initialize database
-    init_database()
-
-    logger.info("=" * 60)
-    logger.info("🚀 Starting MedGemma Telegram Bot for SinoAI")
-    logger.info("=" * 60)
-    logger.info(f"Project: {PROJECT_ID}")
-    logger.info(f"Region: {LOCATION}")
-    logger.info(f"Endpoint: {ENDPOINT_ID}")
-    logger.info("=" * 60)
-
-    # Create application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Drops updates still queued once the shutdown drain deadline has passed
+    application.add_handler(TypeHandler(Update, lifecycle.reject_after_deadline), group=-1)
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -57,12 +76,41 @@ def main():
         MessageHandler(filters.VOICE, handle_voice)
     )
 
+    return application
+
+
+def main():
+    """Start the bot"""
+
+    if not TELEGRAM_TOKEN:
+        raise ValueError("❌ TELEGRAM_TOKEN environment variable not set!")
+
+    # Initialize database
+    init_database()
+    startup.mark("database")
+
+    # Prometheus scrape endpoint for stage latency histograms and other metrics
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+        logger.info(f"📈 Metrics served on :{METRICS_PORT}/metrics")
+
+    logger.info("=" * 60)
+    logger.info("🚀 Starting MedGemma Telegram Bot for SinoAI")
+    logger.info("=" * 60)
+    logger.info(f"Project: {PROJECT_ID}")
+    logger.info(f"Region: {LOCATION}")
+    logger.info(f"Endpoint: {ENDPOINT_ID}")
+    logger.info("=" * 60)
+
+    application = build_application()
+
     # Start polling
     logger.info("✅ Bot is running! Doctors can now ask questions.")
     logger.info("Press Ctrl+C to stop the bot")
     logger.info("=" * 60)
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Stop signals are handled by the lifecycle, which drains in-flight updates first
+    application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
 
 
 if __name__ == "__main__":